@@ -0,0 +1,81 @@
+# Importação em lote de alunos a partir de um CSV e de uma pasta de fotos.
+#
+# Uso (a partir de backend/):
+#   python -m app.bulk_import alunos.csv fotos/ [--school-unit-id 3] [--processes 4] [--report resultado.csv]
+#
+# Colunas do CSV (cabeçalho obrigatório): name, matricula, turma, turno, idade,
+# e opcionalmente school_unit_id e photo (nome do arquivo na pasta de fotos).
+# Sem a coluna photo, procura <matricula>.jpg / .jpeg / .png na pasta.
+import argparse
+import csv
+import os
+import sys
+
+from app.services.database import init_db
+# services.enrollment (que importa face_recognition, carrega a galeria e monta os índices) só é
+# importado dentro de main(): os processos "spawn" do pool reimportam este módulo como __main__ e
+# devem carregar apenas services/embedding_worker.py.
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def _find_photo(photos_dir, row):
+    if row.get("photo"):
+        return os.path.join(photos_dir, row["photo"])
+    for extension in PHOTO_EXTENSIONS:
+        path = os.path.join(photos_dir, f"{row['matricula']}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_students(csv_path, photos_dir, default_school_unit_id=None):
+    students = []
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            row = {k.strip(): (v or '').strip() for k, v in row.items() if k}
+            photo_path = _find_photo(photos_dir, row) if row.get("matricula") else None
+            image_bytes = None
+            if photo_path and os.path.exists(photo_path):
+                with open(photo_path, 'rb') as photo:
+                    image_bytes = photo.read()
+            students.append({
+                "name": row.get("name"),
+                "matricula": row.get("matricula"),
+                "turma": row.get("turma"),
+                "turno": row.get("turno"),
+                "idade": row.get("idade"),
+                "school_unit_id": row.get("school_unit_id") or default_school_unit_id,
+                "image_bytes": image_bytes
+            })
+    return students
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa alunos em lote a partir de um CSV e de uma pasta de fotos.")
+    parser.add_argument("csv_path")
+    parser.add_argument("photos_dir")
+    parser.add_argument("--school-unit-id", type=int, default=None, help="Unidade escolar padrão para linhas sem school_unit_id")
+    parser.add_argument("--processes", type=int, default=None, help="Processos para gerar embeddings (padrão: BULK_ENROLL_PROCESSES; 0 = no próprio processo)")
+    parser.add_argument("--report", default=None, help="Grava o resultado por aluno neste CSV")
+    args = parser.parse_args(argv)
+
+    from app.services.enrollment import bulk_enroll_students, BULK_ENROLL_PROCESSES
+    processes = BULK_ENROLL_PROCESSES if args.processes is None else args.processes
+    init_db()
+    students = load_students(args.csv_path, args.photos_dir, args.school_unit_id)
+    print(f"{len(students)} alunos lidos de {args.csv_path}")
+    results = bulk_enroll_students(students, processes=processes)
+
+    failures = [r for r in results if r["status"] != "enrolled"]
+    for r in failures:
+        print(f"  Falha {r['matricula']}: {r['reason']}")
+    print(f"{len(results) - len(failures)} cadastrados, {len(failures)} falhas.")
+
+    if args.report:
+        with open(args.report, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=["matricula", "status", "reason"])
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"Relatório gravado em {args.report}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
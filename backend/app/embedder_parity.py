@@ -0,0 +1,137 @@
+# Checagem de paridade entre o backend ONNX e o DeepFace, usando as fotos dos alunos cadastrados.
+#
+# Uso (a partir de backend/):
+#   python -m app.embedder_parity [--quantized | --onnx-model caminho.onnx] [--limit 500]
+#                                 [--max-embedding-distance 0.02] [--min-agreement 0.99] [--output resultado.json]
+#
+# Para cada foto em IMG_SAVE_PATH (e variações: espelhada e escurecida, para gerar decisões menos
+# óbvias que a própria foto) o rosto é detectado uma vez e o mesmo recorte passa pelos dois backends.
+# Compara:
+#   - a distância de cosseno entre os dois embeddings do mesmo recorte;
+#   - a decisão de reconhecimento (matrícula ou "não reconhecido") contra a galeria cadastrada,
+#     com o mesmo RECOGNITION_DISTANCE_THRESHOLD usado em produção;
+#   - o tempo de embedding por rosto de cada backend.
+# Sai com código 1 se a concordância ficar abaixo de --min-agreement ou se algum embedding se afastar
+# mais que --max-embedding-distance; nesse caso recadastre a galeria com o backend novo antes de trocá-lo.
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from app.services.embedders import DeepFaceEmbedder, OnnxEmbedder, onnx_model_path
+from app.services.face_recognition import (
+    REGISTERED_STUDENTS_EMBEDDINGS, IMG_SAVE_PATH, RECOGNITION_DISTANCE_THRESHOLD
+)
+from app.services.vector_index import FlatIndex, l2_normalize
+
+def _variants(img):
+    yield "original", img
+    yield "flipped", img[:, ::-1].copy()
+    yield "dark", (img.astype(np.float32) * 0.6).astype(np.uint8)
+
+def _decision(index, embedding):
+    key, distance = index.search(embedding)
+    return (key if distance <= RECOGNITION_DISTANCE_THRESHOLD else None), distance
+
+def _timed_embed(embedder, faces, timings):
+    start = time.perf_counter()
+    embedding = embedder.embed(faces)[0]
+    timings.append(time.perf_counter() - start)
+    return embedding
+
+def run_parity(reference, candidate, records, limit=None):
+    index = FlatIndex()
+    index.build([rec["matricula"] for rec in records], [rec["embedding"] for rec in records])
+
+    distances = []
+    reference_times, candidate_times = [], []
+    probes = agreements = reference_correct = candidate_correct = 0
+    disagreements = []
+    images = 0
+    for rec in records[:limit] if limit else records:
+        img = cv2.imread(os.path.join(IMG_SAVE_PATH, rec["image_path"])) if rec.get("image_path") else None
+        if img is None:
+            continue
+        images += 1
+        for variant, probe_img in _variants(img):
+            faces = reference.detect(probe_img, enforce_detection=False)
+            if not faces:
+                continue
+            face = [faces[0]["face"]]
+            reference_embedding = l2_normalize(_timed_embed(reference, face, reference_times))
+            candidate_embedding = l2_normalize(_timed_embed(candidate, face, candidate_times))
+            distances.append(float(1.0 - reference_embedding @ candidate_embedding))
+
+            reference_match, reference_distance = _decision(index, reference_embedding)
+            candidate_match, candidate_distance = _decision(index, candidate_embedding)
+            probes += 1
+            reference_correct += reference_match == rec["matricula"]
+            candidate_correct += candidate_match == rec["matricula"]
+            if reference_match == candidate_match:
+                agreements += 1
+            else:
+                disagreements.append({
+                    "matricula": rec["matricula"], "variant": variant,
+                    "reference": reference_match, "reference_distance": round(reference_distance, 4),
+                    "candidate": candidate_match, "candidate_distance": round(candidate_distance, 4)
+                })
+
+    distances = np.asarray(distances or [0.0])
+    return {
+        "reference": reference.describe(),
+        "candidate": candidate.describe(),
+        "gallery_size": len(records),
+        "images": images,
+        "probes": probes,
+        "threshold": RECOGNITION_DISTANCE_THRESHOLD,
+        "embedding_distance": {
+            "mean": round(float(distances.mean()), 6),
+            "p99": round(float(np.percentile(distances, 99)), 6),
+            "max": round(float(distances.max()), 6)
+        },
+        "decision_agreement": round(agreements / probes, 4) if probes else None,
+        "reference_accuracy": round(reference_correct / probes, 4) if probes else None,
+        "candidate_accuracy": round(candidate_correct / probes, 4) if probes else None,
+        "reference_embed_ms": round(float(np.mean(reference_times)) * 1000.0, 3) if reference_times else None,
+        "candidate_embed_ms": round(float(np.mean(candidate_times)) * 1000.0, 3) if candidate_times else None,
+        "disagreements": disagreements
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara os embeddings e as decisões do backend ONNX com o DeepFace.")
+    parser.add_argument("--onnx-model", default=None, help="Modelo ONNX (padrão: ONNX_MODEL_DIR/arcface[.int8].onnx)")
+    parser.add_argument("--quantized", action="store_true", help="Usa o modelo int8 gerado com --quantize")
+    parser.add_argument("--limit", type=int, default=None, help="Número máximo de fotos de alunos")
+    parser.add_argument("--max-embedding-distance", type=float, default=0.02)
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--output", default=None, help="Grava o relatório JSON neste arquivo")
+    args = parser.parse_args(argv)
+
+    records = list(REGISTERED_STUDENTS_EMBEDDINGS)
+    if not records:
+        print("Nenhum aluno cadastrado: a paridade precisa das fotos e embeddings da galeria.")
+        return 1
+
+    candidate = OnnxEmbedder(model_path=args.onnx_model or onnx_model_path(quantized=args.quantized))
+    report = run_parity(DeepFaceEmbedder(), candidate, records, limit=args.limit)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+    if not report["probes"]:
+        print("Nenhum rosto detectado nas fotos da galeria.")
+        return 1
+    ok = (report["decision_agreement"] >= args.min_agreement
+          and report["embedding_distance"]["max"] <= args.max_embedding_distance)
+    print("Paridade OK" if ok else "Paridade FALHOU: recadastre a galeria com o backend ONNX antes de usá-lo")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# Exporta o ArcFace do DeepFace para ONNX (backend EMBEDDER_BACKEND=onnx, ver services/embedders.py).
+#
+# Uso (a partir de backend/):
+#   python -m app.export_onnx [--output-dir data/models] [--quantize] [--opset 13]
+#
+# Gera <output-dir>/arcface.onnx e, com --quantize, também arcface.int8.onnx (quantização dinâmica
+# dos pesos em int8 pelo ONNX Runtime; use com ONNX_QUANTIZED=1).
+# Ferramentas só de exportação, fora do requirements.txt: pip install tf2onnx onnx
+# Depois de exportar, compare com o DeepFace antes de trocar o backend: python -m app.embedder_parity
+import argparse
+import os
+import sys
+
+from app.services.embedders import RECOGNITION_MODEL, ONNX_MODEL_DIR, onnx_model_path
+
+def export_arcface(output_path, opset=13):
+    try:
+        import tensorflow as tf
+        import tf2onnx
+    except ImportError as e:
+        raise SystemExit(f"Exportação exige tf2onnx ({e}). Instale com: pip install tf2onnx onnx")
+    from deepface import DeepFace
+
+    model = DeepFace.build_model(model_name=RECOGNITION_MODEL)
+    width, height = model.input_shape
+    # Lote dinâmico, para o serviço de inferência mandar vários rostos em um único run()
+    input_signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model.model, input_signature=input_signature, opset=opset, output_path=output_path)
+    print(f"{RECOGNITION_MODEL} exportado para {output_path}")
+
+def quantize_int8(input_path, output_path):
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError as e:
+        raise SystemExit(f"Quantização exige onnxruntime e onnx ({e}). Instale com: pip install onnxruntime onnx")
+    quantize_dynamic(input_path, output_path, weight_type=QuantType.QInt8)
+    size_mb = os.path.getsize(output_path) / 1e6
+    print(f"Modelo int8 gravado em {output_path} ({size_mb:.1f} MB)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta o modelo de reconhecimento facial para ONNX.")
+    parser.add_argument("--output-dir", default=ONNX_MODEL_DIR, help="Diretório de saída (padrão: ONNX_MODEL_DIR)")
+    parser.add_argument("--quantize", action="store_true", help="Gera também a versão quantizada em int8")
+    parser.add_argument("--opset", type=int, default=13)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    fp32_path = onnx_model_path(quantized=False, model_dir=args.output_dir)
+    export_arcface(fp32_path, opset=args.opset)
+    if args.quantize:
+        quantize_int8(fp32_path, onnx_model_path(quantized=True, model_dir=args.output_dir))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+# Configuração do Gunicorn (usada pelo Dockerfile: gunicorn -c app/gunicorn_conf.py app.main:app)
+#
+# Mudança de padrão: antes o Dockerfile subia "gunicorn -w 4" (4 workers sync, uma requisição por
+# vez em cada um, timeout de 30 s). Agora o padrão é 1 worker gthread com várias threads:
+#   - o modelo fica carregado uma vez só (e não 4), e as threads das requisições alimentam o serviço
+#     de inferência com micro-batching (app/services/inference.py);
+#   - o WebSocket dos quiosques (/api/recognize/stream) mantém a conexão aberta, o que um worker sync
+#     não suporta: cada sessão ocupa uma thread enquanto o quiosque estiver conectado;
+#   - timeout de 300 s, porque o boot do worker inclui o aquecimento dos modelos.
+# Para voltar ao comportamento antigo: GUNICORN_WORKERS=4 GUNICORN_HTTP_THREADS=1 STREAM_MAX_SESSIONS=0
+# (sem WebSocket; os quiosques usam POST /recognize).
+#
+# Dimensionamento (por worker):
+#   GUNICORN_HTTP_THREADS  requisições HTTP simultâneas (padrão 8)
+#   STREAM_MAX_SESSIONS    sessões WebSocket de quiosque abertas ao mesmo tempo (padrão 8). A rota
+#                          recusa sessões acima desse limite (o quiosque volta para POST /recognize),
+#                          então as threads HTTP nunca são tomadas pelos quiosques.
+#   GUNICORN_THREADS       se definido, substitui a soma das duas anteriores
+# O master não distribui as conexões por igual entre os workers, por isso cada worker reserva
+# threads para STREAM_MAX_SESSIONS sessões (e não para o total de quiosques dividido pelos workers).
+import os
+
+bind = "0.0.0.0:5000"
+# Mais workers continuam funcionando (a galeria é sincronizada entre eles), ao custo de uma cópia
+# do modelo por worker.
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+worker_class = "gthread"
+http_threads = int(os.environ.get("GUNICORN_HTTP_THREADS", "8"))
+stream_sessions = int(os.environ.get("STREAM_MAX_SESSIONS", "8"))
+threads = int(os.environ.get("GUNICORN_THREADS") or max(1, http_threads + stream_sessions))
+# O boot do worker inclui o aquecimento dos modelos, então o timeout precisa cobrir esse tempo
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "300"))
+
+# GUNICORN_PRELOAD=1 importa o app (e aquece os modelos) uma única vez no master antes do fork,
+# para que os pesos do modelo sejam compartilhados entre os workers via copy-on-write.
+# Fica desligado por padrão: o TensorFlow não é totalmente seguro para fork depois de inicializado,
+# então só ative depois de validar no ambiente de produção.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
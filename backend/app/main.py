@@ -5,7 +5,7 @@ import os
 
 # Importar serviços e rotas
 from app.services.database import init_db
-from app.services.face_recognition import load_embeddings
+from app.services.face_recognition import load_embeddings, warm_up_models, WARMUP_MODELS
 from app.routes import api_bp # Importa o Blueprint das rotas
 
 app = Flask(__name__)
@@ -13,6 +13,13 @@ app = Flask(__name__)
 # Configurar CORS para todas as rotas da API
 CORS(app, resources={r"/api/*": {"origins": "https://frequencia.simplisoft.com.br"}}) 
 
+# Opções dos WebSockets (flask-sock): ping periódico para manter a conexão através do proxy e
+# limite de tamanho por mensagem (um quadro JPEG)
+app.config['SOCK_SERVER_OPTIONS'] = {
+    'ping_interval': 25,
+    'max_message_size': int(os.environ.get("STREAM_MAX_FRAME_BYTES", str(2 * 1024 * 1024)))
+}
+
 # Registrar o Blueprint das rotas
 app.register_blueprint(api_bp)
 
@@ -28,6 +35,11 @@ def home():
 with app.app_context(): # Garante que estamos no contexto da aplicação Flask
     init_db()
     load_embeddings()
+    # Carrega ArcFace + detector agora, para que a primeira requisição não pague o carregamento.
+    # Com o gunicorn, o worker só aceita conexões depois de importar o app (ou seja, já aquecido).
+    # Com GUNICORN_PRELOAD=1 isso roda uma única vez no master, antes do fork (ver gunicorn_conf.py).
+    if WARMUP_MODELS:
+        warm_up_models()
 
 if __name__ == '__main__':
     # Flask em modo debug (apenas para desenvolvimento)
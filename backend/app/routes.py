@@ -1,33 +1,115 @@
-from flask import request, jsonify, send_file, Blueprint, current_app 
+from flask import request, jsonify, send_file, Blueprint, Response, stream_with_context, g
+from flask_sock import Sock
 import os
 import base64
 import uuid
 import json
+import csv
+import zlib
 from datetime import datetime, date
-from io import StringIO, BytesIO
+from io import StringIO
+import time
+import threading
 import traceback
 
 # Importar serviços
 from app.services.database import (
-    add_student_to_db, get_all_students, get_attendances_from_db,
-    register_attendance_in_db, is_duplicate_attendance,
+    add_student_to_db, get_all_students,
+    iter_attendances_from_db, get_attendances_page,
+    get_daily_attendance_summary, get_absent_students,
+    register_attendance_if_not_duplicate,
+    register_attendances_if_not_duplicate,
     add_school_unit_to_db, get_all_school_units, update_school_unit_in_db,
     delete_school_unit_from_db,get_students_by_school_unit, get_student_details_by_matricula,
-    update_student_image_path, update_student_data, delete_student_by_matricula
+    update_student_image_path, update_student_data, delete_student_by_matricula,
+    resolve_school_unit_by_ip, delete_face_samples
+)
+from app.services.enrollment import bulk_enroll_students
+from app.services.metrics import (
+    render_metrics, timed, RECOGNITION_REQUESTS, HTTP_REQUEST_SECONDS, PROFILER,
+    SLOW_REQUEST_SECONDS as PROFILER_SLOW_REQUEST_SECONDS
 )
 from app.services.face_recognition import (
-    generate_embedding, add_student_embedding,
-    recognize_face_from_image,remove_student_embedding, REGISTERED_STUDENTS_EMBEDDINGS,
-    IMG_SAVE_PATH
+    generate_embedding, enroll_student_samples, update_student_template, get_student_template_info,
+    sync_gallery, update_student_embedding_info, recognize_face_from_image, recognize_faces_in_image, recognize_face_chip, remove_student_embedding, get_gallery_size,
+    IMG_SAVE_PATH, evaluate_gallery_recall, decode_image_bytes, get_readiness,
+    get_recognition_cache_stats
 )
+from app.services.face_templates import TEMPLATE_MAX_SAMPLES
 
 # Crie um Blueprint para suas rotas
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# WebSockets (flask-sock) registrados no mesmo Blueprint
+sock = Sock()
+
+# --- Métricas (ver services/metrics.py) ---
+@api_bp.before_request
+def _start_request_metrics():
+    g.request_start = time.perf_counter()
+    if request.endpoint != 'api.recognize_stream': # Sessões WebSocket são longas por natureza
+        PROFILER.request_started(f"{request.method} {request.path}")
+
+@api_bp.after_request
+def _finish_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.endpoint or "unknown",
+                                     method=request.method, status=response.status_code)
+    PROFILER.request_finished()
+    return response
+
+@api_bp.route('/metrics', methods=['GET'])
+def metrics():
+    # Formato de exposição em texto do Prometheus
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api_bp.route('/metrics/profiler', methods=['GET', 'POST'])
+def metrics_profiler():
+    # POST {"enabled": true|false} liga/desliga o profiler de requisições lentas neste worker
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        PROFILER.set_enabled(data.get('enabled', False))
+    return jsonify({"enabled": PROFILER.enabled, "slow_request_seconds": PROFILER_SLOW_REQUEST_SECONDS}), 200
+
+@api_bp.route('/metrics/slow_requests', methods=['GET'])
+def metrics_slow_requests():
+    return jsonify(list(PROFILER.profiles)), 200
+
 @api_bp.route('/')
 def home():
     return "Backend do Sistema de Frequência Escolar está rodando!"
 
+@api_bp.route('/health/live', methods=['GET'])
+def health_live():
+    return jsonify({"status": "ok"}), 200
+
+@api_bp.route('/health/ready', methods=['GET'])
+def health_ready():
+    # 200 só quando os modelos e a galeria de embeddings estão carregados neste worker;
+    # o orquestrador (healthcheck do Docker/Traefik) só envia tráfego para workers aquecidos
+    status = get_readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+def _sample_embeddings(images_bytes, image_data_urls):
+    # Embeddings das fotos de um aluno (bytes já decodificados + data URLs); fotos sem rosto são ignoradas.
+    # Retorna (embeddings, quantidade_de_fotos_descartadas).
+    images_bytes = list(images_bytes)
+    for image_data_url in image_data_urls[:TEMPLATE_MAX_SAMPLES]:
+        try:
+            images_bytes.append(base64.b64decode(image_data_url.split(',', 1)[1]))
+        except (AttributeError, IndexError, ValueError):
+            images_bytes.append(None)
+    embeddings = []
+    for image_bytes in images_bytes[:TEMPLATE_MAX_SAMPLES]:
+        try:
+            embedding = generate_embedding(decode_image_bytes(image_bytes)) if image_bytes else None
+        except ValueError:
+            embedding = None
+        if embedding is not None:
+            embeddings.append(embedding)
+    return embeddings, len(images_bytes) - len(embeddings)
+
 @api_bp.route('/students', methods=['POST'])
 def register_student():
     data = request.get_json()
@@ -41,6 +123,7 @@ def register_student():
     turno = data.get('turno')
     idade = data.get('idade')
     image_data_url = data.get('image')
+    extra_images = data.get('images') or [] # Fotos extras (opcional): entram no modelo do aluno, não são salvas em disco
     school_unit_id = data.get('school_unit_id')
 
     if not all([name, matricula, turma, turno, idade, image_data_url]):
@@ -77,13 +160,14 @@ def register_student():
             os.remove(relative_image_path) # Remove a imagem se o DB não aceitar
         return jsonify({"error": f"Matrícula '{matricula}' já existe ou erro no DB."}), 409
     
-    # Gerar e salvar embedding
+    # Gerar e salvar o modelo do aluno (uma amostra por foto com rosto detectado)
     try:
-        embedding = generate_embedding(final_image_path) # <-- IMPORTANTE: use final_image_path aqui
-        
-        if embedding is not None:
-            add_student_embedding(name, matricula, embedding, relative_image_path, school_unit_id)
-            print(f"Embedding para {name} ({matricula}) gerado e salvo. Total de alunos com embedding: {len(REGISTERED_STUDENTS_EMBEDDINGS)}")
+        # Gera os embeddings a partir das imagens já decodificadas em memória, sem reler o arquivo do disco
+        embeddings, failed = _sample_embeddings([image_bytes], extra_images)
+
+        if embeddings:
+            template = enroll_student_samples(name, matricula, embeddings, relative_image_path, school_unit_id)
+            print(f"Modelo para {name} ({matricula}) gerado com {template['samples']} amostras ({failed} fotos sem rosto). Total de alunos com embedding: {get_gallery_size()}")
         else:
             print(f"Atenção: Não foi possível gerar embedding para {name} na imagem de cadastro.")
 
@@ -93,6 +177,83 @@ def register_student():
     print(f"Aluno {name} ({matricula}) cadastrado com sucesso.")
     return jsonify({"message": "Aluno cadastrado com sucesso!", "image_path": final_image_path}), 201
 
+@api_bp.route('/students/bulk', methods=['POST'])
+def register_students_bulk():
+    # Corpo: {"students": [{name, matricula, turma, turno, idade, school_unit_id, image (data URL)}, ...]}
+    data = request.get_json()
+    if not data or not isinstance(data.get('students'), list) or not data['students']:
+        return jsonify({"error": "Envie uma lista 'students' com os alunos a cadastrar."}), 400
+
+    students = []
+    for item in data['students']:
+        image_bytes = None
+        try:
+            _, encoded_data = item.get('image', '').split(',', 1)
+            image_bytes = base64.b64decode(encoded_data)
+        except (ValueError, TypeError, AttributeError):
+            pass # Reportado como invalid_image no resultado do aluno
+        student = {key: item.get(key) for key in ('name', 'matricula', 'turma', 'turno', 'idade', 'school_unit_id')}
+        student['image_bytes'] = image_bytes
+        students.append(student)
+
+    try:
+        # Embeddings no próprio worker (modelos já carregados); o pool de processos fica para o CLI
+        results = bulk_enroll_students(students, processes=0)
+    except Exception as e:
+        print(f"Erro no cadastro em lote: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Erro interno no cadastro em lote."}), 500
+
+    enrolled = sum(1 for r in results if r["status"] == "enrolled")
+    return jsonify({"enrolled": enrolled, "failed": len(results) - enrolled, "results": results}), 200
+
+def _attendance_payload(recognition_result, client_ip):
+    # Resposta comum de /recognize, /recognize/chip e /recognize/stream: registra a frequência do aluno reconhecido
+    if recognition_result["recognized"]:
+        recognized_student = recognition_result["student"]
+
+        # --- VERIFICAÇÃO DE DUPLICIDADE + REGISTRO (um único comando atômico no banco) ---
+        attendance_status = register_attendance_if_not_duplicate(recognized_student["matricula"], client_ip)
+        if attendance_status == "duplicate":
+            print(f"Frequência duplicada detectada para {recognized_student['matricula']} dentro do período de cooldown.")
+            return {
+                "recognized": True,
+                "name": recognized_student["name"],
+                "matricula": recognized_student["matricula"],
+                "attendance_recorded": False, 
+                "attendance_status": "duplicate",
+                "message": "Frequência já registrada recentemente."
+            }
+
+        attendance_recorded = attendance_status == "recorded"
+        return {
+            "recognized": True,
+            "name": recognized_student["name"],
+            "matricula": recognized_student["matricula"],
+            "attendance_recorded": attendance_recorded,
+            "attendance_status": attendance_status or "error",
+            "message": "Frequência registrada com sucesso!" if attendance_recorded else "Erro ao registrar frequência."
+        }
+    else:
+        response = {"recognized": False, "message": recognition_result.get("message", "Nenhum aluno reconhecido.")}
+        if "reason" in recognition_result:
+            response["reason"] = recognition_result["reason"] # Quadro reprovado no filtro de qualidade
+        return response
+
+def _recognition_outcome(payload):
+    if payload.get("recognized"):
+        return payload["attendance_status"]
+    return "rejected" if "reason" in payload else "not_recognized"
+
+def _count_recognition(endpoint, school_unit_id, outcome):
+    # Taxa de requisições por unidade escolar (rate() no Prometheus) e por resultado
+    RECOGNITION_REQUESTS.inc(endpoint=endpoint, school_unit_id=school_unit_id if school_unit_id is not None else "none", outcome=outcome)
+
+def _attendance_response(recognition_result, client_ip, endpoint, school_unit_id):
+    payload = _attendance_payload(recognition_result, client_ip)
+    _count_recognition(endpoint, school_unit_id, _recognition_outcome(payload))
+    return jsonify(payload), 200
+
 @api_bp.route('/recognize', methods=['POST'])
 def recognize_face():
     client_ip = request.remote_addr 
@@ -104,42 +265,213 @@ def recognize_face():
 
     image_data_url = data['image']
     try:
-        header, encoded_data = image_data_url.split(',', 1)
-        image_bytes = base64.b64decode(encoded_data)
+        with timed("base64_decode"):
+            header, encoded_data = image_data_url.split(',', 1)
+            image_bytes = base64.b64decode(encoded_data)
         
-        recognition_result = recognize_face_from_image(image_bytes)
+        # Resolve a unidade escolar pela faixa de IP do quiosque; sem unidade, busca na galeria global
+        school_unit_id = resolve_school_unit_by_ip(client_ip)
+        recognition_result = recognize_face_from_image(image_bytes, school_unit_id=school_unit_id, client_ip=client_ip)
         
-        if recognition_result["recognized"]:
-            recognized_student = recognition_result["student"]
-
-            # --- VERIFICAÇÃO DE DUPLICIDADE NO BACKEND ---
-            if is_duplicate_attendance(recognized_student["matricula"]):
-                print(f"Frequência duplicada detectada para {recognized_student['matricula']} dentro do período de cooldown.")
-                return jsonify({
-                    "recognized": True,
-                    "name": recognized_student["name"],
-                    "matricula": recognized_student["matricula"],
-                    "attendance_recorded": False, 
-                    "message": "Frequência já registrada recentemente."
-                }), 200
-            # --- FIM DA VERIFICAÇÃO DE DUPLICIDADE ---
-            
-            attendance_recorded = register_attendance_in_db(recognized_student["matricula"], client_ip) 
-            return jsonify({
-                "recognized": True,
-                "name": recognized_student["name"],
-                "matricula": recognized_student["matricula"],
-                "attendance_recorded": attendance_recorded,
-                "message": "Frequência registrada com sucesso!" if attendance_recorded else "Erro ao registrar frequência."
-            }), 200
-        else:
-            return jsonify({"recognized": False, "message": recognition_result.get("message", "Nenhum aluno reconhecido.")}), 200
+        return _attendance_response(recognition_result, client_ip, "recognize", school_unit_id)
 
     except Exception as e:
         print(f"Erro no reconhecimento facial na rota: {e}")
         traceback.print_exc() 
         return jsonify({"error": f"Erro interno no reconhecimento: {str(e)}"}), 500
 
+@api_bp.route('/recognize/chip', methods=['POST'])
+def recognize_face_chip_route():
+    # Rosto já recortado e alinhado no quiosque, enviado como binário (application/octet-stream
+    # no corpo ou arquivo "face" em multipart/form-data), sem base64 nem detecção no servidor.
+    client_ip = request.remote_addr
+    chip_file = request.files.get('face')
+    chip_bytes = chip_file.read() if chip_file else request.get_data()
+    if not chip_bytes:
+        return jsonify({"error": "Nenhum recorte de rosto recebido."}), 400
+
+    try:
+        school_unit_id = resolve_school_unit_by_ip(client_ip)
+        recognition_result = recognize_face_chip(chip_bytes, school_unit_id=school_unit_id)
+        return _attendance_response(recognition_result, client_ip, "recognize_chip", school_unit_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Erro no reconhecimento do recorte na rota: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Erro interno no reconhecimento: {str(e)}"}), 500
+
+@api_bp.route('/recognize/group', methods=['POST'])
+def recognize_group():
+    # Modo grupo: um quadro com vários alunos (ex.: fila na porta da sala) devolve todos os rostos,
+    # e as frequências de todos os reconhecidos são gravadas em uma única transação.
+    client_ip = request.remote_addr
+    data = request.get_json()
+    if not data or 'image' not in data:
+        return jsonify({"error": "Nenhum dado de imagem recebido."}), 400
+
+    try:
+        with timed("base64_decode"):
+            header, encoded_data = data['image'].split(',', 1)
+            image_bytes = base64.b64decode(encoded_data)
+
+        school_unit_id = resolve_school_unit_by_ip(client_ip)
+        recognition_result = recognize_faces_in_image(image_bytes, school_unit_id=school_unit_id)
+        if "error" in recognition_result:
+            _count_recognition("recognize_group", school_unit_id, "error")
+            return jsonify({"error": recognition_result["error"]}), 500
+
+        recognized_matriculas = [face["student"]["matricula"] for face in recognition_result["faces"] if face["recognized"]]
+        statuses = register_attendances_if_not_duplicate(recognized_matriculas, client_ip) if recognized_matriculas else {}
+
+        faces = []
+        for face in recognition_result["faces"]:
+            item = {"box": face["box"], "recognized": face["recognized"], "distance": face["distance"]}
+            if face["recognized"]:
+                student = face["student"]
+                status = statuses.get(student["matricula"])
+                item.update({
+                    "name": student["name"],
+                    "matricula": student["matricula"],
+                    "attendance_recorded": status == "recorded",
+                    "attendance_status": status or "error"
+                })
+            faces.append(item)
+
+        response = {
+            "faces": faces,
+            "recognized_count": len(recognized_matriculas),
+            "recorded_count": sum(1 for status in statuses.values() if status == "recorded")
+        }
+        if "message" in recognition_result:
+            response["message"] = recognition_result["message"]
+        if "reason" in recognition_result:
+            response["reason"] = recognition_result["reason"]
+        for status in statuses.values():
+            _count_recognition("recognize_group", school_unit_id, status or "error")
+        if not statuses:
+            _count_recognition("recognize_group", school_unit_id, "rejected" if "reason" in recognition_result else "not_recognized")
+        return jsonify(response), 200
+
+    except Exception as e:
+        print(f"Erro no reconhecimento em grupo na rota: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Erro interno no reconhecimento: {str(e)}"}), 500
+
+STREAM_IDLE_TIMEOUT_SECONDS = 60 # Sessão sem nenhum quadro por esse tempo é encerrada
+# Cada sessão ocupa uma thread do worker enquanto está aberta. gunicorn_conf.py soma este limite às
+# threads HTTP; acima dele a sessão é recusada ("busy") e o quiosque continua por POST /recognize,
+# em vez de os quiosques tomarem as threads das requisições HTTP.
+STREAM_MAX_SESSIONS = int(os.environ.get("STREAM_MAX_SESSIONS", "8"))
+STREAM_BUSY_RETRY_SECONDS = 60
+_stream_sessions = 0
+_stream_sessions_lock = threading.Lock()
+
+def _acquire_stream_session():
+    global _stream_sessions
+    with _stream_sessions_lock:
+        if _stream_sessions >= STREAM_MAX_SESSIONS:
+            return False
+        _stream_sessions += 1
+        return True
+
+def _release_stream_session():
+    global _stream_sessions
+    with _stream_sessions_lock:
+        _stream_sessions -= 1
+
+@sock.route('/recognize/stream', bp=api_bp)
+def recognize_stream(ws):
+    # Canal persistente por quiosque: o cliente envia quadros JPEG/PNG como mensagens binárias (sem
+    # HTTP por quadro, JSON nem base64) e recebe eventos JSON com o mesmo conteúdo de /recognize.
+    # Estado da sessão: unidade escolar resolvida uma vez na conexão e último aluno reconhecido.
+    # Quadros que chegam enquanto o anterior está no modelo ficam na fila do WebSocket; antes de
+    # processar, a fila é esvaziada e só o quadro mais recente é usado, então um quiosque nunca
+    # acumula atraso quando a inferência fica para trás.
+    # Mensagens de texto são controles JSON: {"type": "ping"} e {"type": "stats"}.
+    client_ip = request.remote_addr
+    if not _acquire_stream_session():
+        print(f"Sessão de reconhecimento em streaming recusada para o IP {client_ip}: limite de {STREAM_MAX_SESSIONS} sessões no worker")
+        ws.send(json.dumps({"type": "busy", "retry_after": STREAM_BUSY_RETRY_SECONDS}))
+        return
+    try:
+        _run_stream_session(ws, client_ip)
+    finally:
+        _release_stream_session()
+
+def _run_stream_session(ws, client_ip):
+    school_unit_id = resolve_school_unit_by_ip(client_ip)
+    session = {"frames_received": 0, "frames_processed": 0, "frames_dropped": 0, "last_matricula": None}
+    print(f"Sessão de reconhecimento em streaming aberta para o IP {client_ip} (unidade {school_unit_id})")
+    ws.send(json.dumps({"type": "ready", "school_unit_id": school_unit_id}))
+
+    try:
+        while True:
+            message = ws.receive(timeout=STREAM_IDLE_TIMEOUT_SECONDS)
+            if message is None:
+                break # Sessão ociosa
+
+            frame = None
+            while message is not None:
+                if isinstance(message, (bytes, bytearray)):
+                    session["frames_received"] += 1
+                    if frame is not None:
+                        session["frames_dropped"] += 1 # Substituído por um quadro mais novo
+                    frame = bytes(message)
+                else:
+                    _handle_stream_control(ws, message, session)
+                message = ws.receive(timeout=0) # Esvazia a fila sem bloquear
+
+            if frame is None:
+                continue
+
+            recognition_result = recognize_face_from_image(frame, school_unit_id=school_unit_id, client_ip=client_ip)
+            if "error" in recognition_result:
+                event = {"type": "error", "error": recognition_result["error"]}
+                _count_recognition("recognize_stream", school_unit_id, "error")
+            else:
+                event = _attendance_payload(recognition_result, client_ip)
+                _count_recognition("recognize_stream", school_unit_id, _recognition_outcome(event))
+                event["type"] = "result"
+                if event["recognized"]:
+                    event["repeat"] = event["matricula"] == session["last_matricula"] # Mesmo aluno ainda na frente da câmera
+                    session["last_matricula"] = event["matricula"]
+            session["frames_processed"] += 1
+            event["frames_dropped"] = session["frames_dropped"]
+            ws.send(json.dumps(event))
+    finally:
+        print(f"Sessão de reconhecimento em streaming encerrada para o IP {client_ip}: "
+              f"{session['frames_processed']} quadros processados, {session['frames_dropped']} descartados")
+
+def _handle_stream_control(ws, message, session):
+    try:
+        control = json.loads(message)
+    except ValueError:
+        ws.send(json.dumps({"type": "error", "error": "Mensagem de controle inválida."}))
+        return
+    if control.get("type") == "ping":
+        ws.send(json.dumps({"type": "pong"}))
+    elif control.get("type") == "stats":
+        ws.send(json.dumps(dict(session, type="stats")))
+
+@api_bp.route('/recognize/cache', methods=['GET'])
+def recognition_cache_stats():
+    # Acertos/erros do cache de quadros quase idênticos deste worker (para ajustar TTL e distância de Hamming)
+    return jsonify(get_recognition_cache_stats()), 200
+
+@api_bp.route('/gallery/recall', methods=['GET'])
+def gallery_recall():
+    # Compara o backend aproximado (IVF) com a busca exata para ajustar IVF_NLIST/IVF_NPROBE
+    backend = request.args.get('backend', 'ivf')
+    num_queries = request.args.get('num_queries', 200, type=int)
+    k = request.args.get('k', 1, type=int)
+    try:
+        return jsonify(evaluate_gallery_recall(backend=backend, num_queries=num_queries, k=k)), 200
+    except Exception as e:
+        print(f"Erro ao avaliar recall do índice: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Erro ao avaliar recall do índice."}), 500
+
 # --- Endpoints de Unidades Escolares ---
 @api_bp.route('/school_units', methods=['POST'])
 def create_school_unit():
@@ -186,58 +518,146 @@ def delete_school_unit_route(unit_id):
 
 @api_bp.route('/attendances', methods=['GET'])
 def get_attendances():
+    # Modos de resposta:
+    #   ?limit=N[&cursor=...] -> uma página {"items": [...], "next_cursor": ...} (keyset em timestamp, id)
+    #   ?format=jsonl         -> JSON Lines em streaming (uma frequência por linha)
+    #   (sem esses parâmetros) -> lista JSON completa, também enviada em streaming
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     turma = request.args.get('turma')
     search_query = request.args.get('search_query')
     school_unit_id = request.args.get('school_unit_id')
+    filters = (start_date_str, end_date_str, turma, search_query, school_unit_id)
 
     try:
-        attendances = get_attendances_from_db(start_date_str, end_date_str, turma, search_query, school_unit_id)
-        return jsonify(attendances), 200
+        if request.args.get('limit') or request.args.get('cursor'):
+            page = get_attendances_page(*filters, cursor=request.args.get('cursor'), limit=request.args.get('limit', type=int))
+            return jsonify(page), 200
+
+        # Filtros inválidos e erros do banco aparecem aqui (400/500), antes de a resposta começar
+        rows = iter_attendances_from_db(*filters)
+        if request.args.get('format') == 'jsonl':
+            def generate_jsonl():
+                for att in rows:
+                    yield json.dumps(att, ensure_ascii=False) + '\n'
+            return Response(stream_with_context(generate_jsonl()), mimetype='application/x-ndjson')
+
+        def generate_json_array():
+            yield '['
+            first = True
+            for att in rows:
+                yield ('' if first else ',') + json.dumps(att, ensure_ascii=False)
+                first = False
+            yield ']'
+        return Response(stream_with_context(generate_json_array()), mimetype='application/json')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Erro ao consultar frequências: {e}")
         traceback.print_exc() 
         return jsonify({"error": "Erro ao consultar frequências."}), 500
 
+@api_bp.route('/attendances/summary', methods=['GET'])
+def attendance_summary():
+    # Presença diária por turma/turno/unidade a partir da tabela pré-agregada
+    try:
+        summary = get_daily_attendance_summary(
+            request.args.get('start_date'), request.args.get('end_date'),
+            request.args.get('school_unit_id'), request.args.get('turma'), request.args.get('turno')
+        )
+        return jsonify(summary), 200
+    except ValueError:
+        return jsonify({"error": "Datas devem estar no formato AAAA-MM-DD."}), 400
+    except Exception as e:
+        print(f"Erro ao consultar resumo de frequências: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Erro ao consultar resumo de frequências."}), 500
+
+@api_bp.route('/attendances/absent', methods=['GET'])
+def absent_students():
+    # Alunos sem frequência no dia informado (padrão: hoje)
+    day_str = request.args.get('date') or date.today().isoformat()
+    try:
+        students = get_absent_students(
+            day_str, request.args.get('school_unit_id'), request.args.get('turma'), request.args.get('turno')
+        )
+        return jsonify({"date": day_str, "count": len(students), "students": students}), 200
+    except ValueError:
+        return jsonify({"error": "Data deve estar no formato AAAA-MM-DD."}), 400
+    except Exception as e:
+        print(f"Erro ao consultar alunos ausentes: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Erro ao consultar alunos ausentes."}), 500
+
+CSV_EXPORT_CHUNK_ROWS = 1000 # Linhas por bloco enviado ao cliente
+
+def generate_attendances_csv(rows, delimiter=',', bom=False, chunk_rows=CSV_EXPORT_CHUNK_ROWS):
+    # Gera o CSV em blocos de bytes: só um bloco de linhas fica em memória por vez
+    buffer = StringIO(newline='')
+    writer = csv.writer(buffer, delimiter=delimiter)
+    if bom:
+        buffer.write('\ufeff') # BOM: faz o Excel abrir o arquivo como UTF-8 (acentos corretos)
+    writer.writerow(['ID Registro', 'Nome Aluno', 'Matricula', 'Turma', 'Turno', 'Data/Hora', 'IP Cliente', 'Unidade Escolar'])
+
+    pending_rows = 0
+    for att in rows:
+        writer.writerow([
+            str(att['id']),
+            str(att['name']),
+            str(att['matricula']),
+            str(att['turma']),
+            str(att['turno']),
+            str(att['timestamp']),
+            str(att['client_ip'] or 'N/A'),
+            str(att['school_unit_name'] or 'N/A')
+        ])
+        pending_rows += 1
+        if pending_rows >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending_rows = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31 -> formato gzip
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
 @api_bp.route('/attendances/export_csv', methods=['GET'])
 def export_attendances_csv():
+    # ?excel=1 -> separador ';' e BOM UTF-8 (Excel em português)
+    # ?gzip=1  -> arquivo .csv.gz compactado em streaming
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     turma = request.args.get('turma')
     search_query = request.args.get('search_query')
     school_unit_id = request.args.get('school_unit_id')
+    excel = request.args.get('excel') == '1'
+    use_gzip = request.args.get('gzip') == '1'
 
     try:
-        attendances_data = get_attendances_from_db(start_date_str, end_date_str, turma, search_query, school_unit_id)
-
-        si = StringIO(newline='') 
-        cw = csv.writer(si)
-
-        cw.writerow(['ID Registro', 'Nome Aluno', 'Matricula', 'Turma', 'Turno', 'Data/Hora', 'IP Cliente', 'Unidade Escolar'])
-
-        for att in attendances_data:
-            row_data = [
-                str(att['id']),
-                str(att['name']),
-                str(att['matricula']),
-                str(att['turma']),
-                str(att['turno']),
-                str(att['timestamp']),
-                str(att['client_ip'] or 'N/A'),
-                str(att['school_unit_name'] or 'N/A')
-            ]
-            cw.writerow(row_data)
-        
-        output_string = si.getvalue()
-        output_bytes_buffer = BytesIO(output_string.encode('utf-8'))
-        
-        return send_file(
-            output_bytes_buffer,
-            mimetype='text/csv; charset=utf-8', 
-            as_attachment=True,
-            download_name=f'frequencias_{date.today().isoformat()}.csv'
+        # A consulta é validada e executada aqui; o gerador só produz as linhas
+        rows = iter_attendances_from_db(start_date_str, end_date_str, turma, search_query, school_unit_id)
+        chunks = generate_attendances_csv(rows, delimiter=';' if excel else ',', bom=excel)
+        filename = f'frequencias_{date.today().isoformat()}.csv'
+        mimetype = 'text/csv; charset=utf-8'
+        if use_gzip:
+            chunks = gzip_stream(chunks)
+            filename += '.gz'
+            mimetype = 'application/gzip'
+
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
         )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Erro ao exportar frequências para CSV: {e}")
         traceback.print_exc() 
@@ -245,7 +665,8 @@ def export_attendances_csv():
     
 @api_bp.route('/students_by_school/<int:school_unit_id>', methods=['GET'])
 def list_students_by_school(school_unit_id):
-    students = get_students_by_school_unit(school_unit_id)
+    # Parâmetro opcional ?search= filtra por nome/matrícula (prefixo, sem diferenciar acentos)
+    students = get_students_by_school_unit(school_unit_id, request.args.get('search'))
     return jsonify(students), 200
 
 @api_bp.route('/students/<string:matricula>', methods=['GET'])
@@ -270,8 +691,9 @@ def update_student_photo(matricula):
     if not student:
         return jsonify({"error": "Aluno não encontrado."}), 404
 
-    # Remove o embedding antigo e a imagem antiga
+    # Remove o embedding antigo (e as amostras do modelo) e a imagem antiga
     remove_student_embedding(matricula)
+    delete_face_samples(matricula)
     # Tenta remover a imagem antiga do disco, se ela existir
     if os.path.exists(student["image_path"]):
         try:
@@ -299,10 +721,10 @@ def update_student_photo(matricula):
         if not update_student_image_path(matricula, new_image_path):
             return jsonify({"error": "Erro ao atualizar caminho da imagem no banco de dados."}), 500
 
-        # Gera e adiciona o novo embedding
-        embedding = generate_embedding(new_image_path)
-        if embedding is not None:
-            add_student_embedding(student["name"], matricula, embedding, new_image_path, student["school_unit_id"])
+        # Gera o novo modelo (a partir da imagem em memória e das fotos extras opcionais)
+        embeddings, _ = _sample_embeddings([image_bytes], data.get('images') or [])
+        if embeddings:
+            enroll_student_samples(student["name"], matricula, embeddings, new_image_path, student["school_unit_id"])
             return jsonify({"message": "Foto do aluno atualizada com sucesso!"}), 200
         else:
             return jsonify({"error": "Não foi possível gerar embedding para a nova imagem."}), 500
@@ -312,6 +734,36 @@ def update_student_photo(matricula):
         traceback.print_exc()
         return jsonify({"error": "Erro ao processar nova imagem ou atualizar dados."}), 500
 
+@api_bp.route('/students/<string:matricula>/samples', methods=['GET', 'POST'])
+def student_face_samples(matricula):
+    # GET: amostras e tamanho do modelo do aluno. POST {"images": [data URL, ...]}: acrescenta
+    # amostras (ex.: fotos sob outra iluminação) sem trocar a foto do cadastro.
+    if request.method == 'GET':
+        info = get_student_template_info(matricula)
+        if info is None:
+            return jsonify({"error": "Aluno sem embedding cadastrado."}), 404
+        return jsonify(info), 200
+
+    data = request.get_json(silent=True) or {}
+    images = data.get('images') or []
+    if not images:
+        return jsonify({"error": "Nenhuma imagem recebida."}), 400
+
+    sync_gallery(force=True) # O aluno pode ter sido cadastrado por outro worker
+    if get_student_template_info(matricula) is None:
+        return jsonify({"error": "Aluno sem embedding cadastrado."}), 404
+
+    try:
+        embeddings, failed = _sample_embeddings([], images)
+        if not embeddings:
+            return jsonify({"error": "Nenhum rosto detectado nas imagens enviadas."}), 422
+        template = update_student_template(matricula, embeddings, "enrolment")
+    except Exception as e:
+        print(f"Erro ao adicionar amostras do aluno {matricula}: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Erro ao adicionar amostras."}), 500
+    return jsonify({"added": len(embeddings), "failed": failed, **template}), 200
+
 # Rota para servir imagens dos estudantes
 @api_bp.route('/student_images/<string:matricula>/<string:filename>', methods=['GET'])
 def get_student_image(matricula, filename):
@@ -357,16 +809,9 @@ def update_student_info(matricula):
 
     if not update_student_data(matricula, name, turma, turno, idade, school_unit_id):
         return jsonify({"error": "Erro ao atualizar dados do aluno ou aluno não encontrado."}), 500
-    
-    # Se o nome ou outros dados do aluno mudaram, pode ser útil atualizar o embedding em memória
-    # Embora o embedding seja vinculado à foto, se o name mudar, a lista em memória pode precisar de refresh
-    # Uma forma seria recarregar todos os embeddings, ou fazer um update mais granular.
-    # Por simplicidade, podemos ignorar a lista em memória para mudanças de nome,
-    # já que a matricula (key) e o embedding (foto) são os mais críticos para o reconhecimento.
-    # Se você decidir que mudanças de name ou school_unit_id DEVEM atualizar a lista em memória:
-    # from app.services.face_recognition import load_embeddings
-    # load_embeddings() # Isso recarrega tudo, pode ser pesado para muitos alunos.
-    # Uma abordagem melhor seria atualizar o item específico na lista REGISTERED_STUDENTS_EMBEDDINGS.
+
+    # Aluno transferido de escola: sai da partição da unidade antiga e entra na da nova (em todos os workers)
+    update_student_embedding_info(matricula, name, school_unit_id)
 
     return jsonify({"message": "Dados do aluno atualizados com sucesso!"}), 200
 
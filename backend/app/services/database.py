@@ -1,12 +1,23 @@
 import sqlite3
 import os
+import base64
+import bisect
+import json
+import ipaddress
+import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
+from app.services.metrics import timed, register, CallbackMetric, DB_CONNECTION_WAIT_SECONDS
+
 # Definições de caminho para o DB
 # DATA_DIR precisa ser acessível de forma consistente
 # Como services está dentro de app, vamos para 'app/..' (volta para 'backend/')
 # e depois para 'data'
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+# APP_DATA_DIR permite apontar para outro diretório (ex.: benchmarks em diretório temporário)
+DATA_DIR = os.environ.get("APP_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
 DATABASE = os.path.join(DATA_DIR, 'attendance.db')
 
 # Garante que o diretório de dados exista
@@ -14,12 +25,59 @@ if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
 COOLDOWN_PERIOD_MINUTES = 30 # Período em minutos para evitar presenças duplicadas
+RECENT_ATTENDANCE_CACHE_SIZE = int(os.environ.get("RECENT_ATTENDANCE_CACHE_SIZE", "8192"))
+IP_RANGE_TABLE_TTL_SECONDS = 60 # Tempo máximo para outro worker enxergar alterações nas faixas de IP
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
+# --- Pool de conexões ---
+# Em vez de abrir uma conexão nova a cada função, cada thread (de cada worker) reaproveita a sua.
+# A conexão é configurada uma vez com WAL (leitores não bloqueiam o escritor e vice-versa),
+# synchronous=NORMAL (seguro com WAL, sem fsync a cada commit), busy_timeout (espera o lock em vez
+# de falhar com "database is locked") e cache de prepared statements do módulo sqlite3.
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", "256"))
+
+class PooledConnection(sqlite3.Connection):
+    # close() apenas devolve a conexão ao pool (desfazendo uma transação esquecida),
+    # para que as funções abaixo continuem no padrão "get_db_connection() ... conn.close()"
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def close_for_real(self):
+        super().close()
+
+_pool = threading.local()
+
+def _open_pooled_connection():
+    conn = sqlite3.connect(
+        DATABASE,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+        cached_statements=DB_CACHED_STATEMENTS,
+        factory=PooledConnection
+    )
     conn.row_factory = sqlite3.Row # Permite acessar colunas por nome
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
     return conn
 
+def get_db_connection():
+    # Conexão da thread atual; recriada após um fork (uma conexão SQLite não pode cruzar processos)
+    start = time.perf_counter()
+    conn = getattr(_pool, 'conn', None)
+    if conn is None or getattr(_pool, 'pid', None) != os.getpid():
+        conn = _open_pooled_connection()
+        _pool.conn = conn
+        _pool.pid = os.getpid()
+    DB_CONNECTION_WAIT_SECONDS.observe(time.perf_counter() - start)
+    return conn
+
+def close_db_connection():
+    conn = getattr(_pool, 'conn', None)
+    if conn is not None and getattr(_pool, 'pid', None) == os.getpid():
+        conn.close_for_real()
+    _pool.conn = None
+
 def init_db():
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -57,9 +115,258 @@ def init_db():
         )
     ''')
     conn.commit()
+    apply_migrations(conn)
     conn.close()
     print("Banco de dados inicializado/verificado (services/database.py)!")
 
+# --- Migrações de schema ---
+# Cada migração é (versão, [comandos SQL ou funções que recebem a conexão]) e roda uma única vez, em ordem, dentro de uma transação.
+# A versão aplicada fica em PRAGMA user_version do próprio arquivo do banco.
+# Novas migrações devem sempre ser acrescentadas ao final, com a próxima versão.
+MIGRATIONS = [
+    (1, [
+        # Verificação de cooldown (is_duplicate_attendance / inserção condicional): matrícula + período
+        'CREATE INDEX IF NOT EXISTS idx_attendances_matricula_timestamp ON attendances (student_matricula, timestamp)',
+        # Consultas e relatórios por período, ordenados por data
+        'CREATE INDEX IF NOT EXISTS idx_attendances_timestamp_id ON attendances (timestamp, id)',
+        'CREATE INDEX IF NOT EXISTS idx_students_school_unit_turma ON students (school_unit_id, turma)',
+    ]),
+    (2, [
+        # Resumos diários pré-agregados (relatórios e dashboards sem varrer attendances).
+        # daily_presence: um registro por aluno presente por dia (dia = data local do timestamp).
+        # daily_attendance_summary: contadores por dia/unidade/turma/turno.
+        # school_unit_id 0 = aluno sem unidade (NULL não funciona em chave primária para o upsert).
+        '''
+        CREATE TABLE IF NOT EXISTS daily_presence (
+            day TEXT NOT NULL,
+            student_matricula TEXT NOT NULL,
+            school_unit_id INTEGER NOT NULL,
+            turma TEXT NOT NULL,
+            turno TEXT NOT NULL,
+            first_seen TEXT NOT NULL,
+            attendance_count INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (day, student_matricula)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_attendance_summary (
+            day TEXT NOT NULL,
+            school_unit_id INTEGER NOT NULL,
+            turma TEXT NOT NULL,
+            turno TEXT NOT NULL,
+            present_count INTEGER NOT NULL DEFAULT 0,
+            attendance_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, school_unit_id, turma, turno)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_daily_summary_unit_day ON daily_attendance_summary (school_unit_id, day)',
+        # Carga inicial a partir do histórico existente
+        '''
+        INSERT OR IGNORE INTO daily_presence (day, student_matricula, school_unit_id, turma, turno, first_seen, attendance_count)
+        SELECT substr(a.timestamp, 1, 10), a.student_matricula, COALESCE(s.school_unit_id, 0), s.turma, s.turno,
+               MIN(a.timestamp), COUNT(*)
+        FROM attendances AS a
+        JOIN students AS s ON a.student_matricula = s.matricula
+        GROUP BY substr(a.timestamp, 1, 10), a.student_matricula
+        ''',
+        '''
+        INSERT OR IGNORE INTO daily_attendance_summary (day, school_unit_id, turma, turno, present_count, attendance_count)
+        SELECT day, school_unit_id, turma, turno, COUNT(*), SUM(attendance_count)
+        FROM daily_presence
+        GROUP BY day, school_unit_id, turma, turno
+        ''',
+        # Manutenção incremental: os triggers rodam na mesma transação de cada INSERT em attendances,
+        # qualquer que seja a função que registrou a frequência.
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_presence_summary AFTER INSERT ON daily_presence
+        BEGIN
+            INSERT INTO daily_attendance_summary (day, school_unit_id, turma, turno, present_count, attendance_count)
+            VALUES (NEW.day, NEW.school_unit_id, NEW.turma, NEW.turno, 1, 0)
+            ON CONFLICT (day, school_unit_id, turma, turno) DO UPDATE SET present_count = present_count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_attendances_daily_summary AFTER INSERT ON attendances
+        BEGIN
+            INSERT INTO daily_presence (day, student_matricula, school_unit_id, turma, turno, first_seen, attendance_count)
+            SELECT substr(NEW.timestamp, 1, 10), NEW.student_matricula, COALESCE(s.school_unit_id, 0), s.turma, s.turno, NEW.timestamp, 1
+            FROM students AS s WHERE s.matricula = NEW.student_matricula
+            ON CONFLICT (day, student_matricula) DO UPDATE SET attendance_count = attendance_count + 1;
+
+            INSERT INTO daily_attendance_summary (day, school_unit_id, turma, turno, present_count, attendance_count)
+            SELECT substr(NEW.timestamp, 1, 10), COALESCE(s.school_unit_id, 0), s.turma, s.turno, 0, 1
+            FROM students AS s WHERE s.matricula = NEW.student_matricula
+            ON CONFLICT (day, school_unit_id, turma, turno) DO UPDATE SET attendance_count = attendance_count + 1;
+        END
+        ''',
+    ]),
+    (3, [
+        # Índice de busca textual de alunos (nome e matrícula); ver _migrate_student_search
+        lambda conn: _migrate_student_search(conn),
+    ]),
+    (4, [
+        # Amostras de rosto de cada aluno (embeddings float32 em bytes), de onde sai o modelo
+        # compacto (centroide + exemplares) usado no reconhecimento; ver services/face_templates.py.
+        # source: "enrolment" (cadastro/foto do administrador) ou "kiosk" (coletada automaticamente).
+        '''
+        CREATE TABLE IF NOT EXISTS student_face_samples (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_matricula TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            source TEXT NOT NULL,
+            distance REAL,
+            created_at TEXT NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_face_samples_matricula ON student_face_samples (student_matricula, id)',
+    ]),
+]
+
+# --- Busca de alunos (FTS5) ---
+# Busca com LIKE '%texto%' não usa índice: cada tecla digitada no filtro da tela de frequências
+# fazia um scan completo de students + attendances. students_fts é uma tabela FTS5 de conteúdo
+# externo (lê os textos da própria tabela students) sobre nome e matrícula, mantida por triggers.
+# O tokenizador unicode61 com remove_diacritics 2 ignora acentos ("joao" encontra "João") e a
+# consulta usa prefixo em cada termo ("mar sil" encontra "Maria da Silva").
+# Buscas só com dígitos são trechos de matrícula e continuam com LIKE sobre a matrícula: o FTS casa
+# só o início de cada token, e "001" precisa encontrar 2023001.
+# Se o SQLite não tiver FTS5 a migração só registra o aviso e a busca continua com LIKE.
+STUDENT_SEARCH_FTS_STATEMENTS = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+        name, matricula,
+        content='students', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_students_fts_insert AFTER INSERT ON students
+    BEGIN
+        INSERT INTO students_fts (rowid, name, matricula) VALUES (NEW.id, NEW.name, NEW.matricula);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_students_fts_delete AFTER DELETE ON students
+    BEGIN
+        INSERT INTO students_fts (students_fts, rowid, name, matricula) VALUES ('delete', OLD.id, OLD.name, OLD.matricula);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_students_fts_update AFTER UPDATE OF name, matricula ON students
+    BEGIN
+        INSERT INTO students_fts (students_fts, rowid, name, matricula) VALUES ('delete', OLD.id, OLD.name, OLD.matricula);
+        INSERT INTO students_fts (rowid, name, matricula) VALUES (NEW.id, NEW.name, NEW.matricula);
+    END
+    ''',
+    # Indexa os alunos já cadastrados
+    "INSERT INTO students_fts (students_fts) VALUES ('rebuild')",
+]
+
+def _fts5_supported(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _migrate_student_search(conn):
+    if not _fts5_supported(conn):
+        print("SQLite sem suporte a FTS5; a busca de alunos vai usar LIKE (services/database.py)")
+        return
+    for statement in STUDENT_SEARCH_FTS_STATEMENTS:
+        conn.execute(statement)
+
+def apply_migrations(conn):
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            conn.execute('BEGIN IMMEDIATE') # Outro worker migrando ao mesmo tempo espera aqui
+            # Relê a versão já com o lock: outro worker pode ter aplicado esta migração
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn) # Migrações que dependem do ambiente (ex.: extensões do SQLite)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+            print(f"Migração {version} aplicada ao banco de dados (services/database.py)")
+        except Exception as e:
+            conn.rollback()
+            print(f"Erro ao aplicar migração {version} (services/database.py): {e}")
+            raise
+
+_student_fts_available = None
+
+def _has_student_fts(conn):
+    global _student_fts_available
+    if _student_fts_available is None:
+        row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students_fts'").fetchone()
+        _student_fts_available = row is not None
+    return _student_fts_available
+
+def _student_search_condition(conn, search_query, alias='s'):
+    # Retorna (condição SQL, parâmetros) para filtrar alunos por nome/matrícula
+    terms = re.findall(r'\w+', search_query)
+    if terms and all(term.isdigit() for term in terms):
+        # Trecho de matrícula em qualquer posição (o FTS só casaria prefixos)
+        return f"{alias}.matricula LIKE ?", [f"%{search_query.strip()}%"]
+    if terms and _has_student_fts(conn):
+        match = ' '.join(f'"{term}"*' for term in terms) # Todos os termos, cada um como prefixo
+        return f"{alias}.id IN (SELECT rowid FROM students_fts WHERE students_fts MATCH ?)", [match]
+    return f"({alias}.matricula LIKE ? OR {alias}.name LIKE ?)", [f"%{search_query}%", f"%{search_query}%"]
+
+# --- Cache de frequências recentes (cooldown) ---
+# O quiosque envia quadros continuamente; o mesmo aluno parado na frente da câmera geraria uma
+# consulta ao SQLite por quadro só para descobrir que a frequência já foi registrada.
+# Este cache LRU limitado guarda matricula -> horário da última frequência conhecida e responde
+# "já registrada dentro do cooldown" da memória. Entradas mais antigas que o cooldown expiram.
+#
+# Entre workers: o cache só guarda fatos positivos ("houve frequência às HH:MM"), que não deixam de
+# ser verdade, então um worker nunca responde errado por causa de um registro feito em outro.
+# Um miss (inclusive por registro feito em outro worker) cai no banco, e o resultado do banco
+# também alimenta o cache. A única invalidação necessária é ao excluir o aluno.
+_recent_attendances = OrderedDict()
+_recent_attendances_lock = threading.Lock()
+RECENT_ATTENDANCE_CACHE_STATS = {"hits": 0, "misses": 0}
+register(CallbackMetric(
+    "recent_attendance_cache_lookups_total", "Consultas ao cache de frequências recentes (cooldown) por resultado.",
+    lambda: {("hit",): RECENT_ATTENDANCE_CACHE_STATS["hits"], ("miss",): RECENT_ATTENDANCE_CACHE_STATS["misses"]},
+    metric_type="counter", labelnames=["result"]))
+
+def _remember_attendance(matricula, timestamp):
+    with _recent_attendances_lock:
+        previous = _recent_attendances.get(matricula)
+        if previous is None or timestamp > previous:
+            _recent_attendances[matricula] = timestamp
+        _recent_attendances.move_to_end(matricula)
+        while len(_recent_attendances) > RECENT_ATTENDANCE_CACHE_SIZE:
+            _recent_attendances.popitem(last=False)
+
+def _recently_attended(matricula, cooldown_minutes):
+    # True se o cache sabe de uma frequência dentro do cooldown; False significa "não sei" (consultar o banco)
+    with _recent_attendances_lock:
+        timestamp = _recent_attendances.get(matricula)
+        if timestamp is not None and datetime.now() - timestamp < timedelta(minutes=cooldown_minutes):
+            RECENT_ATTENDANCE_CACHE_STATS["hits"] += 1
+            return True
+        if timestamp is not None and datetime.now() - timestamp >= timedelta(minutes=COOLDOWN_PERIOD_MINUTES):
+            del _recent_attendances[matricula] # Expirada (TTL = cooldown padrão)
+        RECENT_ATTENDANCE_CACHE_STATS["misses"] += 1
+        return False
+
+def invalidate_recent_attendance(matricula=None):
+    with _recent_attendances_lock:
+        if matricula is None:
+            _recent_attendances.clear()
+        else:
+            _recent_attendances.pop(matricula, None)
+
 def register_attendance_in_db(matricula, client_ip=None):
     conn = get_db_connection()
     try:
@@ -70,6 +377,7 @@ def register_attendance_in_db(matricula, client_ip=None):
             VALUES (?, ?, ?)
         ''', (matricula, current_time, client_ip))
         conn.commit()
+        _remember_attendance(matricula, datetime.fromisoformat(current_time))
         print(f"Frequência registrada para {matricula} de IP {client_ip} em {current_time} (services/database.py)")
         return True
     except Exception as e:
@@ -80,24 +388,127 @@ def register_attendance_in_db(matricula, client_ip=None):
         conn.close()
 
 def is_duplicate_attendance(matricula, cooldown_minutes=COOLDOWN_PERIOD_MINUTES):
+    with timed("cooldown_check"):
+        return _is_duplicate_attendance(matricula, cooldown_minutes)
+
+def _is_duplicate_attendance(matricula, cooldown_minutes):
+    if _recently_attended(matricula, cooldown_minutes):
+        return True
     conn = get_db_connection()
     try:
         cursor = conn.cursor()
         limit_time = datetime.now() - timedelta(minutes=cooldown_minutes)
         
+        # Com o índice (student_matricula, timestamp) isso é uma busca pontual, independente do histórico
         cursor.execute('''
-            SELECT COUNT(*) FROM attendances
+            SELECT 1 FROM attendances
             WHERE student_matricula = ? AND timestamp >= ?
+            LIMIT 1
         ''', (matricula, limit_time.isoformat()))
         
-        count = cursor.fetchone()[0]
-        return count > 0
+        return cursor.fetchone() is not None
     except Exception as e:
         print(f"Erro ao verificar duplicidade de frequência (services/database.py) para {matricula}: {e}")
         return False
     finally:
         conn.close()
 
+def register_attendance_if_not_duplicate(matricula, client_ip=None, cooldown_minutes=COOLDOWN_PERIOD_MINUTES):
+    # Verificação de cooldown e inserção em um único comando: o SQLite executa o INSERT ... SELECT
+    # com o lock de escrita, então dois quadros simultâneos do mesmo aluno não passam os dois.
+    # Retorna "recorded", "duplicate" ou None em caso de erro.
+    with timed("cooldown_check"):
+        recently_attended = _recently_attended(matricula, cooldown_minutes)
+    if recently_attended:
+        return "duplicate" # Respondido pelo cache, sem ir ao banco
+    with timed("attendance_insert"):
+        return _insert_attendance_if_not_duplicate(matricula, client_ip, cooldown_minutes)
+
+def _insert_attendance_if_not_duplicate(matricula, client_ip, cooldown_minutes):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        now = datetime.now()
+        current_time = now.isoformat()
+        limit_time = (now - timedelta(minutes=cooldown_minutes)).isoformat()
+        cursor.execute('''
+            INSERT INTO attendances (student_matricula, timestamp, client_ip)
+            SELECT ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM attendances
+                WHERE student_matricula = ? AND timestamp >= ?
+            )
+        ''', (matricula, current_time, client_ip, matricula, limit_time))
+        conn.commit()
+        if cursor.rowcount == 0:
+            # Registrada por outro worker/quadro: guarda o horário para os próximos quadros
+            last = conn.execute(
+                'SELECT MAX(timestamp) FROM attendances WHERE student_matricula = ?', (matricula,)
+            ).fetchone()[0]
+            if last:
+                _remember_attendance(matricula, datetime.fromisoformat(last))
+            return "duplicate"
+        _remember_attendance(matricula, now)
+        print(f"Frequência registrada para {matricula} de IP {client_ip} em {current_time} (services/database.py)")
+        return "recorded"
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao registrar frequência para {matricula} (services/database.py): {e}")
+        return None
+    finally:
+        conn.close()
+
+def register_attendances_if_not_duplicate(matriculas, client_ip=None, cooldown_minutes=COOLDOWN_PERIOD_MINUTES):
+    # Versão em lote de register_attendance_if_not_duplicate (modo grupo): todas as frequências
+    # do quadro são gravadas em uma única transação, com o mesmo INSERT condicional por aluno.
+    # Retorna um dict matricula -> "recorded" / "duplicate" (None para as que não puderam ser gravadas).
+    statuses = {}
+    pending = []
+    with timed("cooldown_check"):
+        for matricula in dict.fromkeys(matriculas):
+            if _recently_attended(matricula, cooldown_minutes):
+                statuses[matricula] = "duplicate"
+            else:
+                pending.append(matricula)
+    if not pending:
+        return statuses
+    with timed("attendance_insert"):
+        return _insert_attendances_if_not_duplicate(pending, statuses, client_ip, cooldown_minutes)
+
+def _insert_attendances_if_not_duplicate(pending, statuses, client_ip, cooldown_minutes):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        now = datetime.now()
+        current_time = now.isoformat()
+        limit_time = (now - timedelta(minutes=cooldown_minutes)).isoformat()
+        for matricula in pending:
+            cursor.execute('''
+                INSERT INTO attendances (student_matricula, timestamp, client_ip)
+                SELECT ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM attendances
+                    WHERE student_matricula = ? AND timestamp >= ?
+                )
+            ''', (matricula, current_time, client_ip, matricula, limit_time))
+            statuses[matricula] = "recorded" if cursor.rowcount > 0 else "duplicate"
+        conn.commit()
+        for matricula in pending:
+            if statuses[matricula] == "recorded":
+                _remember_attendance(matricula, now)
+        recorded = [m for m in pending if statuses[m] == "recorded"]
+        if recorded:
+            print(f"Frequência registrada para {', '.join(recorded)} de IP {client_ip} em {current_time} (services/database.py)")
+        return statuses
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao registrar frequências em lote (services/database.py): {e}")
+        for matricula in pending:
+            statuses[matricula] = None # Transação desfeita: nenhuma das pendentes foi gravada
+        return statuses
+    finally:
+        conn.close()
+
 # Funções para consultar alunos e unidades, se necessário para outras partes do backend
 def get_student_by_matricula(matricula):
     conn = get_db_connection()
@@ -129,7 +540,45 @@ def add_student_to_db(name, matricula, turma, turno, idade, image_path, school_u
     finally:
         conn.close()
 
-def get_students_by_school_unit(school_unit_id):
+def get_existing_matriculas(matriculas):
+    # Quais das matrículas informadas já estão cadastradas (consulta em blocos por causa do limite de parâmetros do SQLite)
+    matriculas = list(matriculas)
+    existing = set()
+    conn = get_db_connection()
+    try:
+        for i in range(0, len(matriculas), 500):
+            chunk = matriculas[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(f'SELECT matricula FROM students WHERE matricula IN ({placeholders})', chunk).fetchall()
+            existing.update(row["matricula"] for row in rows)
+    finally:
+        conn.close()
+    return existing
+
+def add_students_bulk_to_db(students):
+    # Insere vários alunos em uma única transação.
+    # Retorna um dict matricula -> True (inserido) / False (matrícula duplicada).
+    conn = get_db_connection()
+    results = {}
+    try:
+        cursor = conn.cursor()
+        for student in students:
+            cursor.execute('''
+                INSERT OR IGNORE INTO students (name, matricula, turma, turno, idade, image_path, school_unit_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (student["name"], student["matricula"], student["turma"], student["turno"],
+                  student["idade"], student["image_path"], student.get("school_unit_id")))
+            results[student["matricula"]] = cursor.rowcount > 0
+        conn.commit()
+        return results
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao adicionar alunos em lote ao DB: {e}")
+        raise
+    finally:
+        conn.close()
+
+def get_students_by_school_unit(school_unit_id, search_query=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     query = '''
@@ -146,7 +595,12 @@ def get_students_by_school_unit(school_unit_id):
         LEFT JOIN school_units AS su ON s.school_unit_id = su.id
         WHERE s.school_unit_id = ?
     '''
-    students = cursor.execute(query, (school_unit_id,)).fetchall()
+    params = [school_unit_id]
+    if search_query:
+        condition, search_params = _student_search_condition(conn, search_query)
+        query += f" AND {condition}"
+        params.extend(search_params)
+    students = cursor.execute(query, params).fetchall()
     conn.close()
     return [dict(s) for s in students]
 
@@ -195,14 +649,69 @@ def delete_student_by_matricula(matricula):
     try:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM students WHERE matricula = ?', (matricula,))
+        deleted = cursor.rowcount
+        conn.execute('DELETE FROM student_face_samples WHERE student_matricula = ?', (matricula,))
         conn.commit()
-        return cursor.rowcount > 0
+        invalidate_recent_attendance(matricula)
+        return deleted > 0
     except Exception as e:
         conn.rollback()
         print(f"Erro ao deletar aluno {matricula} do DB: {e}")
         return False
     finally:
         conn.close()
+
+# --- Amostras de rosto (modelos com várias amostras por aluno) ---
+def get_face_samples(matricula):
+    # Lista de {"embedding" (bytes float32), "source", "distance", "created_at"}, da mais antiga para a mais nova
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('''
+            SELECT embedding, source, distance, created_at FROM student_face_samples
+            WHERE student_matricula = ? ORDER BY id
+        ''', (matricula,)).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def add_face_samples(matricula, samples, max_samples):
+    # samples: lista de (embedding_bytes, source, distance). Mantém no máximo max_samples por aluno:
+    # descarta primeiro as amostras coletadas no quiosque mais antigas, depois as de cadastro mais antigas.
+    # Retorna todas as amostras do aluno depois da inserção (mesmo formato de get_face_samples).
+    conn = get_db_connection()
+    try:
+        now = datetime.now().isoformat()
+        conn.executemany('''
+            INSERT INTO student_face_samples (student_matricula, embedding, source, distance, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(matricula, embedding, source, distance, now) for embedding, source, distance in samples])
+        conn.execute('''
+            DELETE FROM student_face_samples WHERE id IN (
+                SELECT id FROM student_face_samples WHERE student_matricula = ?
+                ORDER BY source = 'kiosk' DESC, id
+                LIMIT MAX((SELECT COUNT(*) FROM student_face_samples WHERE student_matricula = ?) - ?, 0)
+            )
+        ''', (matricula, matricula, max_samples))
+        rows = conn.execute('''
+            SELECT embedding, source, distance, created_at FROM student_face_samples
+            WHERE student_matricula = ? ORDER BY id
+        ''', (matricula,)).fetchall()
+        conn.commit()
+        return [dict(row) for row in rows]
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao salvar amostras de rosto do aluno {matricula} (services/database.py): {e}")
+        raise
+    finally:
+        conn.close()
+
+def delete_face_samples(matricula):
+    conn = get_db_connection()
+    try:
+        conn.execute('DELETE FROM student_face_samples WHERE student_matricula = ?', (matricula,))
+        conn.commit()
+    finally:
+        conn.close()
         
 def get_school_unit(unit_id):
     conn = get_db_connection()
@@ -225,6 +734,7 @@ def add_school_unit_to_db(name, ip_range_start, ip_range_end):
             VALUES (?, ?, ?)
         ''', (name, ip_range_start, ip_range_end))
         conn.commit()
+        invalidate_ip_range_table()
         return cursor.lastrowid
     except sqlite3.IntegrityError:
         return None # Unidade já existe
@@ -234,6 +744,78 @@ def add_school_unit_to_db(name, ip_range_start, ip_range_end):
     finally:
         conn.close()
 
+# --- Resolução de unidade escolar pelo IP do cliente ---
+# As faixas ip_range_start/ip_range_end são convertidas para inteiros e ordenadas uma vez.
+# Cada consulta é então uma busca binária (bisect) em vez de varrer a tabela school_units.
+_ip_range_lock = threading.Lock()
+_ip_range_table = None # (starts, ends, prefix_max_ends, unit_ids, carregado_em)
+
+def _ip_to_int(ip_str):
+    try:
+        ip = ipaddress.ip_address(ip_str.strip())
+    except (ValueError, AttributeError):
+        return None
+    if ip.version == 6 and ip.ipv4_mapped: # ::ffff:192.168.0.10 -> 192.168.0.10
+        ip = ip.ipv4_mapped
+    return int(ip)
+
+def _build_ip_range_table():
+    ranges = []
+    for unit in get_all_school_units():
+        start = _ip_to_int(unit["ip_range_start"]) if unit["ip_range_start"] else None
+        end = _ip_to_int(unit["ip_range_end"]) if unit["ip_range_end"] else None
+        if start is None:
+            continue
+        if end is None:
+            end = start # Faixa de um único IP
+        if end < start:
+            start, end = end, start
+        ranges.append((start, end, unit["id"]))
+    ranges.sort()
+
+    starts = [r[0] for r in ranges]
+    ends = [r[1] for r in ranges]
+    unit_ids = [r[2] for r in ranges]
+    # prefix_max_ends[i] = maior fim entre as faixas 0..i; permite parar a busca cedo quando há sobreposição
+    prefix_max_ends = []
+    current_max = -1
+    for end in ends:
+        current_max = max(current_max, end)
+        prefix_max_ends.append(current_max)
+    return starts, ends, prefix_max_ends, unit_ids, time.monotonic()
+
+def invalidate_ip_range_table():
+    global _ip_range_table
+    with _ip_range_lock:
+        _ip_range_table = None
+
+def resolve_school_unit_by_ip(client_ip):
+    # Retorna o id da unidade escolar cuja faixa contém client_ip, ou None
+    global _ip_range_table
+    ip_value = _ip_to_int(client_ip) if client_ip else None
+    if ip_value is None:
+        return None
+
+    with _ip_range_lock:
+        table = _ip_range_table
+        if table is None or time.monotonic() - table[4] > IP_RANGE_TABLE_TTL_SECONDS:
+            try:
+                table = _build_ip_range_table()
+            except Exception as e:
+                print(f"Erro ao carregar faixas de IP das unidades escolares (services/database.py): {e}")
+                return None
+            _ip_range_table = table
+
+    starts, ends, prefix_max_ends, unit_ids, _ = table
+    i = bisect.bisect_right(starts, ip_value) - 1
+    # Percorre para trás apenas enquanto alguma faixa anterior ainda pode conter o IP.
+    # A primeira encontrada é a de início mais alto, ou seja, a mais específica.
+    while i >= 0 and prefix_max_ends[i] >= ip_value:
+        if ends[i] >= ip_value:
+            return unit_ids[i]
+        i -= 1
+    return None
+
 def update_school_unit_in_db(unit_id, name, ip_range_start, ip_range_end):
     conn = get_db_connection()
     try:
@@ -244,6 +826,7 @@ def update_school_unit_in_db(unit_id, name, ip_range_start, ip_range_end):
             WHERE id = ?
         ''', (name, ip_range_start, ip_range_end, unit_id))
         conn.commit()
+        invalidate_ip_range_table()
         return cursor.rowcount > 0
     except Exception as e:
         print(f"Erro ao atualizar unidade escolar no DB: {e}")
@@ -257,6 +840,7 @@ def delete_school_unit_from_db(unit_id):
         cursor = conn.cursor()
         cursor.execute('DELETE FROM school_units WHERE id = ?', (unit_id,))
         conn.commit()
+        invalidate_ip_range_table()
         return cursor.rowcount > 0
     except Exception as e:
         print(f"Erro ao deletar unidade escolar do DB: {e}")
@@ -264,10 +848,11 @@ def delete_school_unit_from_db(unit_id):
     finally:
         conn.close()
 
-def get_attendances_from_db(start_date_str, end_date_str, turma, search_query, school_unit_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+ATTENDANCE_PAGE_SIZE_DEFAULT = 100
+ATTENDANCE_PAGE_SIZE_MAX = 500
+ATTENDANCE_FETCH_SIZE = 500 # Linhas buscadas do cursor por vez nas consultas em streaming
 
+def _build_attendances_query(start_date_str, end_date_str, turma, search_query, school_unit_id, conn):
     query = '''
         SELECT 
             a.id, 
@@ -300,16 +885,165 @@ def get_attendances_from_db(start_date_str, end_date_str, turma, search_query, s
         params.append(turma)
 
     if search_query:
-        query += " AND (s.matricula LIKE ? OR s.name LIKE ?)"
-        params.append(f"%{search_query}%")
-        params.append(f"%{search_query}%")
+        condition, search_params = _student_search_condition(conn, search_query)
+        query += f" AND {condition}"
+        params.extend(search_params)
     
     if school_unit_id:
         query += " AND s.school_unit_id = ?"
         params.append(school_unit_id)
 
-    query += " ORDER BY a.timestamp DESC"
+    return query, params
+
+def get_attendances_from_db(start_date_str, end_date_str, turma, search_query, school_unit_id):
+    return list(iter_attendances_from_db(start_date_str, end_date_str, turma, search_query, school_unit_id))
+
+def iter_attendances_from_db(start_date_str, end_date_str, turma, search_query, school_unit_id, fetch_size=ATTENDANCE_FETCH_SIZE):
+    # Monta e executa a consulta já na chamada (filtros inválidos levantam ValueError aqui, antes de a
+    # rota começar a responder em streaming) e retorna um gerador que percorre o resultado em blocos
+    # de fetch_size linhas, sem materializar a consulta inteira.
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        query, params = _build_attendances_query(start_date_str, end_date_str, turma, search_query, school_unit_id, conn)
+        query += " ORDER BY a.timestamp DESC, a.id DESC"
+        cursor.execute(query, params)
+    except Exception:
+        cursor.close()
+        conn.close()
+        raise
+    return _iter_cursor_rows(conn, cursor, fetch_size)
+
+def _iter_cursor_rows(conn, cursor, fetch_size):
+    try:
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        cursor.close()
+        conn.close()
+
+def encode_attendance_cursor(timestamp, attendance_id):
+    raw = json.dumps([timestamp, attendance_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_attendance_cursor(cursor_str):
+    # Levanta ValueError se o cursor for inválido
+    try:
+        timestamp, attendance_id = json.loads(base64.urlsafe_b64decode(cursor_str.encode('ascii')))
+        return str(timestamp), int(attendance_id)
+    except Exception:
+        raise ValueError("Cursor de paginação inválido.")
+
+def get_attendances_page(start_date_str, end_date_str, turma, search_query, school_unit_id, cursor=None, limit=None):
+    # Paginação por keyset em (timestamp, id): cada página continua logo após a última linha da anterior,
+    # usando o índice (timestamp, id) em vez de OFFSET (que relê todas as linhas puladas).
+    # Retorna {"items": [...], "next_cursor": str ou None}.
+    limit = min(max(int(limit or ATTENDANCE_PAGE_SIZE_DEFAULT), 1), ATTENDANCE_PAGE_SIZE_MAX)
+    conn = get_db_connection()
+    query, params = _build_attendances_query(start_date_str, end_date_str, turma, search_query, school_unit_id, conn)
+    if cursor:
+        last_timestamp, last_id = decode_attendance_cursor(cursor)
+        query += " AND (a.timestamp, a.id) < (?, ?)"
+        params.extend([last_timestamp, last_id])
+    query += " ORDER BY a.timestamp DESC, a.id DESC LIMIT ?"
+    params.append(limit + 1) # Uma linha extra indica se existe próxima página
+
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_attendance_cursor(items[-1]["timestamp"], items[-1]["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _summary_filters(alias, start_date_str, end_date_str, school_unit_id, turma, turno):
+    conditions = []
+    params = []
+    if start_date_str:
+        datetime.strptime(start_date_str, '%Y-%m-%d') # Valida o formato (ValueError se inválido)
+        conditions.append(f"{alias}.day >= ?")
+        params.append(start_date_str)
+    if end_date_str:
+        datetime.strptime(end_date_str, '%Y-%m-%d')
+        conditions.append(f"{alias}.day <= ?")
+        params.append(end_date_str)
+    if school_unit_id:
+        conditions.append(f"{alias}.school_unit_id = ?")
+        params.append(school_unit_id)
+    if turma:
+        conditions.append(f"{alias}.turma = ?")
+        params.append(turma)
+    if turno:
+        conditions.append(f"{alias}.turno = ?")
+        params.append(turno)
+    return ''.join(f" AND {c}" for c in conditions), params
+
+def get_daily_attendance_summary(start_date_str=None, end_date_str=None, school_unit_id=None, turma=None, turno=None):
+    # Presença diária por unidade/turma/turno, lida da tabela pré-agregada (mantida pelos triggers).
+    # enrolled_count é o número atual de alunos cadastrados no grupo.
+    where, params = _summary_filters('d', start_date_str, end_date_str, school_unit_id, turma, turno)
+    query = f'''
+        SELECT
+            d.day,
+            NULLIF(d.school_unit_id, 0) AS school_unit_id,
+            su.name AS school_unit_name,
+            d.turma,
+            d.turno,
+            d.present_count,
+            d.attendance_count,
+            COALESCE(e.enrolled_count, 0) AS enrolled_count
+        FROM daily_attendance_summary AS d
+        LEFT JOIN (
+            SELECT COALESCE(school_unit_id, 0) AS school_unit_id, turma, turno, COUNT(*) AS enrolled_count
+            FROM students
+            GROUP BY COALESCE(school_unit_id, 0), turma, turno
+        ) AS e ON e.school_unit_id = d.school_unit_id AND e.turma = d.turma AND e.turno = d.turno
+        LEFT JOIN school_units AS su ON su.id = d.school_unit_id
+        WHERE 1=1 {where}
+        ORDER BY d.day DESC, su.name, d.turma, d.turno
+    '''
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+
+    summary = []
+    for row in rows:
+        item = dict(row)
+        item["presence_rate"] = round(item["present_count"] / item["enrolled_count"], 4) if item["enrolled_count"] else None
+        summary.append(item)
+    return summary
+
+def get_absent_students(day_str, school_unit_id=None, turma=None, turno=None):
+    # Alunos cadastrados sem presença no dia (consulta pontual em daily_presence pela chave (day, matricula))
+    datetime.strptime(day_str, '%Y-%m-%d')
+    query = '''
+        SELECT s.matricula, s.name, s.turma, s.turno, s.school_unit_id, su.name AS school_unit_name
+        FROM students AS s
+        LEFT JOIN school_units AS su ON s.school_unit_id = su.id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM daily_presence AS p
+            WHERE p.day = ? AND p.student_matricula = s.matricula
+        )
+    '''
+    params = [day_str]
+    if school_unit_id:
+        query += " AND s.school_unit_id = ?"
+        params.append(school_unit_id)
+    if turma:
+        query += " AND s.turma = ?"
+        params.append(turma)
+    if turno:
+        query += " AND s.turno = ?"
+        params.append(turno)
+    query += " ORDER BY su.name, s.turma, s.turno, s.name"
 
-    attendances = cursor.execute(query, params).fetchall()
+    conn = get_db_connection()
+    rows = conn.execute(query, params).fetchall()
     conn.close()
-    return [dict(att) for att in attendances]
\ No newline at end of file
+    return [dict(row) for row in rows]
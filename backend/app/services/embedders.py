@@ -0,0 +1,155 @@
+import os
+import threading
+import numpy as np
+from deepface import DeepFace
+from deepface.modules import preprocessing
+
+# Backends de detecção + embedding usados pelo serviço de inferência (services/inference.py).
+# Todos têm a mesma interface (detect/embed/represent/warm_up):
+#   - DeepFaceEmbedder: ArcFace no TensorFlow/Keras, via DeepFace (padrão)
+#   - OnnxEmbedder:     o mesmo ArcFace exportado para ONNX (python -m app.export_onnx) e executado
+#                       no ONNX Runtime (CPU), opcionalmente quantizado em int8. Não carrega os pesos
+#                       do ArcFace no TensorFlow, o que reduz a memória de cada worker e a latência na CPU.
+# A detecção é a mesma nos dois: o detector SSD do DeepFace já roda no OpenCV DNN (não no
+# TensorFlow), e compartilhar a detecção e o alinhamento mantém os recortes idênticos entre backends.
+# O backend é escolhido por EMBEDDER_BACKEND ("deepface" ou "onnx").
+# Os embeddings da galeria não são recalculados ao trocar de backend: valide antes com
+# python -m app.embedder_parity.
+
+EMBEDDER_BACKEND = os.environ.get("EMBEDDER_BACKEND", "deepface").lower()
+RECOGNITION_MODEL = "ArcFace"
+DETECTOR_MODEL = "ssd"
+
+# Mesmo diretório de dados de services/face_recognition.py (não importado aqui para manter este
+# módulo leve nos processos do cadastro em lote)
+DATA_DIR = os.environ.get("APP_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR") or os.path.join(DATA_DIR, 'models')
+ONNX_QUANTIZED = os.environ.get("ONNX_QUANTIZED", "0") == "1" # Usa o modelo int8 gerado com --quantize
+ONNX_INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", "0")) # 0 = padrão do ONNX Runtime (todos os núcleos)
+
+
+def onnx_model_path(quantized=None, model_dir=None):
+    quantized = ONNX_QUANTIZED if quantized is None else quantized
+    filename = f"{RECOGNITION_MODEL.lower()}{'.int8' if quantized else ''}.onnx"
+    return os.path.join(model_dir or ONNX_MODEL_DIR, filename)
+
+
+def preprocess_faces(faces, target_size):
+    # Mesmo pré-processamento do DeepFace.represent: RGB -> BGR, redimensiona com padding para o
+    # tamanho de entrada do modelo e normalização "base". Retorna o lote (n, altura, largura, 3).
+    batch = []
+    for face in faces:
+        face = face[:, :, ::-1]
+        face = preprocessing.resize_image(img=face, target_size=(target_size[1], target_size[0]))
+        batch.append(preprocessing.normalize_input(img=face, normalization="base"))
+    return np.concatenate(batch).astype(np.float32)
+
+
+class Embedder:
+    name = None
+
+    def __init__(self, detector_backend=DETECTOR_MODEL):
+        self.detector_backend = detector_backend
+
+    def detect(self, img, enforce_detection=False):
+        # Lista de rostos ({"face" RGB float 0-1, "facial_area", "confidence"}), alinhados pelos olhos
+        return DeepFace.extract_faces(
+            img_path=img,
+            detector_backend=self.detector_backend,
+            enforce_detection=enforce_detection,
+            align=True
+        )
+
+    def embed(self, faces):
+        # faces -> matriz (n, dim), um forward pass para o lote todo
+        raise NotImplementedError
+
+    def represent(self, img, enforce_detection=True):
+        # Equivalente ao DeepFace.represent, sem o serviço de inferência (processos do cadastro em lote)
+        faces = self.detect(img, enforce_detection=enforce_detection)
+        if not faces:
+            return []
+        embeddings = self.embed([face_obj["face"] for face_obj in faces])
+        return [
+            {"embedding": embedding.tolist(), "facial_area": face_obj["facial_area"], "face_confidence": face_obj.get("confidence")}
+            for face_obj, embedding in zip(faces, embeddings)
+        ]
+
+    def warm_up(self):
+        DeepFace.build_model(model_name=self.detector_backend, task="face_detector")
+
+    def describe(self):
+        return f"{self.name}:{RECOGNITION_MODEL}/{self.detector_backend}"
+
+
+class DeepFaceEmbedder(Embedder):
+    name = "deepface"
+
+    def __init__(self, model_name=RECOGNITION_MODEL, detector_backend=DETECTOR_MODEL):
+        super().__init__(detector_backend)
+        self.model_name = model_name
+
+    def embed(self, faces):
+        model = DeepFace.build_model(model_name=self.model_name) # Cacheado internamente pelo DeepFace
+        return model.model(preprocess_faces(faces, model.input_shape), training=False).numpy()
+
+    def warm_up(self):
+        DeepFace.build_model(model_name=self.model_name)
+        super().warm_up()
+
+
+class OnnxEmbedder(Embedder):
+    name = "onnx"
+
+    def __init__(self, model_path=None, detector_backend=DETECTOR_MODEL, intra_op_threads=None):
+        super().__init__(detector_backend)
+        self.model_path = model_path or onnx_model_path()
+        self.intra_op_threads = ONNX_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+        self.input_shape = None
+        self._session = None
+        self._input_name = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        if self._session is not None:
+            return self._session
+        with self._lock:
+            if self._session is not None:
+                return self._session
+            try:
+                import onnxruntime as ort
+            except ImportError:
+                raise RuntimeError("EMBEDDER_BACKEND=onnx exige o pacote onnxruntime (pip install onnxruntime).")
+            if not os.path.exists(self.model_path):
+                raise RuntimeError(f"Modelo ONNX não encontrado em {self.model_path}. Gere com: python -m app.export_onnx")
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.intra_op_threads:
+                options.intra_op_num_threads = self.intra_op_threads
+            session = ort.InferenceSession(self.model_path, sess_options=options, providers=["CPUExecutionProvider"])
+            model_input = session.get_inputs()[0]
+            # Entrada NHWC exportada do Keras: [lote, altura, largura, 3]
+            self.input_shape = (int(model_input.shape[2]), int(model_input.shape[1]))
+            self._input_name = model_input.name
+            self._session = session
+        return self._session
+
+    def embed(self, faces):
+        session = self._get_session()
+        return session.run(None, {self._input_name: preprocess_faces(faces, self.input_shape)})[0]
+
+    def warm_up(self):
+        self._get_session()
+        super().warm_up()
+
+    def describe(self):
+        return f"{self.name}:{os.path.basename(self.model_path)}/{self.detector_backend}"
+
+
+def create_embedder(backend=None):
+    backend = (backend or EMBEDDER_BACKEND).lower()
+    if backend == "onnx":
+        return OnnxEmbedder()
+    if backend != "deepface":
+        print(f"Backend de embedding desconhecido '{backend}', usando 'deepface' (services/embedders.py)")
+    return DeepFaceEmbedder()
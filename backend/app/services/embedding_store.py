@@ -0,0 +1,387 @@
+import os
+import json
+import fcntl
+import pickle
+import numpy as np
+
+# Armazenamento binário dos embeddings dos alunos.
+# Substitui o embeddings.pkl, que era reescrito inteiro a cada cadastro/remoção e
+# desserializado por completo em cada worker do gunicorn.
+#
+# Layout em disco (STORE_DIR):
+#   manifest.json          -> {"epoch": N, "dim": 512}; aponta para os arquivos da época atual
+#   vectors.<epoch>.f32    -> matriz float32 (linhas de tamanho dim), só cresce (append)
+#   log.<epoch>.jsonl      -> log de operações: {"op": "add", "row": i, ...metadados} ou {"op": "del", "matricula": ...}
+#                             Um registro com exemplares (modelo com várias amostras) ocupa "rows" linhas
+#                             consecutivas: o centroide ("embedding") seguido dos "exemplars".
+#   store.lock             -> lock de arquivo (fcntl) para serializar escritas entre workers
+#   generation             -> "<epoch> <geração> <offset_do_log>"; incrementado a cada escrita
+#
+# Cadastrar = acrescentar uma linha no arquivo de vetores + uma linha no log (O(1)).
+# Remover = acrescentar um "del" (tombstone) no log.
+# Cada worker abre o arquivo de vetores com np.memmap somente leitura, então os 4 workers
+# compartilham a mesma cópia no page cache do sistema operacional.
+# A compactação grava uma nova época só com as linhas vivas e troca o manifest atomicamente;
+# workers que ainda estão com a época antiga aberta continuam funcionando até recarregar.
+#
+# Coerência entre workers: cada worker guarda a (época, geração, offset do log) que já aplicou.
+# Ler o arquivo "generation" é barato; se só a geração mudou, o worker lê apenas as entradas
+# novas do log a partir do seu offset (delta). Se a época mudou (compactação), recarrega tudo.
+
+COMPACTION_MIN_DEAD_ROWS = int(os.environ.get("EMBEDDINGS_COMPACTION_MIN_DEAD_ROWS", "256"))
+COMPACTION_DEAD_RATIO = float(os.environ.get("EMBEDDINGS_COMPACTION_DEAD_RATIO", "0.25"))
+
+METADATA_FIELDS = ("name", "matricula", "image_path", "school_unit_id")
+
+
+class EmbeddingStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.lock_path = os.path.join(directory, 'store.lock')
+        self.generation_path = os.path.join(directory, 'generation')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.epoch = 0
+        self.dim = None
+        # Contagem de linhas da época atual, usada para decidir a compactação. Como vários workers
+        # escrevem na mesma época, ela é atualizada com o lock, a partir do log (ver _sync_row_counts),
+        # e não só com as escritas deste processo.
+        self.total_rows = 0 # Linhas gravadas no arquivo de vetores
+        self.live_rows = 0
+        self._rows_by_matricula = {} # Linhas vivas de cada registro (para contar as mortas ao substituir)
+        self._counted_epoch = None # Época e offset do log até onde as contagens acima já foram aplicadas
+        self._counted_offset = 0
+
+    def vectors_path(self, epoch=None):
+        return os.path.join(self.directory, f'vectors.{self.epoch if epoch is None else epoch}.f32')
+
+    def log_path(self, epoch=None):
+        return os.path.join(self.directory, f'log.{self.epoch if epoch is None else epoch}.jsonl')
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def _lock(self):
+        lock_file = open(self.lock_path, 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _read_manifest(self):
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+        self.epoch = manifest["epoch"]
+        self.dim = manifest.get("dim")
+
+    def _write_manifest(self, epoch, dim):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"epoch": epoch, "dim": dim}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path) # Troca atômica: leitores veem a época antiga ou a nova
+
+    def read_generation(self):
+        # Retorna (epoch, generation, log_offset) publicados pela última escrita de qualquer worker
+        try:
+            with open(self.generation_path, 'r') as f:
+                epoch, generation, log_offset = f.read().split()
+            return int(epoch), int(generation), int(log_offset)
+        except (OSError, ValueError):
+            return 0, 0, 0
+
+    def _write_generation(self, epoch, generation, log_offset):
+        tmp_path = self.generation_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(f"{epoch} {generation} {log_offset}")
+        os.replace(tmp_path, self.generation_path)
+
+    def _bump_generation(self, previous_state):
+        # Chamado com o lock de escrita adquirido, logo após acrescentar ao log.
+        # Retorna (estado_anterior, estado_novo), cada um (epoch, generation, log_offset): quem escreveu e
+        # estava sincronizado no estado anterior pode avançar direto para o novo sem reler o próprio delta.
+        _, generation, _ = previous_state
+        log_offset = os.path.getsize(self.log_path()) if os.path.exists(self.log_path()) else 0
+        new_state = (self.epoch, generation + 1, log_offset)
+        self._write_generation(*new_state)
+        return previous_state, new_state
+
+    def _open_vectors(self):
+        # Mapeia o arquivo de vetores somente leitura; nada é copiado para a memória do processo
+        path = self.vectors_path()
+        if self.dim is None or not os.path.exists(path):
+            return np.empty((0, 0), dtype=np.float32)
+        rows = os.path.getsize(path) // (4 * self.dim)
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+
+    @staticmethod
+    def _read_log_entries(path, offset=0):
+        # Lê as entradas do log a partir de um offset em bytes; ignora uma última linha incompleta
+        entries = []
+        if not os.path.exists(path):
+            return entries, offset
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break # Escrita em andamento (ou interrompida); será lida na próxima vez
+                offset += len(line)
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    print(f"Entrada inválida ignorada no log de embeddings {path} (services/embedding_store.py)")
+        return entries, offset
+
+    @staticmethod
+    def _record_vectors(record):
+        vectors = [np.asarray(record["embedding"], dtype=np.float32).reshape(-1)]
+        exemplars = record.get("exemplars")
+        if exemplars is not None and len(exemplars):
+            vectors.extend(np.asarray(exemplar, dtype=np.float32).reshape(-1) for exemplar in exemplars)
+        return vectors
+
+    @staticmethod
+    def _log_entry(row, record, rows):
+        entry = {"op": "add", "row": row}
+        if rows > 1:
+            entry["rows"] = rows
+        entry.update({field: record.get(field) for field in METADATA_FIELDS})
+        return entry
+
+    @staticmethod
+    def _record_from_entry(entry, vectors):
+        # Registro de uma entrada "add"; None se os vetores ainda não estão visíveis
+        # (não deveria ocorrer: os vetores são gravados antes do log)
+        row = entry["row"]
+        rows = entry.get("rows", 1)
+        if vectors is None or row + rows > vectors.shape[0]:
+            return None
+        record = {field: entry.get(field) for field in METADATA_FIELDS}
+        record["embedding"] = vectors[row] # View do memmap, sem cópia
+        if rows > 1:
+            record["exemplars"] = vectors[row + 1:row + rows]
+        return record
+
+    def load(self):
+        # Retorna a lista de registros vivos ({name, matricula, embedding, image_path, school_unit_id}
+        # e, nos modelos com várias amostras, "exemplars")
+        records, _ = self.load_with_state()
+        return records
+
+    def load_with_state(self):
+        # Como load(), mas também retorna o estado (epoch, generation, log_offset) correspondente,
+        # lido com o lock para que nenhuma escrita fique entre o snapshot e o estado
+        if not self.exists():
+            return [], self.read_generation()
+        lock_file = self._lock()
+        try:
+            self._read_manifest()
+            _, generation, _ = self.read_generation()
+            vectors = self._open_vectors()
+            entries, log_offset = self._read_log_entries(self.log_path())
+        finally:
+            lock_file.close()
+        records = self._replay(entries, vectors, {})
+        self._set_row_counts(records.values(), vectors.shape[0], log_offset)
+        return list(records.values()), (self.epoch, generation, log_offset)
+
+    def read_delta(self, epoch, log_offset):
+        # Entradas do log da época informada a partir de log_offset, já resolvidas para registros.
+        # Retorna (mudancas, novo_offset); mudancas é uma lista de ("add", registro) ou ("del", matricula).
+        # Retorna (None, log_offset) se a época mudou (compactação) e é preciso recarregar tudo.
+        if not self.exists():
+            return [], log_offset
+        self._read_manifest()
+        if self.epoch != epoch:
+            return None, log_offset
+        entries, new_offset = self._read_log_entries(self.log_path(), log_offset)
+        vectors = self._open_vectors() if any(e.get("op") == "add" for e in entries) else None
+        changes = []
+        for entry in entries:
+            if entry.get("op") == "add":
+                record = EmbeddingStore._record_from_entry(entry, vectors)
+                if record is not None:
+                    changes.append(("add", record))
+            elif entry.get("op") == "del":
+                changes.append(("del", entry.get("matricula")))
+        return changes, new_offset
+
+    @staticmethod
+    def _replay(entries, vectors, records):
+        for entry in entries:
+            if entry.get("op") == "add":
+                record = EmbeddingStore._record_from_entry(entry, vectors)
+                if record is not None:
+                    records[record["matricula"]] = record
+            elif entry.get("op") == "del":
+                records.pop(entry.get("matricula"), None)
+        return records
+
+    def append(self, record):
+        return self.append_many([record])
+
+    def append_many(self, records):
+        # Acrescenta vários registros com um único lock, um fsync por arquivo e um incremento de geração.
+        # Retorna (estado_anterior, estado_novo) da geração (ver _bump_generation), ou None se não havia o que gravar.
+        if not records:
+            return None
+        record_vectors = [self._record_vectors(record) for record in records]
+        vectors = [vector for group in record_vectors for vector in group]
+        lock_file = self._lock()
+        try:
+            if self.exists():
+                self._read_manifest()
+            previous_state = self.read_generation()
+            if self.dim is None:
+                self.dim = vectors[0].shape[0]
+                self._write_manifest(self.epoch, self.dim)
+            for vector in vectors:
+                if vector.shape[0] != self.dim:
+                    raise ValueError(f"Embedding com dimensão {vector.shape[0]}, esperado {self.dim}")
+
+            with open(self.vectors_path(), 'ab') as f:
+                first_row = f.tell() // (4 * self.dim)
+                f.write(b''.join(vector.tobytes() for vector in vectors))
+                f.flush()
+                os.fsync(f.fileno())
+            entries = []
+            row = first_row
+            for record, group in zip(records, record_vectors):
+                entries.append(self._log_entry(row, record, len(group)))
+                row += len(group)
+            self._append_log(*entries)
+            transition = self._bump_generation(previous_state)
+            self._sync_row_counts()
+            should_compact = self.needs_compaction()
+        finally:
+            lock_file.close()
+        if should_compact:
+            self.compact(only_if_needed=True)
+        return transition
+
+    def delete(self, matricula):
+        # Retorna (estado_anterior, estado_novo) da geração, como append_many
+        lock_file = self._lock()
+        try:
+            if not self.exists():
+                return None
+            self._read_manifest()
+            previous_state = self.read_generation()
+            self._append_log({"op": "del", "matricula": matricula})
+            transition = self._bump_generation(previous_state)
+            self._sync_row_counts()
+            should_compact = self.needs_compaction()
+        finally:
+            lock_file.close()
+        if should_compact:
+            self.compact(only_if_needed=True)
+        return transition
+
+    def _append_log(self, *entries):
+        with open(self.log_path(), 'ab') as f:
+            f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _set_row_counts(self, records, total_rows, log_offset):
+        self._rows_by_matricula = {record["matricula"]: 1 + len(record.get("exemplars", ())) for record in records}
+        self.live_rows = sum(self._rows_by_matricula.values())
+        self.total_rows = total_rows
+        self._counted_epoch = self.epoch
+        self._counted_offset = log_offset
+
+    def _sync_row_counts(self):
+        # Chamado com o lock, depois de _read_manifest: aplica às contagens as entradas do log que
+        # ainda não foram contadas, inclusive as de outros workers (que, do contrário, pareceriam
+        # linhas mortas). Normalmente são só as entradas novas; a época inteira só é relida se
+        # este processo ainda não a contou (primeira escrita ou compactação feita por outro worker).
+        if self._counted_epoch != self.epoch:
+            self._rows_by_matricula = {}
+            self.live_rows = 0
+            self._counted_epoch = self.epoch
+            self._counted_offset = 0
+        entries, self._counted_offset = self._read_log_entries(self.log_path(), self._counted_offset)
+        for entry in entries:
+            if entry.get("op") == "add":
+                rows = entry.get("rows", 1)
+                # Substituir um registro (ex.: modelo atualizado) deixa as linhas antigas mortas
+                self.live_rows += rows - self._rows_by_matricula.get(entry.get("matricula"), 0)
+                self._rows_by_matricula[entry.get("matricula")] = rows
+            elif entry.get("op") == "del":
+                self.live_rows -= self._rows_by_matricula.pop(entry.get("matricula"), 0)
+        vectors_path = self.vectors_path()
+        self.total_rows = os.path.getsize(vectors_path) // (4 * self.dim) if self.dim and os.path.exists(vectors_path) else 0
+
+    def needs_compaction(self):
+        dead_rows = self.total_rows - self.live_rows
+        return dead_rows >= COMPACTION_MIN_DEAD_ROWS and dead_rows >= COMPACTION_DEAD_RATIO * max(self.total_rows, 1)
+
+    def _write_epoch(self, epoch, records, dim):
+        # Grava uma nova época completa (vetores + log) contendo apenas os registros informados
+        with open(self.vectors_path(epoch), 'wb') as vf, open(self.log_path(epoch), 'wb') as lf:
+            row = 0
+            for record in records:
+                vectors = self._record_vectors(record)
+                vf.write(b''.join(vector.tobytes() for vector in vectors))
+                lf.write((json.dumps(self._log_entry(row, record, len(vectors)), ensure_ascii=False) + '\n').encode('utf-8'))
+                row += len(vectors)
+            vf.flush()
+            os.fsync(vf.fileno())
+            lf.flush()
+            os.fsync(lf.fileno())
+
+    def compact(self, only_if_needed=False):
+        # only_if_needed: compactação automática; a condição é reavaliada com o lock, porque outro
+        # worker pode ter compactado (ou escrito) entre a decisão e este ponto
+        lock_file = self._lock()
+        try:
+            if not self.exists():
+                return
+            self._read_manifest()
+            if only_if_needed:
+                self._sync_row_counts()
+                if not self.needs_compaction():
+                    return
+            records = self._replay(self._read_log_entries(self.log_path())[0], self._open_vectors(), {})
+            records = list(records.values())
+            old_epoch = self.epoch
+            new_epoch = old_epoch + 1
+            self._write_epoch(new_epoch, records, self.dim)
+            self._write_manifest(new_epoch, self.dim)
+            self.epoch = new_epoch
+            _, generation, _ = self.read_generation()
+            self._write_generation(new_epoch, generation + 1, os.path.getsize(self.log_path()))
+            self._set_row_counts(records, sum(1 + len(record.get("exemplars", ())) for record in records),
+                                 os.path.getsize(self.log_path()))
+            for path in (self.vectors_path(old_epoch), self.log_path(old_epoch)):
+                if os.path.exists(path):
+                    os.remove(path) # Workers com memmap aberto mantêm o inode até recarregar
+            print(f"Embeddings compactados: época {new_epoch}, {len(records)} registros (services/embedding_store.py)")
+        finally:
+            lock_file.close()
+
+    def migrate_from_pickle(self, pickle_path):
+        # Migração única do embeddings.pkl antigo; o arquivo é renomeado para .migrated ao final
+        lock_file = self._lock()
+        try:
+            if self.exists() or not os.path.exists(pickle_path):
+                return False
+            with open(pickle_path, 'rb') as f:
+                legacy_records = pickle.load(f)
+            records = {}
+            for record in legacy_records:
+                if record.get("embedding") is not None:
+                    records[record["matricula"]] = record # O último registro de cada matrícula prevalece
+            records = list(records.values())
+            dim = len(records[0]["embedding"]) if records else None
+            self._write_epoch(1, records, dim)
+            self._write_manifest(1, dim)
+            self._write_generation(1, 1, os.path.getsize(self.log_path(1)))
+            os.replace(pickle_path, pickle_path + '.migrated')
+            print(f"{len(records)} embeddings migrados de {pickle_path} para {self.directory} (services/embedding_store.py)")
+            return True
+        finally:
+            lock_file.close()
@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+# Funções executadas nos processos do pool de cadastro em lote (ProcessPoolExecutor com "spawn").
+# Este módulo é propositalmente leve: não importa face_recognition (que carrega a galeria e
+# cria o serviço de inferência ao ser importado), só o backend de embedding dentro de cada processo.
+
+_embedder = None
+
+def init_worker(embedder_backend):
+    # Mesmo backend (DeepFace ou ONNX) do processo principal, para a galeria não misturar embeddings
+    global _embedder
+    from app.services.embedders import create_embedder
+    _embedder = create_embedder(embedder_backend)
+    _embedder.warm_up() # Carrega o modelo uma vez por processo
+
+def embed_image_bytes(image_bytes):
+    # Retorna ("ok", embedding) ou ("error", motivo)
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return "error", "invalid_image"
+    try:
+        embeddings = _embedder.represent(img, enforce_detection=True)
+    except ValueError as e:
+        if "Face could not be detected" in str(e):
+            return "error", "no_face_detected"
+        return "error", f"embedding_error: {e}"
+    except Exception as e:
+        return "error", f"embedding_error: {e}"
+    if not embeddings:
+        return "error", "no_face_detected"
+    return "ok", embeddings[0]["embedding"]
@@ -0,0 +1,138 @@
+import os
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.database import get_existing_matriculas, add_students_bulk_to_db
+from app.services.face_recognition import (
+    IMG_SAVE_PATH, EMBEDDER,
+    generate_embedding, decode_image_bytes, add_student_embeddings_bulk
+)
+from app.services.embedding_worker import init_worker, embed_image_bytes
+
+# Cadastro em lote (início do ano letivo: turmas inteiras a partir de CSV + pasta de fotos).
+# Os alunos são inseridos em uma única transação e a galeria é persistida uma vez só, no final.
+# Onde os embeddings são gerados depende de quem chama:
+#   - rota HTTP /students/bulk: no próprio worker, pelo serviço de inferência (processes=0, padrão),
+#     que já tem os modelos carregados. Um pool "spawn" por requisição recarregaria o TensorFlow e os
+#     pesos em cada processo filho a cada chamada, travando o worker por muito mais tempo que o lote.
+#   - CLI offline (app/bulk_import.py): pool de BULK_ENROLL_PROCESSES processos, que compensa o
+#     carregamento dos modelos em importações grandes e roda fora dos workers do gunicorn.
+BULK_ENROLL_PROCESSES = int(os.environ.get("BULK_ENROLL_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+REQUIRED_FIELDS = ("name", "matricula", "turma", "turno", "idade")
+
+def save_student_image(matricula, image_bytes):
+    # Salva a foto em IMG_SAVE_PATH/<matricula>/ e retorna (caminho_absoluto, caminho_relativo)
+    student_img_dir = os.path.join(IMG_SAVE_PATH, matricula)
+    if not os.path.exists(student_img_dir):
+        os.makedirs(student_img_dir)
+    image_filename = f"{matricula}_{uuid.uuid4().hex}.png"
+    final_image_path = os.path.join(student_img_dir, image_filename)
+    with open(final_image_path, 'wb') as f:
+        f.write(image_bytes)
+    return final_image_path, os.path.join(matricula, image_filename)
+
+def _generate_embeddings(images, processes):
+    if processes and processes > 1 and len(images) > 1:
+        # "spawn" evita herdar o estado do TensorFlow do processo pai via fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                 initializer=init_worker, initargs=(EMBEDDER.name,)) as pool:
+            return list(pool.map(embed_image_bytes, images, chunksize=4))
+
+    results = []
+    for image_bytes in images:
+        try:
+            img = decode_image_bytes(image_bytes)
+        except ValueError:
+            results.append(("error", "invalid_image"))
+            continue
+        embedding = generate_embedding(img)
+        results.append(("ok", embedding) if embedding is not None else ("error", "no_face_detected"))
+    return results
+
+def bulk_enroll_students(students, processes=0):
+    # students: lista de dicts com name, matricula, turma, turno, idade, school_unit_id e image_bytes.
+    # processes > 1 usa o pool de processos (só no CLI); 0 gera os embeddings neste processo.
+    # Retorna uma lista (na ordem de entrada) de {"matricula", "status": "enrolled"|"error", "reason"}.
+    results = [{"matricula": s.get("matricula"), "status": "error", "reason": None} for s in students]
+
+    # 1. Validação e matrículas duplicadas (no próprio lote e no banco)
+    seen = set()
+    pending = []
+    for i, student in enumerate(students):
+        missing = [field for field in REQUIRED_FIELDS if not student.get(field)]
+        if missing:
+            results[i]["reason"] = f"missing_fields: {', '.join(missing)}"
+        elif not student.get("image_bytes"):
+            results[i]["reason"] = "invalid_image"
+        elif student["matricula"] in seen:
+            results[i]["reason"] = "duplicate_matricula"
+        else:
+            seen.add(student["matricula"])
+            pending.append(i)
+
+    existing = get_existing_matriculas(students[i]["matricula"] for i in pending)
+    for i in list(pending):
+        if students[i]["matricula"] in existing:
+            results[i]["reason"] = "duplicate_matricula"
+    pending = [i for i in pending if results[i]["reason"] is None]
+
+    # 2. Embeddings (neste processo ou no pool do CLI)
+    embedding_results = _generate_embeddings([students[i]["image_bytes"] for i in pending], processes)
+    embeddings = {}
+    for i, (status, value) in zip(pending, embedding_results):
+        if status == "ok":
+            embeddings[i] = value
+        else:
+            results[i]["reason"] = value
+    pending = [i for i in pending if i in embeddings]
+
+    # 3. Fotos em disco + inserção de todos os alunos em uma transação
+    rows = []
+    saved_paths = {}
+    for i in pending:
+        student = students[i]
+        final_image_path, relative_image_path = save_student_image(student["matricula"], student["image_bytes"])
+        saved_paths[i] = final_image_path
+        rows.append({
+            "name": student["name"], "matricula": student["matricula"], "turma": student["turma"],
+            "turno": student["turno"], "idade": student["idade"], "image_path": relative_image_path,
+            "school_unit_id": student.get("school_unit_id")
+        })
+
+    try:
+        inserted = add_students_bulk_to_db(rows) if rows else {}
+    except Exception as e:
+        inserted = {}
+        for i in pending:
+            results[i]["reason"] = f"db_error: {e}"
+
+    # 4. Galeria persistida uma única vez
+    student_recs = []
+    for i, row in zip(pending, rows):
+        if inserted.get(row["matricula"]):
+            student_recs.append({
+                "name": row["name"], "matricula": row["matricula"], "embedding": embeddings[i],
+                "image_path": row["image_path"], "school_unit_id": row["school_unit_id"]
+            })
+            results[i]["status"] = "enrolled"
+        else:
+            if results[i]["reason"] is None:
+                results[i]["reason"] = "duplicate_matricula" # Cadastrada por outra requisição nesse meio tempo
+            if os.path.exists(saved_paths[i]):
+                os.remove(saved_paths[i])
+    if student_recs:
+        try:
+            add_student_embeddings_bulk(student_recs)
+        except Exception as e:
+            # Os alunos já estão no banco; como no cadastro individual, ficam sem embedding
+            print(f"Erro ao salvar embeddings do cadastro em lote (services/enrollment.py): {e}")
+            for r in results:
+                if r["status"] == "enrolled":
+                    r["reason"] = "embedding_not_saved"
+
+    enrolled = sum(1 for r in results if r["status"] == "enrolled")
+    print(f"Cadastro em lote: {enrolled} de {len(students)} alunos cadastrados (services/enrollment.py)")
+    return results
@@ -1,163 +1,746 @@
 import os
-import pickle
-from deepface import DeepFace
 import uuid
+import threading
+import time
+import base64
+import cv2
+import numpy as np
+
+from app.services.vector_index import FlatIndex, create_index, l2_normalize, measure_recall
+from app.services.embedding_store import EmbeddingStore
+from app.services.inference import InferenceService
+from app.services.frame_quality import FrameRejected, filter_faces, QUALITY_GATE_ENABLED
+from app.services.recognition_cache import RecognitionCache, dhash, RECOGNITION_CACHE_ENABLED
+from app.services.metrics import timed, register, CallbackMetric
+from app.services.embedders import create_embedder, RECOGNITION_MODEL, DETECTOR_MODEL
+from app.services.face_templates import (
+    build_template, template_vectors, sample_to_bytes, sample_from_bytes,
+    TEMPLATE_MAX_SAMPLES, TEMPLATE_HARVEST_ENABLED, TEMPLATE_HARVEST_MAX_DISTANCE,
+    TEMPLATE_HARVEST_MIN_MARGIN, TEMPLATE_HARVEST_MIN_NOVELTY, TEMPLATE_HARVEST_INTERVAL_SECONDS
+)
+from app.services.database import get_face_samples, add_face_samples
 
 # Definições de caminho para imagens e embeddings
 # EMBEDDINGS_PATH e IMG_SAVE_PATH precisam ser acessíveis de forma consistente
 # Como services está dentro de app, vamos para 'app/..' (volta para 'backend/')
 # e depois para 'data'
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+# APP_DATA_DIR permite apontar para outro diretório (ex.: benchmarks em diretório temporário)
+DATA_DIR = os.environ.get("APP_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
 IMG_SAVE_PATH = os.path.join(DATA_DIR, 'student_images')
 TEMP_IMG_DIR = os.path.join(DATA_DIR, 'temp_recognition_images')
-EMBEDDINGS_PATH = os.path.join(DATA_DIR, 'embeddings.pkl')
+EMBEDDINGS_PATH = os.path.join(DATA_DIR, 'embeddings.pkl') # Formato antigo, migrado para EMBEDDINGS_STORE_DIR
+EMBEDDINGS_STORE_DIR = os.path.join(DATA_DIR, 'embeddings')
 
 if not os.path.exists(IMG_SAVE_PATH):
     os.makedirs(IMG_SAVE_PATH)
 if not os.path.exists(TEMP_IMG_DIR):
     os.makedirs(TEMP_IMG_DIR)
 
-RECOGNITION_MODEL = "ArcFace"
-DETECTOR_MODEL = "ssd"
+# Backend de detecção + embedding (DeepFace/TensorFlow ou ONNX Runtime), ver services/embedders.py
+EMBEDDER = create_embedder()
+
+# Os quadros de reconhecimento são decodificados em memória (sem arquivo temporário).
+# Para depuração, SAVE_RECOGNITION_FRAMES=1 grava cada quadro recebido em TEMP_IMG_DIR.
+SAVE_RECOGNITION_FRAMES = os.environ.get("SAVE_RECOGNITION_FRAMES", "0") == "1"
+
+# Distância de cosseno máxima para considerar um rosto reconhecido.
+# 0.68 é o limiar que o DeepFace usa para ArcFace + cosseno no DeepFace.verify.
+RECOGNITION_DISTANCE_THRESHOLD = float(os.environ.get("RECOGNITION_DISTANCE_THRESHOLD", "0.68"))
+
+# Modo de recorte no cliente (/api/recognize/chip): o quiosque envia só o rosto, já recortado e
+# alinhado, como JPEG/PNG quadrado deste tamanho (o tamanho de entrada do ArcFace) e a detecção é pulada
+FACE_CHIP_SIZE = int(os.environ.get("FACE_CHIP_SIZE", "112"))
+
+# Resultados recentes por quiosque (ver services/recognition_cache.py); limpo a cada mudança na galeria
+RECOGNITION_CACHE = RecognitionCache()
 
 # Lista global para armazenar os embeddings em memória
 REGISTERED_STUDENTS_EMBEDDINGS = []
 
+# Índices vetoriais sobre os embeddings acima, usados para o casamento vetorizado (chave = matrícula).
+# Cada aluno ocupa uma linha por vetor do seu modelo (centroide + exemplares, ver services/face_templates.py).
+# GALLERY_INDEX contém todos os alunos; UNIT_GALLERY_INDEXES tem uma partição por school_unit_id,
+# para que um quiosque de uma escola só seja comparado com os alunos daquela escola.
+# O backend (busca exata "flat" ou aproximada "ivf") vem de GALLERY_INDEX_BACKEND.
+GALLERY_INDEX = create_index()
+UNIT_GALLERY_INDEXES = {}
+STUDENTS_BY_MATRICULA = {}
+_gallery_lock = threading.RLock()
+
+def _unit_key(school_unit_id):
+    # O school_unit_id pode chegar como int ou string (JSON do frontend); normaliza para int
+    try:
+        return int(school_unit_id)
+    except (TypeError, ValueError):
+        return None
+
+def _index_rows(records):
+    # (chaves, vetores) com uma linha por vetor do modelo de cada aluno
+    keys, vectors = [], []
+    for student_rec in records:
+        rows = template_vectors(student_rec)
+        keys.extend([student_rec["matricula"]] * len(rows))
+        vectors.extend(rows)
+    return keys, vectors
+
+def rebuild_gallery_index():
+    global GALLERY_INDEX, UNIT_GALLERY_INDEXES, STUDENTS_BY_MATRICULA
+    students_by_matricula = {s["matricula"]: s for s in REGISTERED_STUDENTS_EMBEDDINGS}
+
+    gallery_index = create_index()
+    gallery_index.build(*_index_rows(REGISTERED_STUDENTS_EMBEDDINGS))
+
+    partitions = {}
+    for student_rec in REGISTERED_STUDENTS_EMBEDDINGS:
+        unit_id = _unit_key(student_rec.get("school_unit_id"))
+        if unit_id is not None:
+            partitions.setdefault(unit_id, []).append(student_rec)
+
+    unit_indexes = {}
+    for unit_id, records in partitions.items():
+        index = create_index()
+        index.build(*_index_rows(records))
+        unit_indexes[unit_id] = index
+
+    with _gallery_lock:
+        GALLERY_INDEX = gallery_index
+        UNIT_GALLERY_INDEXES = unit_indexes
+        STUDENTS_BY_MATRICULA = students_by_matricula
+    RECOGNITION_CACHE.clear()
+
+def _index_add(student_rec):
+    # Atualização incremental dos índices ao cadastrar um embedding (sem reconstruir a galeria)
+    RECOGNITION_CACHE.clear()
+    with _gallery_lock:
+        STUDENTS_BY_MATRICULA[student_rec["matricula"]] = student_rec
+        rows = template_vectors(student_rec)
+        GALLERY_INDEX.add(student_rec["matricula"], rows)
+        unit_id = _unit_key(student_rec.get("school_unit_id"))
+        if unit_id is not None:
+            if unit_id not in UNIT_GALLERY_INDEXES:
+                UNIT_GALLERY_INDEXES[unit_id] = create_index()
+            UNIT_GALLERY_INDEXES[unit_id].add(student_rec["matricula"], rows)
+
+def _index_remove(matricula):
+    RECOGNITION_CACHE.clear()
+    with _gallery_lock:
+        student_rec = STUDENTS_BY_MATRICULA.pop(matricula, None)
+        GALLERY_INDEX.remove(matricula)
+        unit_id = _unit_key(student_rec.get("school_unit_id")) if student_rec else None
+        if unit_id in UNIT_GALLERY_INDEXES:
+            UNIT_GALLERY_INDEXES[unit_id].remove(matricula)
+
+def get_gallery_index(school_unit_id=None):
+    # Partição da unidade escolar, ou o índice global quando a unidade não é conhecida.
+    # Uma unidade resolvida mas sem alunos cadastrados recebe um índice vazio (nenhum match).
+    unit_id = _unit_key(school_unit_id)
+    if unit_id is None:
+        return GALLERY_INDEX
+    return UNIT_GALLERY_INDEXES.get(unit_id, FlatIndex())
+
+def match_embedding(embedding, threshold=None, school_unit_id=None):
+    # Compara um embedding com toda a galeria (ou a partição da unidade) de uma vez.
+    # Retorna (registro_do_aluno, distancia); registro é None se nenhum ficar abaixo do limiar.
+    if threshold is None:
+        threshold = RECOGNITION_DISTANCE_THRESHOLD
+    with _gallery_lock:
+        matricula, distance = get_gallery_index(school_unit_id).search(embedding)
+        student_rec = STUDENTS_BY_MATRICULA.get(matricula)
+    if student_rec is None or distance > threshold:
+        return None, distance
+    return student_rec, distance
+
+def match_embeddings(embeddings, threshold=None, school_unit_id=None):
+    # Versão em lote de match_embedding: compara todos os rostos de um quadro com a galeria em
+    # uma única operação vetorizada. Retorna uma lista de (registro_do_aluno ou None, distancia).
+    if threshold is None:
+        threshold = RECOGNITION_DISTANCE_THRESHOLD
+    if not len(embeddings):
+        return []
+    with timed("gallery_match"), _gallery_lock:
+        nearest = get_gallery_index(school_unit_id).search_batch(embeddings)
+        matches = [(STUDENTS_BY_MATRICULA.get(matricula), distance) for matricula, distance in nearest]
+    return [(student_rec if student_rec is not None and distance <= threshold else None, distance)
+            for student_rec, distance in matches]
+
+def evaluate_gallery_recall(backend="ivf", num_queries=200, noise=0.3, k=1, seed=0):
+    # Mede o recall@k de um backend aproximado contra a busca exata, usando como consultas
+    # vetores da própria galeria com ruído gaussiano (simula novas fotos do mesmo aluno).
+    with _gallery_lock:
+        records = list(STUDENTS_BY_MATRICULA.values())
+    if not records:
+        return {"backend": backend, "gallery_size": 0, "recall": None}
+
+    # Mesmas linhas dos índices da galeria (centroide + exemplares de cada aluno)
+    keys, vectors = _index_rows(records)
+    vectors = l2_normalize(np.vstack(vectors))
+    exact_index = FlatIndex()
+    exact_index.build(keys, vectors)
+    approx_index = create_index(backend)
+    approx_index.build(keys, vectors)
+
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+    queries = l2_normalize(sample + rng.normal(scale=noise / np.sqrt(vectors.shape[1]), size=sample.shape))
+    recall = measure_recall(approx_index, exact_index, queries, k=k)
+    return {"backend": backend, "gallery_size": len(records), "num_queries": len(queries), "k": k, "recall": recall}
+
+# Armazenamento em disco: vetores float32 mapeados em memória + log append-only (ver embedding_store.py)
+EMBEDDINGS_STORE = EmbeddingStore(EMBEDDINGS_STORE_DIR)
+
+# Coerência entre os workers do gunicorn: cada worker lembra a (época, geração, offset do log)
+# que já aplicou e, no máximo a cada GALLERY_SYNC_INTERVAL_SECONDS, compara com o contador
+# compartilhado do store. Se outro worker cadastrou/removeu alunos, aplica só o delta do log.
+GALLERY_SYNC_INTERVAL_SECONDS = float(os.environ.get("GALLERY_SYNC_INTERVAL_SECONDS", "1.0"))
+_synced_state = (0, 0, 0)
+_last_sync_check = 0.0
+_sync_lock = threading.Lock()
+
 def load_embeddings():
-    global REGISTERED_STUDENTS_EMBEDDINGS
+    global _synced_state
+    records = []
+    state = EMBEDDINGS_STORE.read_generation()
     try:
-        if os.path.exists(EMBEDDINGS_PATH):
-            with open(EMBEDDINGS_PATH, 'rb') as f:
-                REGISTERED_STUDENTS_EMBEDDINGS = pickle.load(f)
-            print(f"Embeddings carregados de {EMBEDDINGS_PATH} (services/face_recognition.py)")
+        EMBEDDINGS_STORE.migrate_from_pickle(EMBEDDINGS_PATH)
+        if EMBEDDINGS_STORE.exists():
+            # Contagens de linhas lidas do log com o lock (inclui o que outros workers gravaram)
+            EMBEDDINGS_STORE.compact(only_if_needed=True)
+            records, state = EMBEDDINGS_STORE.load_with_state()
+            print(f"{len(records)} embeddings carregados de {EMBEDDINGS_STORE_DIR} (services/face_recognition.py)")
         else:
             print("Nenhum arquivo de embeddings encontrado. Será criado ao cadastrar o primeiro aluno (services/face_recognition.py).")
     except Exception as e:
         print(f"Erro ao carregar embeddings (services/face_recognition.py): {e}. Iniciando lista vazia.")
-        REGISTERED_STUDENTS_EMBEDDINGS = []
+        records = []
+    # Atualiza a lista no lugar, para que referências já importadas continuem válidas
+    REGISTERED_STUDENTS_EMBEDDINGS[:] = records
+    rebuild_gallery_index()
+    _synced_state = state
+    MODEL_STATUS["gallery_loaded"] = True
+
+def _apply_add(student_rec):
+    # Cadastro vindo do log (deste ou de outro worker); substitui um registro anterior da mesma matrícula
+    if student_rec["matricula"] in STUDENTS_BY_MATRICULA:
+        _apply_remove(student_rec["matricula"])
+    REGISTERED_STUDENTS_EMBEDDINGS.append(student_rec)
+    _index_add(student_rec)
+
+def _apply_remove(matricula):
+    if matricula not in STUDENTS_BY_MATRICULA:
+        return False
+    REGISTERED_STUDENTS_EMBEDDINGS[:] = [s for s in REGISTERED_STUDENTS_EMBEDDINGS if s["matricula"] != matricula]
+    _index_remove(matricula)
+    return True
+
+# Acima deste número de alterações de uma vez (cadastro em lote, delta grande do log) os índices
+# afetados são reconstruídos com um único build(), em vez de um add/remove por aluno: cada add
+# incremental copia a matriz inteira (np.vstack), o que torna N cadastros O(N²).
+GALLERY_BATCH_APPLY_MIN = int(os.environ.get("GALLERY_BATCH_APPLY_MIN", "32"))
+
+def _apply_add_many(student_recs, removed_matriculas=()):
+    # Aplica vários cadastros (e remoções) na galeria em memória de uma vez: atualiza
+    # REGISTERED_STUDENTS_EMBEDDINGS e as partições e reconstrói uma vez o índice global e o de
+    # cada unidade afetada. O último registro de cada matrícula prevalece.
+    global GALLERY_INDEX, UNIT_GALLERY_INDEXES, STUDENTS_BY_MATRICULA
+    added = {student_rec["matricula"]: student_rec for student_rec in student_recs}
+    removed = set(removed_matriculas) - set(added)
+    changed = set(added) | removed
+    if not changed:
+        return
+    affected_units = {_unit_key(rec.get("school_unit_id")) for rec in added.values()}
+    affected_units.update(_unit_key(STUDENTS_BY_MATRICULA[m].get("school_unit_id")) for m in changed if m in STUDENTS_BY_MATRICULA)
+    affected_units.discard(None)
+
+    REGISTERED_STUDENTS_EMBEDDINGS[:] = [s for s in REGISTERED_STUDENTS_EMBEDDINGS if s["matricula"] not in changed] + list(added.values())
+    students_by_matricula = {s["matricula"]: s for s in REGISTERED_STUDENTS_EMBEDDINGS}
+
+    gallery_index = create_index()
+    gallery_index.build(*_index_rows(REGISTERED_STUDENTS_EMBEDDINGS))
+    partitions = {unit_id: [] for unit_id in affected_units}
+    for student_rec in REGISTERED_STUDENTS_EMBEDDINGS:
+        unit_id = _unit_key(student_rec.get("school_unit_id"))
+        if unit_id in partitions:
+            partitions[unit_id].append(student_rec)
+    unit_indexes = {}
+    for unit_id, records in partitions.items():
+        index = create_index()
+        index.build(*_index_rows(records))
+        unit_indexes[unit_id] = index
+
+    with _gallery_lock:
+        GALLERY_INDEX = gallery_index
+        UNIT_GALLERY_INDEXES = {**UNIT_GALLERY_INDEXES, **unit_indexes}
+        STUDENTS_BY_MATRICULA = students_by_matricula
+    RECOGNITION_CACHE.clear()
+
+def _apply_changes(changes):
+    # Alterações lidas do log (("add", registro) ou ("del", matrícula)), na ordem em que foram gravadas
+    if len(changes) < GALLERY_BATCH_APPLY_MIN:
+        for op, payload in changes:
+            if op == "add":
+                _apply_add(payload)
+            else:
+                _apply_remove(payload)
+        return
+    final = {} # matrícula -> registro, ou None se a última operação foi uma remoção
+    for op, payload in changes:
+        if op == "add":
+            final[payload["matricula"]] = payload
+        else:
+            final[payload] = None
+    _apply_add_many([rec for rec in final.values() if rec is not None],
+                    [matricula for matricula, rec in final.items() if rec is None])
 
-def save_embeddings():
+def _advance_synced_state(transition):
+    # Chamado com _sync_lock, depois de uma escrita deste worker no store (já aplicada em memória).
+    # Se o worker estava sincronizado exatamente no estado anterior à escrita, ninguém mais escreveu
+    # no meio: avança direto para o estado novo, em vez de reler e reaplicar o próprio delta.
+    # Senão mantém o estado; o próximo sync_gallery lê as escritas dos outros (e reaplica a nossa).
+    global _synced_state
+    if transition is not None and tuple(transition[0]) == tuple(_synced_state):
+        _synced_state = tuple(transition[1])
+
+def sync_gallery(force=False):
+    # Verificação barata (leitura de um arquivo pequeno) chamada a cada requisição de reconhecimento.
+    # Retorna True se a galeria em memória foi atualizada.
+    global _synced_state, _last_sync_check
+    now = time.monotonic()
+    if not force and now - _last_sync_check < GALLERY_SYNC_INTERVAL_SECONDS:
+        return False
+    _last_sync_check = now
+
+    epoch, generation, _ = EMBEDDINGS_STORE.read_generation()
+    if (epoch, generation) == _synced_state[:2]:
+        return False
+
+    with _sync_lock:
+        synced_epoch, synced_generation, synced_offset = _synced_state
+        if (epoch, generation) == (synced_epoch, synced_generation):
+            return False
+        if epoch != synced_epoch:
+            # Outro worker compactou o store (nova época): recarrega tudo
+            load_embeddings()
+            return True
+        try:
+            changes, new_offset = EMBEDDINGS_STORE.read_delta(synced_epoch, synced_offset)
+        except Exception as e:
+            print(f"Erro ao sincronizar embeddings (services/face_recognition.py): {e}")
+            return False
+        if changes is None:
+            load_embeddings()
+            return True
+        _apply_changes(changes)
+        _synced_state = (epoch, generation, new_offset)
+        if changes:
+            print(f"Galeria sincronizada: {len(changes)} alterações aplicadas, {len(STUDENTS_BY_MATRICULA)} alunos (services/face_recognition.py)")
+        return True
+
+def get_gallery_size():
+    return len(STUDENTS_BY_MATRICULA)
+
+# --- Pré-carregamento dos modelos ---
+# Sem isso o ArcFace e o detector SSD só são carregados dentro do primeiro DeepFace.represent,
+# e a primeira requisição de cada worker fica parada por vários segundos.
+# "models_loaded" também passa a True na primeira inferência bem-sucedida (embed_faces), então um
+# worker que não aqueceu (WARMUP_MODELS=0) ou cujo aquecimento falhou não fica fora do ar para sempre.
+# Com WARMUP_MODELS=0 a prontidão depende só da galeria (os modelos carregam na primeira requisição);
+# com WARMUP_MODELS=1, enquanto os modelos não carregam, o probe de prontidão tenta o aquecimento de
+# novo em segundo plano, no máximo a cada WARMUP_RETRY_SECONDS.
+WARMUP_MODELS = os.environ.get("WARMUP_MODELS", "1") == "1"
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "30"))
+MODEL_STATUS = {"models_loaded": False, "gallery_loaded": False, "warmup_seconds": None, "error": None,
+                "embedder": EMBEDDER.describe(), "warmup_enabled": WARMUP_MODELS}
+_warmup_lock = threading.Lock()
+_last_warmup_attempt = None
+
+def warm_up_models():
+    global _last_warmup_attempt
+    with _warmup_lock:
+        _last_warmup_attempt = time.monotonic()
+        if MODEL_STATUS["models_loaded"]:
+            return True
+        return _warm_up_models()
+
+def _warm_up_models():
+    start = time.monotonic()
     try:
-        with open(EMBEDDINGS_PATH, 'wb') as f:
-            pickle.dump(REGISTERED_STUDENTS_EMBEDDINGS, f)
-        print(f"Embeddings salvos em {EMBEDDINGS_PATH} (services/face_recognition.py)")
+        MODEL_STATUS["embedder"] = EMBEDDER.describe()
+        EMBEDDER.warm_up()
+        # Uma inferência com imagem vazia força a criação dos grafos do TensorFlow (ou da sessão ONNX)
+        INFERENCE_SERVICE.represent(np.zeros((224, 224, 3), dtype=np.uint8))
+        MODEL_STATUS["models_loaded"] = True
+        MODEL_STATUS["error"] = None
+        MODEL_STATUS["warmup_seconds"] = round(time.monotonic() - start, 2)
+        print(f"Modelos {EMBEDDER.describe()} carregados em {MODEL_STATUS['warmup_seconds']}s (services/face_recognition.py)")
     except Exception as e:
-        print(f"Erro ao salvar embeddings (services/face_recognition.py): {e}")
+        MODEL_STATUS["error"] = str(e)
+        print(f"Erro ao pré-carregar modelos (services/face_recognition.py): {e}")
+    return MODEL_STATUS["models_loaded"]
+
+def _retry_warm_up_in_background():
+    # Chamado pelo probe de prontidão: não bloqueia a resposta com o carregamento dos modelos
+    if _warmup_lock.locked():
+        return
+    if _last_warmup_attempt is not None and time.monotonic() - _last_warmup_attempt < WARMUP_RETRY_SECONDS:
+        return
+    threading.Thread(target=warm_up_models, name="warm-up-retry", daemon=True).start()
+
+def get_readiness():
+    if WARMUP_MODELS and not MODEL_STATUS["models_loaded"]:
+        _retry_warm_up_in_background()
+    status = dict(MODEL_STATUS)
+    status["gallery_size"] = get_gallery_size()
+    status["ready"] = status["gallery_loaded"] and (status["models_loaded"] or not WARMUP_MODELS)
+    return status
+
+# --- Detecção e embedding ---
+# Mesmo pré-processamento do DeepFace.represent, mas separado em duas etapas para que o
+# serviço de inferência possa calcular os embeddings de vários rostos em um único forward pass.
+# Delegam ao EMBEDDER do momento (os benchmarks e a checagem de paridade podem trocá-lo).
+def detect_faces(img, enforce_detection=False):
+    return EMBEDDER.detect(img, enforce_detection=enforce_detection)
 
-def generate_embedding(image_path):
+def embed_faces(faces):
+    embeddings = EMBEDDER.embed(faces)
+    if not MODEL_STATUS["models_loaded"]:
+        MODEL_STATUS["models_loaded"] = True # Primeira inferência bem-sucedida sem aquecimento prévio
+        MODEL_STATUS["error"] = None
+    return embeddings
+
+INFERENCE_SERVICE = InferenceService(detect_faces, embed_faces, quality_fn=filter_faces)
+
+def decode_image_bytes(image_bytes):
+    # Bytes de JPEG/PNG -> array NumPy BGR (o formato que o DeepFace/OpenCV esperam), sem tocar o disco
+    with timed("image_decode"):
+        img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Não foi possível decodificar a imagem recebida.")
+    return img
+
+def decode_data_url(image_data_url):
+    # "data:image/jpeg;base64,..." -> array NumPy BGR
+    _, encoded_data = image_data_url.split(',', 1)
+    return decode_image_bytes(base64.b64decode(encoded_data))
+
+def _save_debug_frame(image_bytes):
+    extension = "jpg" if image_bytes[:3] == b"\xff\xd8\xff" else "png"
+    debug_path = os.path.join(TEMP_IMG_DIR, f"temp_recognition_{uuid.uuid4().hex}.{extension}")
+    with open(debug_path, 'wb') as f:
+        f.write(image_bytes)
+    print(f"Quadro de reconhecimento salvo para depuração em: {debug_path} (services/face_recognition.py)")
+
+def generate_embedding(image):
+    # image pode ser um caminho de arquivo ou um array NumPy BGR já decodificado
     try:
-        embeddings = DeepFace.represent(
-            img_path=image_path,
-            model_name=RECOGNITION_MODEL,
-            detector_backend=DETECTOR_MODEL,
-            enforce_detection=True
-        )
+        if isinstance(image, str):
+            image = cv2.imread(image)
+            if image is None:
+                raise ValueError("Arquivo de imagem não encontrado ou inválido.")
+        embeddings = INFERENCE_SERVICE.represent(image, enforce_detection=True)
         if embeddings:
             return embeddings[0]["embedding"]
         return None
     except Exception as e:
-        print(f"Erro ao gerar embedding DeepFace para {image_path} (services/face_recognition.py): {e}")
+        print(f"Erro ao gerar embedding DeepFace (services/face_recognition.py): {e}")
         return None
 
-def add_student_embedding(name, matricula, embedding, relative_image_path, school_unit_id):
-    global REGISTERED_STUDENTS_EMBEDDINGS
-    REGISTERED_STUDENTS_EMBEDDINGS.append({
+def add_student_embedding(name, matricula, embedding, relative_image_path, school_unit_id, exemplars=None):
+    # embedding é o vetor principal (o centroide, nos modelos com várias amostras); exemplars, opcional,
+    # são as linhas extras do modelo
+    student_rec = {
         "name": name,
         "matricula": matricula,
         "embedding": embedding,
         "image_path": relative_image_path,
         "school_unit_id": school_unit_id
-    })
-    save_embeddings()
+    }
+    if exemplars is not None and len(exemplars):
+        student_rec["exemplars"] = exemplars
+    # Grava e aplica com _sync_lock, para que nenhuma sincronização deste worker fique entre as duas
+    with _sync_lock:
+        transition = None
+        try:
+            transition = EMBEDDINGS_STORE.append(student_rec)
+        except Exception as e:
+            print(f"Erro ao salvar embedding do aluno {matricula} (services/face_recognition.py): {e}")
+        _apply_add(student_rec)
+        _advance_synced_state(transition)
+
+def add_student_embeddings_bulk(student_recs):
+    # Cadastro em lote: grava todos os embeddings no store de uma vez (um lock, um fsync, uma geração)
+    with _sync_lock:
+        transition = EMBEDDINGS_STORE.append_many(student_recs)
+        _apply_changes([("add", student_rec) for student_rec in student_recs])
+        _advance_synced_state(transition)
+    print(f"{len(student_recs)} embeddings cadastrados em lote. Total de alunos com embedding: {get_gallery_size()} (services/face_recognition.py)")
+
+def update_student_embedding_info(matricula, name, school_unit_id):
+    # Nome e unidade escolar também ficam no registro da galeria; a unidade define a partição em que
+    # o aluno é procurado. Regrava o registro (mesmo embedding e exemplares) no store: o "add" da mesma
+    # matrícula substitui o anterior aqui e nos outros workers, sem intervalo em que o aluno some da galeria.
+    # Retorna True se o registro foi regravado.
+    sync_gallery(force=True)
+    student_rec = STUDENTS_BY_MATRICULA.get(matricula)
+    if student_rec is None:
+        return False
+    if student_rec.get("name") == name and _unit_key(student_rec.get("school_unit_id")) == _unit_key(school_unit_id):
+        return False
+    add_student_embedding(name, matricula, student_rec["embedding"], student_rec.get("image_path"), school_unit_id,
+                          exemplars=student_rec.get("exemplars"))
+    print(f"Registro do aluno {matricula} atualizado na galeria (unidade {school_unit_id}) (services/face_recognition.py)")
+    return True
 
 def remove_student_embedding(matricula):
-    global REGISTERED_STUDENTS_EMBEDDINGS
-    initial_len = len(REGISTERED_STUDENTS_EMBEDDINGS)
-    REGISTERED_STUDENTS_EMBEDDINGS = [s for s in REGISTERED_STUDENTS_EMBEDDINGS if s["matricula"] != matricula]
-    if len(REGISTERED_STUDENTS_EMBEDDINGS) < initial_len:
-        save_embeddings()
-        print(f"Embedding do aluno {matricula} removido. Total de alunos com embedding: {len(REGISTERED_STUDENTS_EMBEDDINGS)}")
+    # Sincroniza antes, para remover também alunos cadastrados por outro worker
+    sync_gallery(force=True)
+    with _sync_lock:
+        removed = _apply_remove(matricula)
+        if removed:
+            try:
+                _advance_synced_state(EMBEDDINGS_STORE.delete(matricula))
+            except Exception as e:
+                print(f"Erro ao remover embedding do aluno {matricula} do disco (services/face_recognition.py): {e}")
+    if removed:
+        print(f"Embedding do aluno {matricula} removido. Total de alunos com embedding: {get_gallery_size()}")
         return True
     return False
 
-def recognize_face_from_image(image_bytes):
-    temp_img_path = None
+# --- Modelos com várias amostras por aluno (ver services/face_templates.py) ---
+TEMPLATE_STATS = {"harvested": 0, "harvest_errors": 0}
+_last_harvest = {} # matrícula -> instante da última coleta automática neste worker
+
+def update_student_template(matricula, embeddings, source, distances=None, student_info=None):
+    # Guarda as novas amostras no banco e regrava o modelo do aluno (centroide + exemplares) no store.
+    # student_info ({name, image_path, school_unit_id}) é usado no cadastro; senão os dados vêm da galeria.
+    # Retorna {"samples", "template_rows"} ou None se o aluno não está na galeria.
+    student_rec = STUDENTS_BY_MATRICULA.get(matricula)
+    info = student_info or student_rec
+    if info is None or not embeddings:
+        return None
+    distances = distances or [None] * len(embeddings)
+    new_samples = [(sample_to_bytes(embedding), source, distance) for embedding, distance in zip(embeddings, distances)]
+    if student_rec is not None and student_info is None and not get_face_samples(matricula):
+        # Aluno cadastrado antes dos modelos com várias amostras: o embedding atual vira a primeira amostra
+        new_samples.insert(0, (sample_to_bytes(student_rec["embedding"]), "enrolment", None))
+    samples = add_face_samples(matricula, new_samples, TEMPLATE_MAX_SAMPLES)
+    centroid, exemplars = build_template([sample_from_bytes(sample["embedding"]) for sample in samples])
+    add_student_embedding(info["name"], matricula, centroid, info["image_path"], info["school_unit_id"], exemplars=exemplars)
+    return {"samples": len(samples), "template_rows": 1 + len(exemplars)}
+
+def enroll_student_samples(name, matricula, embeddings, relative_image_path, school_unit_id):
+    # Cadastro com uma ou mais fotos do aluno
+    student_info = {"name": name, "image_path": relative_image_path, "school_unit_id": school_unit_id}
+    return update_student_template(matricula, embeddings, "enrolment", student_info=student_info)
+
+def get_student_template_info(matricula):
+    sync_gallery()
+    student_rec = STUDENTS_BY_MATRICULA.get(matricula)
+    if student_rec is None:
+        return None
+    by_source = {}
+    for sample in get_face_samples(matricula):
+        by_source[sample["source"]] = by_source.get(sample["source"], 0) + 1
+    return {"samples": sum(by_source.values()) or 1, "by_source": by_source or {"enrolment": 1},
+            "template_rows": len(template_vectors(student_rec))}
+
+def _harvest_sample(matricula, embedding, distance):
     try:
-        temp_img_path = os.path.join(TEMP_IMG_DIR, f"temp_recognition_{uuid.uuid4().hex}.png")
-        with open(temp_img_path, 'wb') as f:
-            f.write(image_bytes)
-        print(f"Imagem temporária de reconhecimento salva em: {temp_img_path} (services/face_recognition.py)")
+        result = update_student_template(matricula, [embedding], "kiosk", [distance])
+        if result:
+            TEMPLATE_STATS["harvested"] += 1
+            print(f"Amostra coletada no quiosque para {matricula} (distância {distance:.4f}); modelo com {result['template_rows']} vetores e {result['samples']} amostras (services/face_recognition.py)")
+    except Exception as e:
+        TEMPLATE_STATS["harvest_errors"] += 1
+        print(f"Erro ao coletar amostra do aluno {matricula} (services/face_recognition.py): {e}")
+
+def _maybe_harvest_sample(student_rec, embedding, distance, school_unit_id=None):
+    # Coleta automática de um reconhecimento de alta confiança (um único rosto, aprovado no filtro de
+    # qualidade). Roda em uma thread à parte para não atrasar a resposta ao quiosque.
+    if not TEMPLATE_HARVEST_ENABLED or distance > TEMPLATE_HARVEST_MAX_DISTANCE:
+        return False
+    # distance já é a distância até a linha mais próxima do modelo do aluno: perto demais não acrescenta nada
+    if distance < TEMPLATE_HARVEST_MIN_NOVELTY:
+        return False
+    matricula = student_rec["matricula"]
+    now = time.monotonic()
+    if now - _last_harvest.get(matricula, float('-inf')) < TEMPLATE_HARVEST_INTERVAL_SECONDS:
+        return False
+    # Folga para o segundo aluno mais próximo: um rosto ambíguo não pode contaminar o modelo
+    with _gallery_lock:
+        nearest = get_gallery_index(school_unit_id).search_k(embedding, 2)
+    if len(nearest) > 1 and nearest[1][1] - distance < TEMPLATE_HARVEST_MIN_MARGIN:
+        return False
+    _last_harvest[matricula] = now
+    threading.Thread(target=_harvest_sample, args=(matricula, np.asarray(embedding, dtype=np.float32), distance),
+                     name="template-harvest", daemon=True).start()
+    return True
+
+def _best_match_result(detected_faces, school_unit_id=None):
+    # O embedding de cada rosto detectado já vem calculado pelo serviço de inferência.
+    # Comparamos todos os rostos com a galeria em memória (uma única operação vetorizada),
+    # sem reprocessar as imagens dos alunos cadastrados.
+    recognized_student = None
+    min_distance = float('inf')
+    embeddings = [face_data["embedding"] for face_data in detected_faces or []]
+    for student_rec, distance in match_embeddings(embeddings, school_unit_id=school_unit_id):
+        if student_rec is not None and distance < min_distance:
+            min_distance = distance
+            recognized_student = student_rec
+
+    if recognized_student:
+        print(f"Aluno {recognized_student['matricula']} reconhecido com distância {min_distance:.4f} (services/face_recognition.py)")
+        return {"recognized": True, "student": recognized_student, "distance": min_distance}
+    else:
+        return {"recognized": False, "message": "Nenhum aluno reconhecido."}
+
+def _cached_recognition(mode, client_ip, img, recognize_fn):
+    # Reaproveita o resultado de um quadro quase idêntico do mesmo quiosque. Só resultados negativos
+    # são guardados (ver recognition_cache.py): um aluno reconhecido nunca vem do cache, então uma
+    # frequência só é registrada a partir de uma inferência deste quadro. Erros também não são guardados.
+    if not RECOGNITION_CACHE_ENABLED or client_ip is None:
+        return recognize_fn()
+    cache_key = (client_ip, mode)
+    frame_hash = dhash(img)
+    cached = RECOGNITION_CACHE.get(cache_key, frame_hash)
+    if cached is not None:
+        return cached
+    result = recognize_fn()
+    if "error" not in result and not result.get("recognized"):
+        RECOGNITION_CACHE.put(cache_key, frame_hash, result)
+    return result
 
-        if not REGISTERED_STUDENTS_EMBEDDINGS:
+def get_recognition_cache_stats():
+    return RECOGNITION_CACHE.get_stats()
+
+def recognize_face_from_image(image_bytes, school_unit_id=None, client_ip=None):
+    try:
+        if SAVE_RECOGNITION_FRAMES:
+            _save_debug_frame(image_bytes)
+
+        sync_gallery()
+        if not get_gallery_size():
             return {"recognized": False, "message": "Nenhum aluno cadastrado para reconhecimento."}
 
-        # Tenta detectar faces na imagem de entrada
-        detected_faces = DeepFace.represent(
-            img_path=temp_img_path,
-            model_name=RECOGNITION_MODEL,
-            detector_backend=DETECTOR_MODEL,
-            enforce_detection=False # Permite que o DeepFace continue mesmo que não detecte um rosto com alta confiança
-        )
-        
-        recognized_student = None
-        if detected_faces:
-            # Para cada rosto detectado na imagem de entrada (poderia ser mais de um, embora o foco seja um por vez)
-            for face_data in detected_faces:
-                # Compara o embedding do rosto detectado com todos os alunos registrados
-                # DeepFace.find é mais eficiente para procurar em um banco de dados de rostos
-                # No seu caso, REGISTERED_STUDENTS_EMBEDDINGS já tem os embeddings pré-computados
-                # Então, podemos fazer a verificação direta
-                
-                # Para simplificar a migração e manter a lógica de `verify` com `img1_path` e `img2_path`
-                # vamos usar a mesma lógica que estava no main.py, mas mais otimizada se você tiver muitos alunos.
-                
-                # Uma abordagem mais otimizada seria criar um DataFrame de embeddings e usar DeepFace.find
-                # df = pd.DataFrame(REGISTERED_STUDENTS_EMBEDDINGS)
-                # results = DeepFace.find(img_path=temp_img_path, db_path=IMG_SAVE_PATH, model_name=RECOGNITION_MODEL, detector_backend=DETECTOR_MODEL, distance_metric="cosine", enforce_detection=False)
-                # No entanto, a lógica atual de loop e verify também funciona para um número moderado de alunos.
-
-                min_distance = float('inf')
-                best_match = None
-                
-                for student_rec in REGISTERED_STUDENTS_EMBEDDINGS:
-                    # Verifica se a imagem do aluno cadastrado 
-                    full_student_image_path = os.path.join(IMG_SAVE_PATH, student_rec["image_path"])
-
-                    if not os.path.exists(full_student_image_path):
-                        print(f"AVISO: Imagem do aluno {student_rec['matricula']} não encontrada em: {full_student_image_path} (services/face_recognition.py)")
-                        continue # Pula este aluno se a imagem não for encontrada
-
-                    verification_result = DeepFace.verify(
-                        img1_path=temp_img_path,
-                        img2_path=full_student_image_path,
-                        model_name=RECOGNITION_MODEL,
-                        detector_backend=DETECTOR_MODEL,
-                        enforce_detection=False # Já detectamos uma face, mas podemos relaxar para o segundo img
-                    )
-                    
-                    if verification_result["verified"]:
-                        distance = verification_result["distance"]
-                        if distance < min_distance: # Queremos o menor distance para o melhor match
-                            min_distance = distance
-                            best_match = student_rec
-                            # Assim que encontrar um match verificado, pode parar ou continuar buscando o melhor.
-                            # Se você quer apenas o primeiro match verificado, adicione 'break' aqui
-                            recognized_student = best_match
-                            break # Encontrou um match, não precisa verificar os outros
-            
-        if recognized_student:
-            return {"recognized": True, "student": recognized_student}
-        else:
-            return {"recognized": False, "message": "Nenhum aluno reconhecido."}
+        img = decode_image_bytes(image_bytes)
+
+        # Detecta os rostos e calcula os embeddings pelo serviço de inferência (micro-batching com
+        # outras requisições simultâneas). enforce_detection=False permite continuar mesmo sem um
+        # rosto detectado com alta confiança, como no DeepFace.represent; quadros sem rosto útil
+        # são barrados pelo filtro de qualidade antes do embedding.
+        def recognize():
+            try:
+                with timed("inference"):
+                    detected_faces = INFERENCE_SERVICE.represent(img, enforce_detection=False, quality_gate=QUALITY_GATE_ENABLED)
+            except FrameRejected as e:
+                return {"recognized": False, "reason": e.reason, "message": e.message}
+            result = _best_match_result(detected_faces, school_unit_id)
+            if result["recognized"] and QUALITY_GATE_ENABLED and len(detected_faces) == 1:
+                _maybe_harvest_sample(result["student"], detected_faces[0]["embedding"], result["distance"], school_unit_id)
+            return result
+
+        # Quadros quase idênticos do mesmo quiosque (aluno parado) não passam de novo pelo modelo
+        return _cached_recognition("single", client_ip, img, recognize)
 
     except Exception as e:
         print(f"Erro no reconhecimento facial (services/face_recognition.py): {e}")
         import traceback
         traceback.print_exc()
         return {"recognized": False, "error": f"Erro interno no reconhecimento: {str(e)}"}
-    finally:
-        if temp_img_path and os.path.exists(temp_img_path):
-            os.remove(temp_img_path)
+
+def _face_box(facial_area):
+    return {key: int(facial_area.get(key, 0)) for key in ("x", "y", "w", "h")}
+
+def recognize_faces_in_image(image_bytes, school_unit_id=None):
+    # Modo grupo (câmera na porta da sala): devolve todos os rostos do quadro, cada um com
+    # bounding box, melhor correspondência e distância. Se o mesmo aluno casar com mais de um
+    # rosto, só o rosto mais próximo fica com ele.
+    # Retorna {"faces": [{"box", "recognized", "student", "distance"}, ...]} ou {"faces": [], "message"/"error"}.
+    try:
+        if SAVE_RECOGNITION_FRAMES:
+            _save_debug_frame(image_bytes)
+
+        sync_gallery()
+        if not get_gallery_size():
+            return {"faces": [], "message": "Nenhum aluno cadastrado para reconhecimento."}
+
+        img = decode_image_bytes(image_bytes)
+        with timed("inference"):
+            detected_faces = INFERENCE_SERVICE.represent(img, enforce_detection=False, quality_gate=QUALITY_GATE_ENABLED) or []
+        matches = match_embeddings([face_data["embedding"] for face_data in detected_faces], school_unit_id=school_unit_id)
+
+        best_face_by_matricula = {}
+        for position, (student_rec, distance) in enumerate(matches):
+            if student_rec is None:
+                continue
+            current = best_face_by_matricula.get(student_rec["matricula"])
+            if current is None or distance < matches[current][1]:
+                best_face_by_matricula[student_rec["matricula"]] = position
+        winners = set(best_face_by_matricula.values())
+
+        faces = []
+        for position, (face_data, (student_rec, distance)) in enumerate(zip(detected_faces, matches)):
+            recognized = position in winners
+            faces.append({
+                "box": _face_box(face_data["facial_area"]),
+                "recognized": recognized,
+                "student": student_rec if recognized else None,
+                "distance": distance if distance != float('inf') else None
+            })
+        if winners:
+            print(f"{len(winners)} aluno(s) reconhecido(s) em {len(faces)} rosto(s) (services/face_recognition.py)")
+        return {"faces": faces}
+
+    except FrameRejected as e:
+        return {"faces": [], "reason": e.reason, "message": e.message}
+    except Exception as e:
+        print(f"Erro no reconhecimento facial em grupo (services/face_recognition.py): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"faces": [], "error": f"Erro interno no reconhecimento: {str(e)}"}
+
+def decode_face_chip(chip_bytes):
+    # Recorte de rosto já alinhado (JPEG/PNG) enviado pelo quiosque -> mesmo formato do "face" que
+    # o detector devolve (RGB, float 0-1), pronto para o embedding sem passar pela detecção
+    chip = decode_image_bytes(chip_bytes)
+    height, width = chip.shape[:2]
+    if (width, height) != (FACE_CHIP_SIZE, FACE_CHIP_SIZE):
+        raise ValueError(f"O recorte do rosto deve ter {FACE_CHIP_SIZE}x{FACE_CHIP_SIZE} pixels (recebido {width}x{height}).")
+    return chip[:, :, ::-1].astype(np.float32) / 255.0
+
+def recognize_face_chip(chip_bytes, school_unit_id=None):
+    # Mesmo retorno de recognize_face_from_image, para um rosto já recortado no cliente.
+    # ValueError (recorte inválido) é propagado para a rota responder 400.
+    try:
+        sync_gallery()
+        if not get_gallery_size():
+            return {"recognized": False, "message": "Nenhum aluno cadastrado para reconhecimento."}
+
+        face = decode_face_chip(chip_bytes)
+        with timed("inference"):
+            detected_faces = INFERENCE_SERVICE.represent(face, detect=False)
+        return _best_match_result(detected_faces, school_unit_id)
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"Erro no reconhecimento do recorte facial (services/face_recognition.py): {e}")
+        import traceback
+        traceback.print_exc()
+        return {"recognized": False, "error": f"Erro interno no reconhecimento: {str(e)}"}
+
+# Métricas lidas na coleta de /api/metrics
+register(CallbackMetric("gallery_size", "Alunos na galeria em memória deste worker.", get_gallery_size))
+register(CallbackMetric(
+    "recognition_cache_lookups_total", "Consultas ao cache de quadros quase idênticos por resultado.",
+    lambda: {("hit",): RECOGNITION_CACHE.stats["hits"], ("miss",): RECOGNITION_CACHE.stats["misses"]},
+    metric_type="counter", labelnames=["result"]))
+register(CallbackMetric(
+    "inference_total", "Contadores do serviço de inferência (lotes, quadros, rostos, quadros descartados).",
+    lambda: {(key,): value for key, value in INFERENCE_SERVICE.stats.items()},
+    metric_type="counter", labelnames=["kind"]))
+register(CallbackMetric(
+    "template_harvest_total", "Amostras de rosto coletadas automaticamente no quiosque (e erros na coleta).",
+    lambda: {(key,): value for key, value in TEMPLATE_STATS.items()},
+    metric_type="counter", labelnames=["result"]))
 
 # Carrega os embeddings quando o módulo é importado
 load_embeddings()
\ No newline at end of file
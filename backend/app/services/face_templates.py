@@ -0,0 +1,64 @@
+import os
+import numpy as np
+
+from app.services.vector_index import l2_normalize
+
+# Modelo compacto de cada aluno a partir de várias amostras de rosto.
+# Uma única foto de cadastro falha com frequência sob outra iluminação, e cada quadro que o
+# quiosque repete é uma inferência completa. Com várias amostras (fotos extras no cadastro e
+# reconhecimentos de alta confiança coletados no quiosque) o aluno passa a ser representado por:
+#   - o centroide (média normalizada) de todas as amostras, que fica em "embedding";
+#   - até TEMPLATE_EXEMPLARS exemplares, as amostras que mais se afastam do que já está no
+#     modelo (seleção gulosa k-center), cobrindo as variações que o centroide sozinho não cobre.
+# O índice guarda no máximo 1 + TEMPLATE_EXEMPLARS linhas por aluno e a distância do aluno é a da
+# linha mais próxima, então o custo do casamento continua limitado por aluno, qualquer que seja
+# o número de amostras guardadas (no máximo TEMPLATE_MAX_SAMPLES, no banco).
+
+TEMPLATE_EXEMPLARS = int(os.environ.get("TEMPLATE_EXEMPLARS", "3"))
+TEMPLATE_MAX_SAMPLES = int(os.environ.get("TEMPLATE_MAX_SAMPLES", "12"))
+# Amostras a menos desta distância de cosseno de uma linha já escolhida não viram exemplar
+TEMPLATE_MIN_EXEMPLAR_DISTANCE = float(os.environ.get("TEMPLATE_MIN_EXEMPLAR_DISTANCE", "0.05"))
+
+# Coleta automática no quiosque: só reconhecimentos de um único rosto, aprovados no filtro de
+# qualidade, bem abaixo do limiar de reconhecimento, com folga para o segundo aluno mais próximo
+# e que acrescentem algo ao modelo (longe o bastante das linhas que ele já tem).
+TEMPLATE_HARVEST_ENABLED = os.environ.get("TEMPLATE_HARVEST", "1") == "1"
+TEMPLATE_HARVEST_MAX_DISTANCE = float(os.environ.get("TEMPLATE_HARVEST_MAX_DISTANCE", "0.35"))
+TEMPLATE_HARVEST_MIN_MARGIN = float(os.environ.get("TEMPLATE_HARVEST_MIN_MARGIN", "0.15"))
+TEMPLATE_HARVEST_MIN_NOVELTY = float(os.environ.get("TEMPLATE_HARVEST_MIN_NOVELTY", "0.08"))
+TEMPLATE_HARVEST_INTERVAL_SECONDS = float(os.environ.get("TEMPLATE_HARVEST_INTERVAL_SECONDS", "600")) # Por aluno, por worker
+
+
+def template_vectors(student_rec):
+    # Linhas do aluno no índice: centroide seguido dos exemplares
+    exemplars = student_rec.get("exemplars")
+    if exemplars is None or not len(exemplars):
+        return np.asarray(student_rec["embedding"], dtype=np.float32).reshape(1, -1)
+    return np.vstack([np.asarray(student_rec["embedding"], dtype=np.float32).reshape(1, -1),
+                      np.asarray(exemplars, dtype=np.float32)])
+
+
+def build_template(samples, exemplars=None, min_exemplar_distance=None):
+    # samples: lista de embeddings -> (centroide, matriz de exemplares (m, dim), m <= exemplars)
+    exemplars = TEMPLATE_EXEMPLARS if exemplars is None else exemplars
+    min_exemplar_distance = TEMPLATE_MIN_EXEMPLAR_DISTANCE if min_exemplar_distance is None else min_exemplar_distance
+    samples = l2_normalize(np.vstack([np.asarray(sample, dtype=np.float32).reshape(1, -1) for sample in samples]))
+    centroid = l2_normalize(samples.mean(axis=0))
+    chosen = []
+    # Distância de cada amostra à linha mais próxima já no modelo (começa só com o centroide)
+    nearest = 1.0 - samples @ centroid
+    for _ in range(min(exemplars, len(samples)) if len(samples) > 1 else 0):
+        i = int(np.argmax(nearest))
+        if nearest[i] < min_exemplar_distance:
+            break
+        chosen.append(i)
+        nearest = np.minimum(nearest, 1.0 - samples @ samples[i])
+    return centroid, samples[chosen]
+
+
+def sample_to_bytes(embedding):
+    return np.asarray(embedding, dtype=np.float32).reshape(-1).tobytes()
+
+
+def sample_from_bytes(data):
+    return np.frombuffer(data, dtype=np.float32)
@@ -0,0 +1,111 @@
+import os
+import math
+import cv2
+import numpy as np
+
+# Filtro de qualidade do quadro, aplicado depois da detecção e antes do embedding.
+# O quiosque envia quadros continuamente e muitos nunca poderiam ser reconhecidos (sem rosto,
+# rosto muito pequeno, borrado, escuro ou de lado). Essas verificações custam uma fração do
+# forward pass do ArcFace, então rostos reprovados nem entram no lote de embeddings e o
+# quiosque recebe o motivo para orientar o aluno.
+# Todos os limiares são configuráveis por variável de ambiente; 0 desativa a verificação.
+
+QUALITY_GATE_ENABLED = os.environ.get("QUALITY_GATE", "1") == "1"
+QUALITY_MIN_DETECTION_CONFIDENCE = float(os.environ.get("QUALITY_MIN_DETECTION_CONFIDENCE", "0.5"))
+QUALITY_MIN_FACE_SIZE = int(os.environ.get("QUALITY_MIN_FACE_SIZE", "80")) # Lado menor do rosto, em pixels
+QUALITY_MIN_SHARPNESS = float(os.environ.get("QUALITY_MIN_SHARPNESS", "40")) # Variância do Laplaciano
+QUALITY_MIN_BRIGHTNESS = float(os.environ.get("QUALITY_MIN_BRIGHTNESS", "50")) # Média de cinza (0-255)
+QUALITY_MAX_BRIGHTNESS = float(os.environ.get("QUALITY_MAX_BRIGHTNESS", "215"))
+QUALITY_MAX_ROLL_DEGREES = float(os.environ.get("QUALITY_MAX_ROLL_DEGREES", "25")) # Inclinação da linha dos olhos
+QUALITY_MAX_YAW_OFFSET = float(os.environ.get("QUALITY_MAX_YAW_OFFSET", "0.2")) # Deslocamento dos olhos / largura do rosto
+
+REJECTION_MESSAGES = {
+    "no_face": "Nenhum rosto detectado. Posicione o rosto em frente à câmera.",
+    "face_too_small": "Rosto muito distante. Aproxime-se da câmera.",
+    "blurry": "Imagem borrada. Fique parado por um instante.",
+    "too_dark": "Imagem muito escura. Procure um local mais iluminado.",
+    "too_bright": "Imagem muito clara. Evite luz forte atrás ou sobre o rosto.",
+    "bad_pose": "Olhe de frente para a câmera.",
+}
+
+
+class FrameRejected(Exception):
+    # Quadro reprovado pelo filtro de qualidade; reason é uma das chaves de REJECTION_MESSAGES
+
+    def __init__(self, reason):
+        self.reason = reason
+        self.message = REJECTION_MESSAGES.get(reason, "Quadro rejeitado.")
+        super().__init__(self.message)
+
+
+def _face_crop_gray(img, facial_area):
+    height, width = img.shape[:2]
+    x = max(int(facial_area.get("x", 0)), 0)
+    y = max(int(facial_area.get("y", 0)), 0)
+    w = int(facial_area.get("w", width))
+    h = int(facial_area.get("h", height))
+    crop = img[y:min(y + h, height), x:min(x + w, width)]
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return crop
+
+
+def _pose_ok(facial_area):
+    left_eye = facial_area.get("left_eye")
+    right_eye = facial_area.get("right_eye")
+    if not left_eye or not right_eye:
+        return True # Detector sem marcos dos olhos: não há como estimar a pose
+    dx = float(left_eye[0]) - float(right_eye[0])
+    dy = float(left_eye[1]) - float(right_eye[1])
+    if QUALITY_MAX_ROLL_DEGREES:
+        roll = abs(math.degrees(math.atan2(dy, dx)))
+        roll = min(roll, 180.0 - roll) # A ordem dos olhos varia entre detectores
+        if roll > QUALITY_MAX_ROLL_DEGREES:
+            return False
+    if QUALITY_MAX_YAW_OFFSET and facial_area.get("w"):
+        # Rosto de lado: o ponto médio entre os olhos se afasta do centro do retângulo do rosto
+        eyes_center_x = (float(left_eye[0]) + float(right_eye[0])) / 2
+        face_center_x = facial_area["x"] + facial_area["w"] / 2
+        if abs(eyes_center_x - face_center_x) / facial_area["w"] > QUALITY_MAX_YAW_OFFSET:
+            return False
+    return True
+
+
+def assess_face(img, face_obj):
+    # Retorna None se o rosto passa em todas as verificações, ou o motivo da reprovação
+    facial_area = face_obj["facial_area"]
+    if face_obj.get("confidence", 1.0) < QUALITY_MIN_DETECTION_CONFIDENCE:
+        return "no_face" # Com enforce_detection=False o DeepFace devolve a imagem inteira com confiança 0
+
+    if QUALITY_MIN_FACE_SIZE and min(facial_area.get("w", 0), facial_area.get("h", 0)) < QUALITY_MIN_FACE_SIZE:
+        return "face_too_small"
+
+    gray = _face_crop_gray(img, facial_area)
+    if gray.size == 0:
+        return "no_face"
+
+    brightness = float(gray.mean())
+    if QUALITY_MIN_BRIGHTNESS and brightness < QUALITY_MIN_BRIGHTNESS:
+        return "too_dark"
+    if QUALITY_MAX_BRIGHTNESS and brightness > QUALITY_MAX_BRIGHTNESS:
+        return "too_bright"
+
+    if QUALITY_MIN_SHARPNESS and cv2.Laplacian(gray, cv2.CV_64F).var() < QUALITY_MIN_SHARPNESS:
+        return "blurry"
+
+    if not _pose_ok(facial_area):
+        return "bad_pose"
+    return None
+
+
+def filter_faces(img, face_objs):
+    # Mantém só os rostos aprovados. Se nenhum passar, levanta FrameRejected com o motivo do
+    # maior rosto (o mais provável de ser o aluno em frente ao quiosque).
+    if not face_objs:
+        raise FrameRejected("no_face")
+    reasons = [assess_face(img, face_obj) for face_obj in face_objs]
+    kept = [face_obj for face_obj, reason in zip(face_objs, reasons) if reason is None]
+    if kept:
+        return kept
+    largest = int(np.argmax([face_obj["facial_area"].get("w", 0) * face_obj["facial_area"].get("h", 0) for face_obj in face_objs]))
+    raise FrameRejected(reasons[largest])
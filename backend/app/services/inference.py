@@ -0,0 +1,147 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.services.metrics import timed
+
+# Serviço de inferência com micro-batching.
+# Uma única thread é dona do modelo: as requisições (threads do gunicorn/gthread) enfileiram
+# quadros e esperam o resultado. A thread junta os quadros que chegam dentro de uma janela de
+# alguns milissegundos, faz a detecção de cada um e calcula os embeddings de todos os rostos
+# em um único forward pass do modelo. Isso aumenta o throughput por núcleo e garante uma
+# única cópia do modelo por processo.
+
+BATCH_WINDOW_MS = float(os.environ.get("INFERENCE_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", "16"))
+INFERENCE_BATCHING_ENABLED = os.environ.get("INFERENCE_BATCHING", "1") == "1"
+
+
+class InferenceService:
+
+    def __init__(self, detect_fn, embed_fn, batch_window_ms=None, max_batch_size=None, quality_fn=None):
+        # detect_fn(img, enforce_detection) -> lista de rostos ({"face", "facial_area", "confidence"})
+        # embed_fn(lista_de_faces) -> matriz (n, dim) de embeddings, um forward pass para o lote todo
+        # quality_fn(img, rostos) -> rostos aprovados, ou levanta exceção com o motivo da reprovação
+        self.detect_fn = detect_fn
+        self.embed_fn = embed_fn
+        self.quality_fn = quality_fn
+        self.batch_window = (BATCH_WINDOW_MS if batch_window_ms is None else batch_window_ms) / 1000.0
+        self.max_batch_size = MAX_BATCH_SIZE if max_batch_size is None else max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.stats = {"batches": 0, "frames": 0, "faces": 0, "rejected": 0}
+
+    def _ensure_started(self):
+        # A thread é criada sob demanda e recriada após um fork (threads não sobrevivem ao fork)
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, img, enforce_detection=False, detect=True, quality_gate=False):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((img, enforce_detection, detect, quality_gate, future))
+        return future
+
+    def represent(self, img, enforce_detection=False, timeout=None, detect=True, quality_gate=False):
+        # Equivalente ao DeepFace.represent: lista de {"embedding", "facial_area", "face_confidence"}.
+        # detect=False trata img como um rosto já recortado e alinhado (mesmo formato do "face"
+        # devolvido por detect_fn) e pula a detecção, como o detector_backend="skip" do DeepFace.
+        # quality_gate=True passa os rostos detectados por quality_fn antes do embedding.
+        if not INFERENCE_BATCHING_ENABLED:
+            result = self._process_batch_direct([(img, enforce_detection, detect, quality_gate)])[0]
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return self.submit(img, enforce_detection, detect, quality_gate).result(timeout=timeout)
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            items = [item[:4] for item in batch]
+            try:
+                results = self._process_batch_direct(items)
+            except Exception as e:
+                # Falha no forward pass do lote: todas as requisições do lote recebem o erro
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+            for (*_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _process_batch_direct(self, items):
+        # Detecção quadro a quadro; embeddings de todos os rostos do lote em um único forward pass
+        detections = []
+        faces = []
+        for img, enforce_detection, detect, quality_gate in items:
+            if not detect:
+                height, width = img.shape[:2]
+                face_objs = [{"face": img, "facial_area": {"x": 0, "y": 0, "w": width, "h": height}, "confidence": 1.0}]
+                detections.append(face_objs)
+                faces.append(img)
+                continue
+            try:
+                with timed("detection"):
+                    face_objs = self.detect_fn(img, enforce_detection)
+                if quality_gate and self.quality_fn is not None:
+                    with timed("quality_gate"):
+                        face_objs = self.quality_fn(img, face_objs) # Rostos reprovados não entram no forward pass
+            except Exception as e:
+                detections.append(e)
+                continue
+            detections.append(face_objs)
+            faces.extend(face_obj["face"] for face_obj in face_objs)
+
+        embeddings = []
+        if faces:
+            with timed("embedding"):
+                embeddings = self.embed_fn(faces)
+
+        results = []
+        position = 0
+        for face_objs in detections:
+            if isinstance(face_objs, Exception):
+                results.append(face_objs)
+                continue
+            frame_result = []
+            for face_obj in face_objs:
+                frame_result.append({
+                    "embedding": embeddings[position],
+                    "facial_area": face_obj["facial_area"],
+                    "face_confidence": face_obj["confidence"]
+                })
+                position += 1
+            results.append(frame_result)
+
+        self.stats["batches"] += 1
+        self.stats["frames"] += len(items)
+        self.stats["faces"] += len(faces)
+        # Quadros descartados antes do embedding (sem rosto ou reprovados no filtro de qualidade)
+        self.stats["rejected"] += sum(1 for face_objs in detections if isinstance(face_objs, Exception))
+        return results
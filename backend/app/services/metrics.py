@@ -0,0 +1,249 @@
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _StackCounter, deque
+from contextlib import contextmanager
+
+# Métricas no formato texto do Prometheus (exportadas em /api/metrics), sem dependências externas.
+# Histogramas e contadores simples, seguros entre threads; cada worker do gunicorn tem os seus
+# (o Prometheus soma as séries quando cada worker é coletado, ou use GUNICORN_WORKERS=1).
+#
+# Estágios do reconhecimento medidos em recognition_stage_seconds{stage=...}:
+#   base64_decode, image_decode, inference (espera + detecção + embedding vista pela requisição),
+#   detection, quality_gate, embedding (por lote), gallery_match, cooldown_check, attendance_insert
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # labels -> [contagem por bucket..., soma, contagem]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames + ("le",), key + (repr(float(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    # Valor lido na hora da coleta (ex.: tamanho da galeria, contadores já mantidos pelos serviços).
+    # fn() retorna um número, ou um dict {tupla_de_labels: número} quando há labelnames.
+
+    def __init__(self, name, documentation, fn, metric_type="gauge", labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Erro ao coletar a métrica {self.name} (services/metrics.py): {e}")
+            return lines
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {item}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def render_metrics():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+RECOGNITION_STAGE_SECONDS = register(Histogram(
+    "recognition_stage_seconds", "Duração de cada estágio do reconhecimento.", ["stage"]))
+RECOGNITION_REQUESTS = register(Counter(
+    "recognition_requests_total", "Requisições de reconhecimento por endpoint, unidade escolar e resultado.",
+    ["endpoint", "school_unit_id", "outcome"]))
+HTTP_REQUEST_SECONDS = register(Histogram(
+    "http_request_seconds", "Duração das requisições HTTP da API.", ["endpoint", "method", "status"]))
+DB_CONNECTION_WAIT_SECONDS = register(Histogram(
+    "db_connection_wait_seconds", "Tempo para obter a conexão SQLite do pool da thread (inclui abrir e configurar).",
+    buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0)))
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        RECOGNITION_STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+# --- Profiler por amostragem para requisições lentas (opcional) ---
+# Ligado por PROFILE_SLOW_REQUESTS=1 ou em tempo de execução (POST /api/metrics/profiler).
+# Enquanto houver requisições em andamento, uma thread amostra a pilha de cada uma (e da thread do
+# serviço de inferência) via sys._current_frames() a cada PROFILER_INTERVAL_MS. Ao final, se a
+# requisição passou de SLOW_REQUEST_SECONDS, as pilhas mais frequentes vão para o log e para a
+# lista de /api/metrics/slow_requests. Custo zero quando desligado.
+PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", "10"))
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", "1.0"))
+SLOW_REQUEST_PROFILES_KEPT = 20
+PROFILER_TOP_STACKS = 5
+
+class SlowRequestProfiler:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._active = {} # thread_id -> {"name", "start", "samples": Counter}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.profiles = deque(maxlen=SLOW_REQUEST_PROFILES_KEPT)
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        if self.enabled:
+            self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def request_started(self, name):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._active[threading.get_ident()] = {"name": name, "start": time.monotonic(), "samples": _StackCounter()}
+        self._wakeup.set()
+
+    def request_finished(self):
+        if not self._active:
+            return None
+        with self._lock:
+            state = self._active.pop(threading.get_ident(), None)
+        if state is None:
+            return None
+        duration = time.monotonic() - state["start"]
+        if duration < SLOW_REQUEST_SECONDS or not state["samples"]:
+            return None
+        total = sum(state["samples"].values())
+        profile = {
+            "request": state["name"],
+            "duration_seconds": round(duration, 4),
+            "samples": total,
+            "top_stacks": [{"share": round(count / total, 3), "stack": stack.split(" <- ")}
+                           for stack, count in state["samples"].most_common(PROFILER_TOP_STACKS)]
+        }
+        self.profiles.append(profile)
+        print(f"Requisição lenta {state['name']} ({duration:.2f}s); pilha mais frequente: "
+              f"{profile['top_stacks'][0]['stack'][0]} (services/metrics.py)")
+        return profile
+
+    @staticmethod
+    def _stack_key(frame):
+        entries = []
+        for frame_summary in reversed(traceback.extract_stack(frame, limit=12)):
+            entries.append(f"{os.path.basename(frame_summary.filename)}:{frame_summary.name}:{frame_summary.lineno}")
+        return " <- ".join(entries)
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(PROFILER_INTERVAL_MS / 1000.0)
+            frames = sys._current_frames()
+            batcher_ids = [t.ident for t in threading.enumerate() if t.name == "inference-batcher"]
+            batcher_stack = self._stack_key(frames[batcher_ids[0]]) if batcher_ids and batcher_ids[0] in frames else None
+            if batcher_stack and "_collect_batch" in batcher_stack:
+                batcher_stack = None # Thread de inferência ociosa, esperando quadros
+            with self._lock:
+                for thread_id, state in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        state["samples"][self._stack_key(frame)] += 1
+                    if batcher_stack:
+                        state["samples"]["[inference-batcher] " + batcher_stack] += 1
+
+PROFILER = SlowRequestProfiler(enabled=os.environ.get("PROFILE_SLOW_REQUESTS", "0") == "1")
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Cache de resultados de reconhecimento por hash perceptual do quadro.
+# O quiosque envia quadros sem parar e, com o aluno parado em frente à câmera, quadros seguidos
+# são quase idênticos. Cada quadro é reduzido a um dHash de 64 bits (gradiente horizontal de uma
+# miniatura 9x8 em tons de cinza), que muda pouco com ruído da câmera e compressão JPEG.
+# Um quadro do mesmo IP cujo hash difere de um quadro recente em até RECOGNITION_CACHE_MAX_HAMMING
+# bits reaproveita o resultado anterior sem passar pelo modelo.
+# Só resultados negativos (nenhum rosto, quadro reprovado, ninguém reconhecido) são guardados: o hash
+# é do quadro inteiro, e dois alunos diferentes no mesmo fundo podem cair a poucos bits um do outro.
+# Um reconhecimento positivo sempre passa pelo modelo antes de gerar uma frequência.
+# Limitado em tamanho (LRU por IP) e com TTL; é limpo sempre que a galeria muda.
+# O quiosque envia um quadro a cada 5 s (RECOGNITION_INTERVAL em RecognitionView.vue), então o TTL
+# precisa ser maior que esse intervalo para que o quadro seguinte do mesmo quiosque encontre o anterior;
+# o padrão cobre dois intervalos.
+
+RECOGNITION_CACHE_ENABLED = os.environ.get("RECOGNITION_CACHE", "1") == "1"
+RECOGNITION_CACHE_TTL_SECONDS = float(os.environ.get("RECOGNITION_CACHE_TTL_SECONDS", "12"))
+RECOGNITION_CACHE_MAX_CLIENTS = int(os.environ.get("RECOGNITION_CACHE_MAX_CLIENTS", "256"))
+RECOGNITION_CACHE_ENTRIES_PER_CLIENT = int(os.environ.get("RECOGNITION_CACHE_ENTRIES_PER_CLIENT", "4"))
+RECOGNITION_CACHE_MAX_HAMMING = int(os.environ.get("RECOGNITION_CACHE_MAX_HAMMING", "4"))
+
+
+def dhash(img, hash_size=8):
+    # img: array BGR (ou cinza) -> inteiro de hash_size*hash_size bits
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class RecognitionCache:
+
+    def __init__(self, ttl_seconds=None, max_clients=None, entries_per_client=None, max_hamming=None):
+        self.ttl = RECOGNITION_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_clients = RECOGNITION_CACHE_MAX_CLIENTS if max_clients is None else max_clients
+        self.entries_per_client = RECOGNITION_CACHE_ENTRIES_PER_CLIENT if entries_per_client is None else entries_per_client
+        self.max_hamming = RECOGNITION_CACHE_MAX_HAMMING if max_hamming is None else max_hamming
+        self._entries = OrderedDict() # (client_ip, modo) -> [(hash, instante, resultado), ...] do mais novo para o mais antigo
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, client_key, frame_hash):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.get(client_key)
+            if entries:
+                entries[:] = [entry for entry in entries if now - entry[1] <= self.ttl]
+                for cached_hash, _, result in entries:
+                    if bin(cached_hash ^ frame_hash).count("1") <= self.max_hamming:
+                        self._entries.move_to_end(client_key)
+                        self.stats["hits"] += 1
+                        return result
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, client_key, frame_hash, result):
+        with self._lock:
+            entries = self._entries.setdefault(client_key, [])
+            entries.insert(0, (frame_hash, time.monotonic(), result))
+            del entries[self.entries_per_client:]
+            self._entries.move_to_end(client_key)
+            while len(self._entries) > self.max_clients:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+                "clients": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "max_hamming": self.max_hamming,
+                "enabled": RECOGNITION_CACHE_ENABLED
+            }
@@ -0,0 +1,287 @@
+import os
+import numpy as np
+
+# Índice vetorial usado pelo reconhecimento facial.
+# Em vez de chamar DeepFace.verify para cada aluno cadastrado (o que re-detecta e
+# re-calcula o embedding das duas imagens a cada comparação), os embeddings já
+# calculados são empilhados em uma única matriz float32 normalizada (norma L2 = 1).
+# Assim a distância de cosseno para todos os alunos sai de um único produto matriz-vetor:
+#   distancia = 1 - (galeria @ probe)
+#
+# Há dois backends com a mesma interface (build/add/remove/search/search_k/search_batch):
+#   - FlatIndex: busca exata, varre todos os vetores (ideal até alguns milhares de alunos)
+#   - IVFIndex:  busca aproximada (inverted file). Os vetores são agrupados por k-means em
+#                "listas" e cada consulta só varre as nprobe listas mais próximas.
+# O backend é escolhido por GALLERY_INDEX_BACKEND ("flat" ou "ivf").
+# Uma chave (matrícula) pode ter várias linhas: o modelo do aluno é o centroide das amostras mais
+# alguns exemplares (services/face_templates.py) e a distância da chave é a da linha mais próxima.
+
+INDEX_BACKEND = os.environ.get("GALLERY_INDEX_BACKEND", "flat").lower()
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0")) # 0 = automático (~raiz quadrada do tamanho da galeria)
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))
+IVF_MIN_TRAIN_SIZE = int(os.environ.get("IVF_MIN_TRAIN_SIZE", "2048")) # Abaixo disso o IVF se comporta como busca exata
+
+
+def l2_normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0 # Evita divisão por zero para vetores nulos
+    return vectors / norms
+
+
+def _top_k(keys, matrix, probe, k):
+    # Retorna os k pares (chave, distancia) mais próximos de probe, em ordem crescente de distância.
+    # Uma chave pode ter várias linhas (modelo do aluno: centroide + exemplares); vale a mais próxima,
+    # e cada chave aparece uma vez só no resultado.
+    if not keys:
+        return []
+    distances = 1.0 - matrix @ probe
+    if k == 1:
+        best = int(np.argmin(distances))
+        return [(keys[best], float(distances[best]))]
+    n = len(keys)
+    m = min(n, 4 * k)
+    while True:
+        candidates = np.argpartition(distances, m - 1)[:m] if m < n else np.arange(n)
+        results = []
+        seen = set()
+        for i in candidates[np.argsort(distances[candidates])]:
+            if keys[i] not in seen:
+                seen.add(keys[i])
+                results.append((keys[i], float(distances[i])))
+                if len(results) == k:
+                    return results
+        if m == n:
+            return results
+        m = min(n, 4 * m) # Poucas chaves distintas entre os candidatos: amplia a busca
+
+
+def _nearest_batch(keys, matrix, probes):
+    probes = l2_normalize(np.asarray(probes, dtype=np.float32).reshape(len(probes), -1)) if len(probes) else probes
+    if not keys or len(probes) == 0:
+        return [(None, float('inf'))] * len(probes)
+    distances = 1.0 - probes @ matrix.T
+    best = np.argmin(distances, axis=1)
+    return [(keys[i], float(distances[row, i])) for row, i in enumerate(best)]
+
+
+class FlatIndex:
+    # Busca exata (força bruta vetorizada) sobre todos os embeddings da galeria.
+
+    def __init__(self):
+        self.keys = []
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def build(self, keys, vectors):
+        self.keys = list(keys)
+        if self.keys:
+            self.matrix = l2_normalize(np.vstack([np.asarray(v, dtype=np.float32) for v in vectors]))
+        else:
+            self.matrix = np.empty((0, 0), dtype=np.float32)
+
+    def add(self, key, vector):
+        # vector pode ser um embedding ou uma matriz com várias linhas da mesma chave
+        rows = l2_normalize(vector).reshape(-1, np.shape(vector)[-1])
+        self.matrix = rows if not self.keys else np.vstack([self.matrix, rows])
+        self.keys.extend([key] * len(rows))
+
+    def remove(self, key):
+        # Remove todas as linhas associadas à chave; retorna True se alguma foi removida
+        keep = [i for i, k in enumerate(self.keys) if k != key]
+        if len(keep) == len(self.keys):
+            return False
+        self.keys = [self.keys[i] for i in keep]
+        self.matrix = self.matrix[keep] if keep else np.empty((0, 0), dtype=np.float32)
+        return True
+
+    def search_k(self, probe, k=1):
+        return _top_k(self.keys, self.matrix, l2_normalize(probe), k)
+
+    def search(self, probe):
+        # Retorna (chave, distancia_cosseno) do vizinho mais próximo, ou (None, inf) se o índice estiver vazio
+        results = self.search_k(probe, 1)
+        return results[0] if results else (None, float('inf'))
+
+    def search_batch(self, probes):
+        # Vizinho mais próximo de vários probes (ex.: todos os rostos de um quadro) em um único
+        # produto matriz-matriz. Retorna uma lista de (chave, distancia) na ordem dos probes.
+        return _nearest_batch(self.keys, self.matrix, probes)
+
+
+class IVFIndex:
+    # Busca aproximada: k-means esférico define nlist centroides; cada vetor fica na lista do
+    # centroide mais próximo e a consulta varre só as nprobe listas mais próximas do probe.
+    # Enquanto a galeria tem menos de min_train_size vetores, tudo fica em uma única lista (busca exata).
+
+    def __init__(self, nlist=None, nprobe=None, min_train_size=None, seed=0):
+        self.nlist = nlist if nlist is not None else IVF_NLIST
+        self.nprobe = nprobe if nprobe is not None else IVF_NPROBE
+        self.min_train_size = min_train_size if min_train_size is not None else IVF_MIN_TRAIN_SIZE
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self.lists = [([], np.empty((0, 0), dtype=np.float32))]
+        self.key_lists = {} # chave -> ids das listas onde ela aparece (para remoção incremental)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _all_items(self):
+        keys = []
+        matrices = []
+        for list_keys, list_matrix in self.lists:
+            if list_keys:
+                keys.extend(list_keys)
+                matrices.append(list_matrix)
+        return keys, (np.vstack(matrices) if matrices else np.empty((0, 0), dtype=np.float32))
+
+    def _train(self, matrix):
+        n = matrix.shape[0]
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+        centroids = matrix[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(10):
+            assignment = np.argmax(matrix @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = matrix[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+                else:
+                    centroids[c] = matrix[rng.integers(n)] # Reinicia centroides vazios
+            centroids = l2_normalize(centroids)
+        self.centroids = centroids
+        self.trained_size = n
+
+    def build(self, keys, vectors):
+        keys = list(keys)
+        matrix = l2_normalize(np.vstack([np.asarray(v, dtype=np.float32) for v in vectors])) if keys else np.empty((0, 0), dtype=np.float32)
+        self._assign_all(keys, matrix, retrain=True)
+
+    def _assign_all(self, keys, matrix, retrain):
+        self.key_lists = {}
+        self._size = len(keys)
+        if retrain:
+            self.centroids = None
+            self.trained_size = 0
+            if len(keys) >= self.min_train_size:
+                self._train(matrix)
+
+        if self.centroids is None:
+            self.lists = [(keys, matrix)]
+            for key in keys:
+                self.key_lists.setdefault(key, set()).add(0)
+            return
+
+        assignment = np.argmax(matrix @ self.centroids.T, axis=1) if keys else np.empty(0, dtype=int)
+        self.lists = []
+        for c in range(len(self.centroids)):
+            rows = np.flatnonzero(assignment == c)
+            self.lists.append(([keys[i] for i in rows], matrix[rows]))
+            for i in rows:
+                self.key_lists.setdefault(keys[i], set()).add(c)
+
+    def add(self, key, vector):
+        # vector pode ser um embedding ou uma matriz com várias linhas da mesma chave
+        rows = l2_normalize(vector).reshape(-1, np.shape(vector)[-1])
+        list_ids = np.zeros(len(rows), dtype=int) if self.centroids is None else np.argmax(rows @ self.centroids.T, axis=1)
+        for list_id in np.unique(list_ids):
+            list_id = int(list_id)
+            new_rows = rows[list_ids == list_id]
+            list_keys, list_matrix = self.lists[list_id]
+            list_matrix = new_rows if not list_keys else np.vstack([list_matrix, new_rows])
+            self.lists[list_id] = (list_keys + [key] * len(new_rows), list_matrix)
+            self.key_lists.setdefault(key, set()).add(list_id)
+        self._size += len(rows)
+
+        # Treina quando a galeria atinge o tamanho mínimo e re-treina quando ela dobra,
+        # para que as listas continuem balanceadas conforme novos alunos são cadastrados
+        if self._size >= self.min_train_size and self._size >= 2 * self.trained_size:
+            keys, matrix = self._all_items()
+            self._assign_all(keys, matrix, retrain=True)
+
+    def remove(self, key):
+        list_ids = self.key_lists.pop(key, None)
+        if not list_ids:
+            return False
+        for list_id in list_ids:
+            list_keys, list_matrix = self.lists[list_id]
+            keep = [i for i, k in enumerate(list_keys) if k != key]
+            self._size -= len(list_keys) - len(keep)
+            self.lists[list_id] = ([list_keys[i] for i in keep], list_matrix[keep] if keep else np.empty((0, 0), dtype=np.float32))
+        return True
+
+    def search_k(self, probe, k=1):
+        probe = l2_normalize(probe)
+        if self.centroids is None:
+            list_keys, list_matrix = self.lists[0]
+            return _top_k(list_keys, list_matrix, probe, k)
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_distances = 1.0 - self.centroids @ probe
+        probe_lists = np.argpartition(centroid_distances, nprobe - 1)[:nprobe]
+        return self._search_lists(probe, probe_lists, k)
+
+    def _search_lists(self, probe, probe_lists, k):
+        # Varre só as listas escolhidas para o probe (já normalizado)
+        keys = []
+        matrices = []
+        for list_id in probe_lists:
+            list_keys, list_matrix = self.lists[list_id]
+            if list_keys:
+                keys.extend(list_keys)
+                matrices.append(list_matrix)
+        if not keys:
+            return []
+        return _top_k(keys, np.vstack(matrices), probe, k)
+
+    def search(self, probe):
+        results = self.search_k(probe, 1)
+        return results[0] if results else (None, float('inf'))
+
+    def search_batch(self, probes):
+        if self.centroids is None:
+            list_keys, list_matrix = self.lists[0]
+            return _nearest_batch(list_keys, list_matrix, probes)
+        probes = l2_normalize(np.asarray(probes, dtype=np.float32).reshape(len(probes), -1)) if len(probes) else probes
+        if len(probes) == 0:
+            return []
+        # A escolha das listas de todos os probes sai de um único produto com os centroides;
+        # depois cada probe varre as suas nprobe listas
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_distances = 1.0 - probes @ self.centroids.T
+        probe_lists = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for probe, list_ids in zip(probes, probe_lists):
+            nearest = self._search_lists(probe, list_ids, 1)
+            results.append(nearest[0] if nearest else (None, float('inf')))
+        return results
+
+
+def create_index(backend=None):
+    backend = (backend or INDEX_BACKEND).lower()
+    if backend == "ivf":
+        return IVFIndex()
+    if backend != "flat":
+        print(f"Backend de índice desconhecido '{backend}', usando 'flat' (services/vector_index.py)")
+    return FlatIndex()
+
+
+def measure_recall(index, exact_index, queries, k=1):
+    # Fração dos k vizinhos exatos que o índice aproximado também retornou (recall@k).
+    # Usado para ajustar nlist/nprobe do IVF comparando com o FlatIndex.
+    if len(queries) == 0:
+        return 1.0
+    total = 0.0
+    for probe in queries:
+        exact = {key for key, _ in exact_index.search_k(probe, k)}
+        if not exact:
+            total += 1.0
+            continue
+        approx = {key for key, _ in index.search_k(probe, k)}
+        total += len(exact & approx) / len(exact)
+    return total / len(queries)
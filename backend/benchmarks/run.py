@@ -0,0 +1,397 @@
+# Benchmarks offline dos caminhos críticos de reconhecimento e frequência.
+#
+# Uso (a partir de backend/):
+#   python -m benchmarks.run [--stages matching,cooldown,enrolment,queries,csv,recognition]
+#                            [--gallery-sizes 1000,10000,50000] [--students 2000] [--attendances 200000]
+#                            [--repeat 200] [--model stub|deepface|onnx --image foto.jpg] [--output resultado.json]
+#
+# Tudo roda em um diretório temporário (APP_DATA_DIR), com galerias sintéticas (vetores unitários
+# aleatórios de 512 dimensões, como o ArcFace) e históricos SQLite sintéticos, então não toca nos
+# dados reais. Com --model stub (padrão) a detecção/embedding é substituída por uma função que
+# devolve um vetor da galeria com ruído: a suíte roda sem baixar pesos e mede só o nosso código.
+# A saída é um JSON (um resultado por etapa/medição) para comparar regressões entre commits.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+EMBEDDING_DIM = 512
+ALL_STAGES = ["matching", "cooldown", "enrolment", "queries", "csv", "recognition"]
+
+FIRST_NAMES = ["João", "Maria", "José", "Ana", "Antônio", "Francisca", "Luís", "Conceição", "Sebastião", "Lúcia", "Inês", "Caio"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Araújo", "Gonçalves", "Ribeiro", "Simões", "Brandão", "Conceição"]
+TURMAS = ["1A", "1B", "2A", "2B", "3A", "3B", "4A", "5A"]
+TURNOS = ["Manhã", "Tarde"]
+
+
+# --- Medição ---
+
+def _summary(samples):
+    samples_ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "n": int(samples_ms.size),
+        "mean_ms": round(float(samples_ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 4),
+        "min_ms": round(float(samples_ms.min()), 4),
+        "max_ms": round(float(samples_ms.max()), 4),
+    }
+
+def _time_calls(fn, repeat, warmup=1, setup=None):
+    # setup (opcional) roda antes de cada chamada e fica fora da medição
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+def _time_once(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def _result(stage, name, params, **measures):
+    return {"stage": stage, "name": name, "params": params, **measures}
+
+
+# --- Dados sintéticos ---
+
+def random_unit_vectors(rng, n, dim=EMBEDDING_DIM):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def noisy_probes(rng, gallery, n, noise=0.3):
+    rows = rng.integers(0, len(gallery), n)
+    return gallery[rows] + noise * random_unit_vectors(rng, n, gallery.shape[1]), rows
+
+def build_synthetic_history(database, num_students, num_attendances, num_units, days, seed):
+    # Cria o schema pelo próprio init_db (migrações, índices e triggers) e insere os dados em lote
+    rng = random.Random(seed)
+    database.init_db()
+    conn = database.get_db_connection()
+    try:
+        conn.executemany(
+            'INSERT INTO school_units (name, ip_range_start, ip_range_end) VALUES (?, ?, ?)',
+            [(f"Unidade {u}", f"10.{u}.0.1", f"10.{u}.0.254") for u in range(1, num_units + 1)]
+        )
+        students = []
+        for i in range(num_students):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+            students.append((name, f"B{i:06d}", rng.choice(TURMAS), rng.choice(TURNOS), rng.randint(6, 17),
+                             f"student_images/B{i:06d}.jpg", rng.randint(1, num_units)))
+        conn.executemany(
+            'INSERT INTO students (name, matricula, turma, turno, idade, image_path, school_unit_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            students
+        )
+        start_day = datetime.now().replace(hour=7, minute=0, second=0, microsecond=0) - timedelta(days=days)
+        attendances = []
+        for _ in range(num_attendances):
+            timestamp = start_day + timedelta(days=rng.randrange(days), seconds=rng.randrange(11 * 3600))
+            attendances.append((f"B{rng.randrange(num_students):06d}", timestamp.isoformat(), f"10.1.0.{rng.randint(1, 254)}"))
+        conn.executemany('INSERT INTO attendances (student_matricula, timestamp, client_ip) VALUES (?, ?, ?)', attendances)
+        conn.commit()
+    finally:
+        conn.close()
+    return start_day
+
+
+# --- Etapas ---
+
+def bench_matching(args, rng):
+    from app.services.vector_index import FlatIndex, IVFIndex, measure_recall
+    results = []
+    for size in args.gallery_sizes:
+        gallery = random_unit_vectors(rng, size)
+        keys = [f"B{i:06d}" for i in range(size)]
+        probes, _ = noisy_probes(rng, gallery, args.repeat)
+        batch, _ = noisy_probes(rng, gallery, args.batch_faces)
+        flat = FlatIndex()
+        for backend, index in (("flat", flat), ("ivf", IVFIndex())):
+            build_seconds, _ = _time_once(lambda: index.build(keys, gallery))
+            params = {"gallery_size": size, "backend": backend}
+            results.append(_result("matching", "build", params, seconds=round(build_seconds, 4)))
+            probe_iter = iter(probes)
+            results.append(_result("matching", "search", params,
+                                   **_time_calls(lambda: index.search(next(probe_iter)), args.repeat - 1)))
+            results.append(_result("matching", "search_batch", dict(params, faces=args.batch_faces),
+                                   **_time_calls(lambda: index.search_batch(batch), args.repeat)))
+            if backend != "flat":
+                recall = measure_recall(index, flat, probes[:min(200, len(probes))], k=1)
+                results.append(_result("matching", "recall_at_1", params, recall=round(recall, 4)))
+    return results
+
+def bench_cooldown(args, database):
+    rng = random.Random(args.seed)
+    params = {"students": args.students, "attendances": args.attendances}
+    matriculas = [f"B{rng.randrange(args.students):06d}" for _ in range(args.repeat + 1)]
+
+    def next_matricula():
+        return matriculas[rng.randrange(len(matriculas))]
+
+    results = []
+    # Sem cache: cada verificação vai ao SQLite (índice student_matricula, timestamp)
+    results.append(_result("cooldown", "is_duplicate_db", params, **_time_calls(
+        lambda: database.is_duplicate_attendance(next_matricula()), args.repeat,
+        setup=database.invalidate_recent_attendance)))
+    # Com o cache em memória aquecido (o mesmo aluno na frente do quiosque)
+    database.register_attendance_in_db(matriculas[0], "127.0.0.1")
+    results.append(_result("cooldown", "is_duplicate_cached", params, **_time_calls(
+        lambda: database.is_duplicate_attendance(matriculas[0]), args.repeat)))
+    # Inserção condicional atômica: caminho "duplicate" sem cache e caminho "recorded"
+    results.append(_result("cooldown", "register_if_not_duplicate_duplicate", params, **_time_calls(
+        lambda: database.register_attendance_if_not_duplicate(matriculas[0], "127.0.0.1"), args.repeat,
+        setup=database.invalidate_recent_attendance)))
+    fresh = iter(range(args.repeat + 1))
+    results.append(_result("cooldown", "register_if_not_duplicate_recorded", params, **_time_calls(
+        lambda: database.register_attendance_if_not_duplicate(f"B{next(fresh) % args.students:06d}", "127.0.0.1", cooldown_minutes=0),
+        args.repeat)))
+    return results
+
+def bench_enrolment(args, rng, work_dir):
+    from app.services.embedding_store import EmbeddingStore
+    results = []
+    for size in args.gallery_sizes:
+        store_dir = os.path.join(work_dir, f"store_{size}")
+        store = EmbeddingStore(store_dir)
+        vectors = random_unit_vectors(rng, size)
+        records = [{"name": f"Aluno {i}", "matricula": f"B{i:06d}", "image_path": f"student_images/B{i:06d}.jpg",
+                    "school_unit_id": 1, "embedding": vectors[i]} for i in range(size)]
+        params = {"gallery_size": size}
+        bulk_seconds, _ = _time_once(lambda: store.append_many(records))
+        results.append(_result("enrolment", "append_many", params, seconds=round(bulk_seconds, 4),
+                               records_per_second=round(size / bulk_seconds, 1) if bulk_seconds else None))
+        extra = random_unit_vectors(rng, args.repeat + 1)
+        counter = iter(range(args.repeat + 1))
+
+        def append_one():
+            i = next(counter)
+            store.append({"name": f"Novo {i}", "matricula": f"N{i:06d}", "image_path": "", "school_unit_id": 1, "embedding": extra[i]})
+
+        results.append(_result("enrolment", "append_one", params, **_time_calls(append_one, args.repeat)))
+        load_seconds, loaded = _time_once(store.load)
+        results.append(_result("enrolment", "load", dict(params, records=len(loaded)), seconds=round(load_seconds, 4)))
+        compact_seconds, _ = _time_once(store.compact)
+        results.append(_result("enrolment", "compact", params, seconds=round(compact_seconds, 4)))
+        shutil.rmtree(store_dir, ignore_errors=True)
+    return results
+
+def bench_queries(args, database, start_day):
+    params = {"students": args.students, "attendances": args.attendances}
+    start = start_day.date().isoformat()
+    end = (start_day + timedelta(days=args.days)).date().isoformat()
+    results = []
+    results.append(_result("queries", "page_first", params, **_time_calls(
+        lambda: database.get_attendances_page(None, None, None, None, None, limit=100), args.repeat)))
+    first = database.get_attendances_page(None, None, None, None, None, limit=100)
+    results.append(_result("queries", "page_next_cursor", params, **_time_calls(
+        lambda: database.get_attendances_page(None, None, None, None, None, cursor=first["next_cursor"], limit=100), args.repeat)))
+    results.append(_result("queries", "page_turma_unit", params, **_time_calls(
+        lambda: database.get_attendances_page(start, end, "1A", None, 1, limit=100), args.repeat)))
+    results.append(_result("queries", "page_search_prefix", params, **_time_calls(
+        lambda: database.get_attendances_page(None, None, None, "conce", None, limit=100), args.repeat)))
+    results.append(_result("queries", "students_search", params, **_time_calls(
+        lambda: database.get_students_by_school_unit(1, "joao silv"), args.repeat)))
+    results.append(_result("queries", "daily_summary", params, **_time_calls(
+        lambda: database.get_daily_attendance_summary(start, end), max(1, args.repeat // 10))))
+    results.append(_result("queries", "absent_students", params, **_time_calls(
+        lambda: database.get_absent_students(end), max(1, args.repeat // 10))))
+    full_seconds, rows = _time_once(lambda: sum(1 for _ in database.iter_attendances_from_db(None, None, None, None, None)))
+    results.append(_result("queries", "iterate_all", dict(params, rows=rows), seconds=round(full_seconds, 4),
+                           rows_per_second=round(rows / full_seconds, 1) if full_seconds else None))
+    return results
+
+def bench_csv(args, database):
+    from app.routes import generate_attendances_csv, gzip_stream
+    params = {"attendances": args.attendances}
+    results = []
+    for name, make_chunks in (
+        ("export_csv", lambda: generate_attendances_csv(database.iter_attendances_from_db(None, None, None, None, None))),
+        ("export_csv_gzip", lambda: gzip_stream(generate_attendances_csv(database.iter_attendances_from_db(None, None, None, None, None)))),
+    ):
+        seconds, total_bytes = _time_once(lambda: sum(len(chunk) for chunk in make_chunks()))
+        results.append(_result("csv", name, params, seconds=round(seconds, 4), bytes=total_bytes,
+                               rows_per_second=round(args.attendances / seconds, 1) if seconds else None))
+    return results
+
+def bench_recognition(args, rng, database):
+    import cv2
+    from app.services import face_recognition
+    from app.services.inference import InferenceService
+    from app.services.frame_quality import filter_faces
+
+    size = args.gallery_sizes[0]
+    gallery = random_unit_vectors(rng, size)
+    records = [{"name": f"Aluno {i}", "matricula": f"B{i:06d}", "image_path": "", "school_unit_id": 1,
+                "embedding": gallery[i]} for i in range(size)]
+    face_recognition.add_student_embeddings_bulk(records)
+
+    if args.model == "stub":
+        # Modelo substituído: um "rosto" do tamanho do quadro e um embedding próximo de um aluno da galeria
+        # (ou, com stub_probe["unknown"], um embedding aleatório, longe de todos: rosto não reconhecido)
+        frame = rng.integers(40, 215, (480, 640, 3), dtype=np.uint8)
+        stub_probe = {"unknown": False}
+
+        def detect(img, enforce_detection=False):
+            height, width = img.shape[:2]
+            return [{"face": img, "facial_area": {"x": 0, "y": 0, "w": width, "h": height}, "confidence": 1.0}]
+
+        def embed(faces):
+            if stub_probe["unknown"]:
+                return random_unit_vectors(rng, len(faces))
+            probes, _ = noisy_probes(rng, gallery, len(faces), noise=0.2)
+            return probes
+
+        face_recognition.INFERENCE_SERVICE = InferenceService(detect, embed, quality_fn=filter_faces)
+    else:
+        stub_probe = {}
+        frame = cv2.imread(args.image)
+        if frame is None:
+            raise SystemExit(f"--model {args.model} exige --image com uma foto contendo um rosto.")
+        # Backend real escolhido na linha de comando (ver services/embedders.py)
+        from app.services.embedders import create_embedder
+        face_recognition.EMBEDDER = create_embedder(args.model)
+        face_recognition.warm_up_models()
+
+    image_bytes = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+    params = {"gallery_size": size, "model": args.model, "frame_bytes": len(image_bytes)}
+    repeat = args.repeat if args.model == "stub" else max(5, args.repeat // 20)
+
+    results = [_result("recognition", "recognize_face_from_image", params, **_time_calls(
+        lambda: face_recognition.recognize_face_from_image(image_bytes), repeat))]
+
+    # Requisição HTTP completa (JSON + base64 + reconhecimento + cooldown) pelo cliente de teste do Flask
+    import base64
+    from app.main import app
+    client = app.test_client()
+    payload = {"image": "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode("ascii")}
+    # Sem cache (quadro novo a cada requisição) e com o cache de quadros quase idênticos
+    results.append(_result("recognition", "http_recognize", params, **_time_calls(
+        lambda: client.post("/api/recognize", json=payload), repeat, setup=face_recognition.RECOGNITION_CACHE.clear)))
+    # O cache só guarda resultados negativos: o quadro repetido precisa dar "não reconhecido". Com o
+    # modelo real isso já acontece (a foto de --image não está na galeria aleatória); no stub, troca o embedding.
+    stub_probe["unknown"] = True
+    results.append(_result("recognition", "http_recognize_cached", params, **_time_calls(
+        lambda: client.post("/api/recognize", json=payload), repeat)))
+    stub_probe["unknown"] = False
+    chip = cv2.resize(frame, (face_recognition.FACE_CHIP_SIZE, face_recognition.FACE_CHIP_SIZE))
+    chip_bytes = cv2.imencode(".jpg", chip)[1].tobytes()
+    results.append(_result("recognition", "http_recognize_chip", dict(params, chip_bytes=len(chip_bytes)), **_time_calls(
+        lambda: client.post("/api/recognize/chip", data=chip_bytes, content_type="application/octet-stream"), repeat)))
+    return results
+
+
+# --- Execução ---
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks offline de reconhecimento e frequência.")
+    parser.add_argument("--stages", default=",".join(ALL_STAGES), help="Etapas separadas por vírgula: " + ", ".join(ALL_STAGES))
+    parser.add_argument("--gallery-sizes", type=_int_list, default=[1000, 10000, 50000])
+    parser.add_argument("--batch-faces", type=int, default=8, help="Rostos por quadro no search_batch")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--attendances", type=int, default=200000)
+    parser.add_argument("--units", type=int, default=4)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", choices=["stub", "deepface", "onnx"], default="stub")
+    parser.add_argument("--image", help="Foto usada com --model deepface/onnx")
+    parser.add_argument("--work-dir", help="Diretório de trabalho (padrão: temporário, apagado ao final)")
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: stdout)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(ALL_STAGES)
+    if unknown:
+        raise SystemExit(f"Etapas desconhecidas: {', '.join(sorted(unknown))}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="presenca-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    # Antes de importar app.*: banco, galeria e imagens vão para o diretório de trabalho
+    os.environ["APP_DATA_DIR"] = os.path.join(work_dir, "data")
+    os.environ.setdefault("WARMUP_MODELS", "0")
+    os.environ.setdefault("GALLERY_SYNC_INTERVAL_SECONDS", "3600")
+
+    # Os serviços registram o progresso com print(); vai para stderr para não misturar com o JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        from app.services import database
+
+        rng = np.random.default_rng(args.seed)
+        results = []
+        started = time.time()
+        try:
+            start_day = None
+            if any(stage in stages for stage in ("cooldown", "queries", "csv", "recognition")):
+                seconds, start_day = _time_once(lambda: build_synthetic_history(
+                    database, args.students, args.attendances, args.units, args.days, args.seed))
+                results.append(_result("setup", "synthetic_history", {"students": args.students, "attendances": args.attendances},
+                                       seconds=round(seconds, 4)))
+            for stage in stages:
+                print(f"Executando etapa '{stage}'...", file=sys.stderr)
+                if stage == "matching":
+                    results.extend(bench_matching(args, rng))
+                elif stage == "cooldown":
+                    results.extend(bench_cooldown(args, database))
+                elif stage == "enrolment":
+                    results.extend(bench_enrolment(args, rng, work_dir))
+                elif stage == "queries":
+                    results.extend(bench_queries(args, database, start_day))
+                elif stage == "csv":
+                    results.extend(bench_csv(args, database))
+                elif stage == "recognition":
+                    results.extend(bench_recognition(args, rng, database))
+        finally:
+            database.close_db_connection()
+            if not args.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.fromtimestamp(started).isoformat(),
+            "duration_seconds": round(time.time() - started, 2),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "work_dir")},
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Resultados gravados em {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# Testes das camadas de banco, armazenamento de embeddings, índice e modelos de aluno.
+#
+# Uso (a partir de backend/):
+#   python -m pytest -q
+#
+# Tudo roda em diretórios temporários (APP_DATA_DIR), então não toca nos dados reais. Os módulos
+# que dependem do OpenCV/DeepFace (detecção, reconhecimento, rotas) ficam de fora ou usam
+# pytest.importorskip: estes testes cobrem o nosso código, sem baixar pesos.
+import os
+import tempfile
+
+import pytest
+
+# Antes de importar app.services.*: os módulos leem APP_DATA_DIR na importação
+os.environ.setdefault("APP_DATA_DIR", tempfile.mkdtemp(prefix="auto-presenca-tests-"))
+
+from app.services import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # Banco novo por teste, com o schema e as migrações aplicados
+    database.close_db_connection()
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "attendance.db"))
+    monkeypatch.setattr(database, "_student_fts_available", None)
+    database.invalidate_recent_attendance()
+    database.invalidate_ip_range_table()
+    database.init_db()
+    yield database
+    database.close_db_connection()
+    database.invalidate_recent_attendance()
+    database.invalidate_ip_range_table()
+
+
+@pytest.fixture
+def school_unit(db):
+    return db.add_school_unit_to_db("Escola Teste", "10.0.0.1", "10.0.0.254")
+
+
+@pytest.fixture
+def make_student(db):
+    def _make(matricula, name="Aluno Teste", turma="1A", turno="Manhã", school_unit_id=None):
+        assert db.add_student_to_db(name, matricula, turma, turno, 10, f"{matricula}.jpg", school_unit_id)
+        return matricula
+    return _make
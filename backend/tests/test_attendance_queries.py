@@ -0,0 +1,64 @@
+import pytest
+
+
+def test_iter_attendances_validates_filters_before_streaming(db):
+    # A rota só começa a responder depois desta chamada: o erro precisa sair aqui, não na iteração
+    with pytest.raises(ValueError):
+        db.iter_attendances_from_db("2024-13-45", None, None, None, None)
+    with pytest.raises(ValueError):
+        db.iter_attendances_from_db(None, "ontem", None, None, None)
+
+
+def test_iter_attendances_streams_rows_in_order(db, make_student):
+    make_student("2023001")
+    for _ in range(5):
+        db.register_attendance_in_db("2023001", "10.0.0.5")
+    rows = list(db.iter_attendances_from_db(None, None, None, None, None, fetch_size=2))
+    assert len(rows) == 5
+    assert [row["id"] for row in rows] == sorted((row["id"] for row in rows), reverse=True)
+
+
+def _insert_attendances(db, rows):
+    conn = db.get_db_connection()
+    conn.executemany("INSERT INTO attendances (student_matricula, timestamp, client_ip) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def test_keyset_pages_cover_all_rows_once_with_timestamp_ties(db, make_student):
+    make_student("2023001")
+    make_student("2023002", turma="2B")
+    # Vários registros com o mesmo timestamp: o desempate pelo id mantém as páginas estáveis
+    _insert_attendances(db, [("2023001", "2024-03-01T08:00:00", None)] * 4
+                        + [("2023002", "2024-03-01T09:30:00", None)] * 3
+                        + [("2023001", "2024-03-02T07:45:00", None)])
+    expected = [row["id"] for row in db.iter_attendances_from_db(None, None, None, None, None)]
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = db.get_attendances_page(None, None, None, None, None, cursor=cursor, limit=3)
+        seen.extend(item["id"] for item in page["items"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == expected
+    assert pages == 3
+
+
+def test_keyset_pages_keep_filters(db, make_student):
+    make_student("2023001")
+    make_student("2023002", turma="2B")
+    _insert_attendances(db, [("2023001", f"2024-03-0{day}T08:00:00", None) for day in range(1, 6)]
+                        + [("2023002", f"2024-03-0{day}T08:00:00", None) for day in range(1, 6)])
+    first = db.get_attendances_page("2024-03-02", "2024-03-04", "2B", None, None, limit=2)
+    second = db.get_attendances_page("2024-03-02", "2024-03-04", "2B", None, None, cursor=first["next_cursor"], limit=2)
+    items = first["items"] + second["items"]
+    assert [item["timestamp"][:10] for item in items] == ["2024-03-04", "2024-03-03", "2024-03-02"]
+    assert {item["matricula"] for item in items} == {"2023002"}
+    assert second["next_cursor"] is None
+
+
+def test_invalid_cursor_is_rejected(db):
+    with pytest.raises(ValueError):
+        db.get_attendances_page(None, None, None, None, None, cursor="não-é-um-cursor")
@@ -0,0 +1,52 @@
+import threading
+from datetime import datetime, timedelta
+
+
+def test_second_attendance_within_cooldown_is_duplicate(db, make_student):
+    make_student("2023001")
+    assert db.register_attendance_if_not_duplicate("2023001", "10.0.0.5") == "recorded"
+    assert db.register_attendance_if_not_duplicate("2023001", "10.0.0.5") == "duplicate"
+    db.invalidate_recent_attendance() # Mesmo sem o cache em memória, o banco barra a segunda
+    assert db.register_attendance_if_not_duplicate("2023001", "10.0.0.5") == "duplicate"
+    assert len(db.get_attendances_from_db(None, None, None, None, None)) == 1
+
+
+def test_attendance_after_cooldown_is_recorded(db, make_student):
+    make_student("2023001")
+    conn = db.get_db_connection()
+    old = (datetime.now() - timedelta(minutes=db.COOLDOWN_PERIOD_MINUTES + 1)).isoformat()
+    conn.execute("INSERT INTO attendances (student_matricula, timestamp) VALUES (?, ?)", ("2023001", old))
+    conn.commit()
+    conn.close()
+    assert db.register_attendance_if_not_duplicate("2023001") == "recorded"
+
+
+def test_concurrent_frames_record_a_single_attendance(db, make_student):
+    # Quadros simultâneos do mesmo aluno em threads diferentes (cada uma com a sua conexão do pool):
+    # o INSERT condicional garante um único registro, sem depender do cache em memória
+    make_student("2023001")
+    barrier = threading.Barrier(8)
+    statuses = []
+
+    def worker():
+        barrier.wait()
+        statuses.append(db._insert_attendance_if_not_duplicate("2023001", None, db.COOLDOWN_PERIOD_MINUTES))
+        db.close_db_connection()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == ["duplicate"] * 7 + ["recorded"]
+    assert len(db.get_attendances_from_db(None, None, None, None, None)) == 1
+
+
+def test_bulk_register_records_each_student_once(db, make_student):
+    make_student("2023001")
+    make_student("2023002")
+    assert db.register_attendance_if_not_duplicate("2023001") == "recorded"
+    statuses = db.register_attendances_if_not_duplicate(["2023001", "2023002", "2023002"])
+    assert statuses == {"2023001": "duplicate", "2023002": "recorded"}
+    summary = db.get_daily_attendance_summary()
+    assert sum(row["present_count"] for row in summary) == 2
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.services.embedding_store import EmbeddingStore
+
+DIM = 8
+
+
+def _record(matricula, seed=None, exemplars=0):
+    rng = np.random.default_rng(seed if seed is not None else int(matricula))
+    record = {"name": f"Aluno {matricula}", "matricula": matricula, "image_path": f"{matricula}.jpg",
+              "school_unit_id": 1, "embedding": rng.standard_normal(DIM).astype(np.float32)}
+    if exemplars:
+        record["exemplars"] = rng.standard_normal((exemplars, DIM)).astype(np.float32)
+    return record
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / "embeddings")
+
+
+def test_append_load_and_delete(store_dir):
+    store = EmbeddingStore(store_dir)
+    store.append_many([_record(str(i)) for i in range(3)])
+    store.delete("1")
+    records = {rec["matricula"]: rec for rec in EmbeddingStore(store_dir).load()}
+    assert sorted(records) == ["0", "2"]
+    np.testing.assert_array_equal(records["2"]["embedding"], _record("2")["embedding"])
+
+
+def test_multi_row_record_keeps_exemplars(store_dir):
+    store = EmbeddingStore(store_dir)
+    record = _record("7", exemplars=3)
+    store.append(record)
+    loaded = EmbeddingStore(store_dir).load()[0]
+    np.testing.assert_array_equal(loaded["embedding"], record["embedding"])
+    np.testing.assert_array_equal(loaded["exemplars"], record["exemplars"])
+    assert store.total_rows == store.live_rows == 4
+
+
+def test_replacements_trigger_compaction_into_new_epoch(store_dir, monkeypatch):
+    monkeypatch.setattr("app.services.embedding_store.COMPACTION_MIN_DEAD_ROWS", 10)
+    store = EmbeddingStore(store_dir)
+    store.append_many([_record(str(i)) for i in range(20)])
+    assert store.read_generation()[0] == 0
+    store.append_many([_record(str(i), seed=100 + i) for i in range(10)]) # 10 linhas mortas de 30
+    epoch, _, _ = store.read_generation()
+    assert epoch == 1
+    assert not os.path.exists(store.vectors_path(0)) and not os.path.exists(store.log_path(0))
+    assert store.total_rows == store.live_rows == 20
+    records = {rec["matricula"]: rec for rec in EmbeddingStore(store_dir).load()}
+    assert len(records) == 20
+    np.testing.assert_array_equal(records["3"]["embedding"], _record("3", seed=103)["embedding"])
+
+
+def test_other_workers_appends_are_not_counted_as_dead_rows(store_dir):
+    # Dois workers na mesma época: as linhas gravadas por B estão vivas para A
+    worker_a = EmbeddingStore(store_dir)
+    worker_b = EmbeddingStore(store_dir)
+    worker_a.append(_record("0"))
+    worker_a.load()
+    worker_b.append_many([_record(str(i)) for i in range(1, 301)])
+    worker_a.append(_record("301"))
+    assert worker_a.read_generation()[0] == 0
+    assert worker_a.total_rows == worker_a.live_rows == 302
+
+
+def test_other_workers_deletes_still_trigger_compaction(store_dir, monkeypatch):
+    monkeypatch.setattr("app.services.embedding_store.COMPACTION_MIN_DEAD_ROWS", 10)
+    worker_a = EmbeddingStore(store_dir)
+    worker_b = EmbeddingStore(store_dir)
+    worker_a.append_many([_record(str(i)) for i in range(30)])
+    for i in range(12):
+        worker_b.delete(str(i)) # B conta as remoções a partir do log (nunca carregou a época)
+    assert worker_b.read_generation()[0] == 1
+    worker_a.append(_record("30"))
+    assert worker_a.read_generation()[0] == 1 # A enxerga a época nova e não compacta de novo
+    assert len(EmbeddingStore(store_dir).load()) == 19
+
+
+def test_worker_stays_on_delta_path_after_another_workers_bulk_append(store_dir):
+    # Fluxo de sync_gallery: A sincronizado em (época, geração, offset); B importa em lote e A cadastra
+    # um aluno. A galeria de A deve continuar sendo atualizada só pelo delta do log, sem nova época.
+    worker_a = EmbeddingStore(store_dir)
+    worker_b = EmbeddingStore(store_dir)
+    worker_a.append(_record("0"))
+    records, (epoch, generation, offset) = worker_a.load_with_state()
+    assert len(records) == 1
+
+    worker_b.append_many([_record(str(i)) for i in range(1, 301)])
+    worker_a.append(_record("301"))
+
+    new_epoch, new_generation, new_offset = worker_a.read_generation()
+    assert new_epoch == epoch
+    assert new_generation == generation + 2
+    changes, delta_offset = worker_a.read_delta(epoch, offset)
+    assert changes is not None
+    assert [payload["matricula"] for op, payload in changes] == [str(i) for i in range(1, 302)]
+    assert delta_offset == new_offset
+
+
+def test_writes_return_the_generation_transition(store_dir):
+    # Um worker sincronizado no estado anterior avança para o novo sem reler a própria escrita;
+    # com outro worker escrevendo no meio, o estado anterior não confere e o delta é lido
+    worker_a = EmbeddingStore(store_dir)
+    worker_b = EmbeddingStore(store_dir)
+    synced = worker_a.read_generation()
+    previous, new = worker_a.append_many([_record("1"), _record("2")])
+    assert previous == synced
+    assert new == worker_a.read_generation()
+    changes, _ = worker_a.read_delta(new[0], new[2])
+    assert changes == []
+
+    worker_b.append(_record("3"))
+    previous, new = worker_a.delete("1")
+    assert previous != synced and previous[1] == new[1] - 1
+    assert new == worker_a.read_generation()
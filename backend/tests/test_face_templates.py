@@ -0,0 +1,49 @@
+import numpy as np
+
+from app.services.face_templates import build_template, template_vectors, sample_from_bytes, sample_to_bytes
+from app.services.vector_index import l2_normalize
+
+DIM = 16
+
+
+def _around(center, count, noise, seed):
+    rng = np.random.default_rng(seed)
+    return [l2_normalize(center + rng.standard_normal(DIM) * noise) for _ in range(count)]
+
+
+def test_single_sample_has_no_exemplars():
+    sample = l2_normalize(np.arange(1, DIM + 1, dtype=np.float32))
+    centroid, exemplars = build_template([sample])
+    np.testing.assert_allclose(centroid, sample, atol=1e-6)
+    assert exemplars.shape == (0, DIM)
+
+
+def test_k_center_picks_one_exemplar_per_distinct_condition():
+    # Três "condições" (ex.: iluminações) bem separadas, com várias amostras quase iguais em cada
+    conditions = list(np.eye(DIM, dtype=np.float32)[:3])
+    samples = _around(conditions[0], 4, 0.01, 2) + _around(conditions[1], 4, 0.01, 3) + _around(conditions[2], 4, 0.01, 4)
+    centroid, exemplars = build_template(samples, exemplars=3, min_exemplar_distance=0.05)
+
+    assert abs(float(np.linalg.norm(centroid)) - 1.0) < 1e-5
+    assert exemplars.shape == (3, DIM)
+    covered = sorted(int(np.argmax([exemplar @ c for c in conditions])) for exemplar in exemplars)
+    assert covered == [0, 1, 2]
+
+    _, two = build_template(samples, exemplars=2, min_exemplar_distance=0.05)
+    assert len({int(np.argmax([exemplar @ c for c in conditions])) for exemplar in two}) == 2
+
+
+def test_near_duplicate_samples_do_not_become_exemplars():
+    base = l2_normalize(np.random.default_rng(5).standard_normal(DIM))
+    centroid, exemplars = build_template(_around(base, 6, 0.001, 6), exemplars=3, min_exemplar_distance=0.05)
+    assert exemplars.shape[0] == 0
+    assert template_vectors({"embedding": centroid, "exemplars": exemplars}).shape == (1, DIM)
+
+
+def test_template_vectors_and_sample_bytes_round_trip():
+    samples = _around(l2_normalize(np.ones(DIM)), 4, 0.5, 7)
+    centroid, exemplars = build_template(samples, exemplars=2, min_exemplar_distance=0.0)
+    rows = template_vectors({"embedding": centroid, "exemplars": exemplars})
+    assert rows.shape == (1 + len(exemplars), DIM)
+    np.testing.assert_array_equal(rows[0], centroid)
+    np.testing.assert_array_equal(sample_from_bytes(sample_to_bytes(samples[0])), samples[0])
@@ -0,0 +1,66 @@
+import sqlite3
+
+
+def _create_baseline_database(path):
+    # Schema anterior às migrações (user_version 0), com histórico já gravado
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, matricula TEXT UNIQUE NOT NULL,
+            turma TEXT NOT NULL, turno TEXT NOT NULL, idade INTEGER NOT NULL, image_path TEXT NOT NULL,
+            school_unit_id INTEGER
+        );
+        CREATE TABLE attendances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, student_matricula TEXT NOT NULL, timestamp TEXT NOT NULL, client_ip TEXT
+        );
+        CREATE TABLE school_units (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, ip_range_start TEXT, ip_range_end TEXT
+        );
+        INSERT INTO students (name, matricula, turma, turno, idade, image_path, school_unit_id)
+        VALUES ('Maria da Silva', '2023001', '1A', 'Manhã', 10, 'a.jpg', NULL),
+               ('João Souza', '2023002', '1A', 'Manhã', 11, 'b.jpg', NULL);
+        INSERT INTO attendances (student_matricula, timestamp) VALUES
+            ('2023001', '2024-03-01T08:00:00'), ('2023001', '2024-03-01T12:00:00'), ('2023002', '2024-03-01T08:05:00');
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def _user_version(db):
+    conn = db.get_db_connection()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.close()
+    return version
+
+
+def test_fresh_database_is_at_latest_version(db):
+    assert _user_version(db) == db.MIGRATIONS[-1][0]
+
+
+def test_migrations_upgrade_existing_database(db, tmp_path, monkeypatch):
+    path = str(tmp_path / "baseline.db")
+    _create_baseline_database(path)
+    db.close_db_connection()
+    monkeypatch.setattr(db, "DATABASE", path)
+    monkeypatch.setattr(db, "_student_fts_available", None)
+    db.init_db()
+
+    assert _user_version(db) == db.MIGRATIONS[-1][0]
+    conn = db.get_db_connection()
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert {"idx_attendances_matricula_timestamp", "idx_attendances_timestamp_id", "idx_face_samples_matricula"} <= indexes
+    # Resumo diário carregado a partir do histórico existente
+    summary = db.get_daily_attendance_summary()
+    assert [(row["day"], row["present_count"], row["attendance_count"]) for row in summary] == [("2024-03-01", 2, 3)]
+    # Alunos já cadastrados entram no índice de busca
+    assert [row["matricula"] for row in db.get_attendances_from_db(None, None, None, "joao", None)] == ["2023002"]
+
+
+def test_migrations_are_idempotent(db):
+    version = _user_version(db)
+    db.init_db()
+    conn = db.get_db_connection()
+    db.apply_migrations(conn)
+    conn.close()
+    assert _user_version(db) == version
@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.services.recognition_cache import RecognitionCache, dhash
+
+
+def _frame(seed):
+    rng = np.random.default_rng(seed)
+    return (rng.random((120, 160, 3)) * 255).astype(np.uint8)
+
+
+def test_dhash_tolerates_camera_noise():
+    frame = _frame(0)
+    noisy = np.clip(frame.astype(np.int16) + np.random.default_rng(1).integers(-3, 4, frame.shape), 0, 255).astype(np.uint8)
+    assert bin(dhash(frame) ^ dhash(noisy)).count("1") <= 4
+    assert bin(dhash(frame) ^ dhash(_frame(2))).count("1") > 4
+
+
+def test_near_identical_frame_hits_and_different_frame_misses():
+    cache = RecognitionCache(ttl_seconds=10, max_hamming=4)
+    result = {"recognized": False, "message": "Nenhum aluno reconhecido."}
+    cache.put(("10.0.0.5", "single"), 0b1010, result)
+    assert cache.get(("10.0.0.5", "single"), 0b1011) is result
+    assert cache.get(("10.0.0.5", "single"), 0b1010 ^ 0xFF) is None
+    assert cache.get(("10.0.0.6", "single"), 0b1010) is None # Outro quiosque
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = RecognitionCache(ttl_seconds=0.05)
+    cache.put(("10.0.0.5", "single"), 1, {"recognized": False})
+    time.sleep(0.1)
+    assert cache.get(("10.0.0.5", "single"), 1) is None
+
+
+def test_least_recently_used_client_is_evicted():
+    cache = RecognitionCache(ttl_seconds=10, max_clients=2)
+    for client in ("a", "b"):
+        cache.put((client, "single"), 1, {"recognized": False})
+    cache.get(("a", "single"), 1)
+    cache.put(("c", "single"), 1, {"recognized": False})
+    assert cache.get(("b", "single"), 1) is None
+    assert cache.get(("a", "single"), 1) is not None
@@ -0,0 +1,38 @@
+import pytest
+
+
+@pytest.fixture
+def students(db, school_unit, make_student):
+    make_student("2023001", name="Maria da Silva", school_unit_id=school_unit)
+    make_student("2023002", name="João Souza", school_unit_id=school_unit)
+    make_student("2024100", name="Ana Ribeiro", school_unit_id=school_unit)
+    return school_unit
+
+
+def _search(db, school_unit_id, query):
+    return sorted(student["matricula"] for student in db.get_students_by_school_unit(school_unit_id, query))
+
+
+def test_matricula_substring(db, students):
+    assert _search(db, students, "001") == ["2023001"]
+    assert _search(db, students, "2023") == ["2023001", "2023002"]
+    assert _search(db, students, "41") == ["2024100"]
+
+
+def test_name_prefix_and_accents(db, students):
+    assert _search(db, students, "mar sil") == ["2023001"]
+    assert _search(db, students, "joao") == ["2023002"]
+    assert _search(db, students, "souza jo") == ["2023002"]
+
+
+def test_attendance_filter_uses_same_search(db, students):
+    db.register_attendance_in_db("2023001")
+    db.register_attendance_in_db("2024100")
+    rows = db.get_attendances_from_db(None, None, None, "001", None)
+    assert [row["matricula"] for row in rows] == ["2023001"]
+
+
+def test_search_without_fts_falls_back_to_like(db, students, monkeypatch):
+    monkeypatch.setattr(db, "_student_fts_available", False)
+    assert _search(db, students, "Silva") == ["2023001"]
+    assert _search(db, students, "001") == ["2023001"]
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from app.services.vector_index import FlatIndex, IVFIndex, l2_normalize
+
+DIM = 16
+
+
+@pytest.fixture
+def gallery():
+    rng = np.random.default_rng(0)
+    return [f"m{i}" for i in range(50)], l2_normalize(rng.standard_normal((50, DIM)))
+
+
+@pytest.mark.parametrize("index", [FlatIndex(), IVFIndex(nlist=4, nprobe=4, min_train_size=10)])
+def test_nearest_key(index, gallery):
+    keys, vectors = gallery
+    index.build(keys, vectors)
+    assert index.search(vectors[7])[0] == "m7"
+    assert [key for key, _ in index.search_batch(vectors[[3, 9]])] == ["m3", "m9"]
+
+
+@pytest.mark.parametrize("index", [FlatIndex(), IVFIndex(nlist=4, nprobe=4, min_train_size=10)])
+def test_multi_row_key_is_returned_once_with_its_closest_row(index, gallery):
+    keys, vectors = gallery
+    keys, vectors, probe = keys[1:], vectors[1:], vectors[0]
+    index.build(keys, vectors)
+    # Centroide + exemplares: várias linhas perto do probe com a mesma chave
+    index.add("modelo", np.vstack([l2_normalize(probe + 0.05), l2_normalize(probe + 0.01), l2_normalize(probe - 0.02)]))
+    results = index.search_k(probe, 3)
+    result_keys = [key for key, _ in results]
+    assert len(set(result_keys)) == 3
+    assert result_keys[0] == "modelo"
+    assert results[0][1] == pytest.approx(1.0 - float(l2_normalize(probe + 0.01) @ probe), abs=1e-5)
+    assert index.remove("modelo")
+    assert "modelo" not in [key for key, _ in index.search_k(probe, 3)]
+    assert len(index) == len(keys)
+
+
+def test_empty_index():
+    index = FlatIndex()
+    assert index.search(np.ones(DIM)) == (None, float("inf"))
+    assert index.search_k(np.ones(DIM), 3) == []
+
+
+def test_ivf_search_batch_matches_search(gallery):
+    keys, vectors = gallery
+    # nprobe < nlist: cada probe varre só parte das listas
+    index = IVFIndex(nlist=8, nprobe=2, min_train_size=10)
+    index.build(keys, vectors)
+    probes = l2_normalize(vectors[:20] + 0.3 * np.random.default_rng(1).standard_normal((20, DIM)))
+    batch = index.search_batch(probes)
+    for probe, (key, distance) in zip(probes, batch):
+        expected_key, expected_distance = index.search(probe)
+        assert key == expected_key
+        assert distance == pytest.approx(expected_distance, abs=1e-5)
+    assert index.search_batch(np.empty((0, DIM))) == []
@@ -70,6 +70,64 @@ export async function recognizeFace(imageDataURL) {
     }
 }
 
+// Canal WebSocket persistente de reconhecimento: os quadros vão como Blob binário (sem JSON/base64)
+// e os resultados chegam como eventos JSON em onEvent. Retorna o WebSocket aberto.
+export function openRecognitionStream(onEvent, onClose) {
+    const wsUrl = new URL(`${API_BASE_URL}/recognize/stream`, window.location.href);
+    wsUrl.protocol = wsUrl.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(wsUrl.toString());
+    socket.binaryType = 'arraybuffer';
+    socket.onmessage = (event) => {
+        try {
+            onEvent(JSON.parse(event.data));
+        } catch (error) {
+            console.error('Evento inválido recebido do canal de reconhecimento:', error);
+        }
+    };
+    socket.onclose = () => onClose && onClose();
+    socket.onerror = (error) => console.error('Erro no canal WebSocket de reconhecimento:', error);
+    return socket;
+}
+
+// Recorte do rosto já alinhado no quiosque (Blob JPEG/PNG no tamanho FACE_CHIP_SIZE do backend),
+// enviado como binário: sem base64 e sem detecção no servidor
+export async function recognizeFaceChip(chipBlob) {
+    try {
+        const response = await fetch(`${API_BASE_URL}/recognize/chip`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: chipBlob
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Erro desconhecido ao reconhecer.');
+        }
+        return data;
+    } catch (error) {
+        console.error('Erro de rede ou ao enviar recorte do rosto para reconhecimento:', error);
+        throw error;
+    }
+}
+
+// Modo grupo: todos os rostos do quadro, cada um com box, aluno reconhecido e status da frequência
+export async function recognizeGroup(imageDataURL) {
+    try {
+        const response = await fetch(`${API_BASE_URL}/recognize/group`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ image: imageDataURL })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Erro desconhecido ao reconhecer.');
+        }
+        return data;
+    } catch (error) {
+        console.error('Erro de rede ou ao enviar frame para reconhecimento em grupo:', error);
+        throw error;
+    }
+}
+
 export async function fetchAttendances(params) {
     const query = new URLSearchParams(params).toString();
     try {
@@ -84,10 +142,31 @@ export async function fetchAttendances(params) {
     }
 }
 
-export async function exportAttendancesCsv(params) {
-    const query = new URLSearchParams(params).toString();
+// Busca uma página de registros (paginação por cursor). Retorna { items, next_cursor }.
+export async function fetchAttendancesPage(params, cursor = null, limit = 100) {
+    const query = new URLSearchParams({ ...params, limit, ...(cursor ? { cursor } : {}) }).toString();
+    try {
+        const response = await fetch(`${API_BASE_URL}/attendances?${query}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return await response.json();
+    } catch (error) {
+        console.error('Erro ao buscar página de logs de frequência:', error);
+        throw error;
+    }
+}
+
+export async function exportAttendancesCsv(params, options = {}) {
+    // options.excel: separador ';' + BOM UTF-8; options.gzip: arquivo .csv.gz
+    const cleanedParams = Object.fromEntries(
+        Object.entries(params).filter(([, value]) => value !== '' && value !== null && value !== undefined)
+    );
+    if (options.excel) cleanedParams.excel = '1';
+    if (options.gzip) cleanedParams.gzip = '1';
+    const query = new URLSearchParams(cleanedParams).toString();
     // Abre em uma nova aba para iniciar o download
-    window.open(`<span class="math-inline">\{API\_BASE\_URL\}/attendances/export\_csv?</span>{query}`, '_blank');
+    window.open(`${API_BASE_URL}/attendances/export_csv?${query}`, '_blank');
 }
 
 export async function fetchStudentsBySchool(schoolUnitId) {
@@ -134,6 +213,25 @@ export async function updateStudentImage(matricula, imageDataURL) {
     }
 }
 
+export async function addStudentSamples(matricula, imageDataURLs) {
+    // Fotos extras do aluno: entram no modelo usado no reconhecimento, sem trocar a foto do cadastro
+    try {
+        const response = await fetch(`${API_BASE_URL}/students/${matricula}/samples`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ images: imageDataURLs })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Erro desconhecido ao adicionar fotos.');
+        }
+        return data;
+    } catch (error) {
+        console.error('Erro de rede ou ao enviar fotos extras:', error);
+        throw error;
+    }
+}
+
 export async function updateStudentInfo(matricula, studentData) {
     try {
         const response = await fetch(`${API_BASE_URL}/students/${matricula}`, {